@@ -1,13 +1,19 @@
 import streamlit as st
-import requests
-import google.generativeai as genai
 import pandas as pd
-import json
 import plotly.express as px
 import plotly.graph_objects as go
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+
+import modelos_ia
+from historial import obtener_historial
+from ingesta import cargar_reseñas_archivo
+from metricas import tendencias
+from notificaciones import obtener_cola_notificaciones
+from radar import (buscar_candidatos_negocio, validar_direccion, obtener_mercado, preparar_analisis, calcular_kpis,
+                   tareas_ia, lanzar_en_paralelo, recoger_resultados, resultados_listos, generar_analisis_exhaustivo,
+                   auditar_brecha, armar_resultado, clave_objetivo, clave_mercado, REPORTE_VACIO, SOV_NEUTRO)
+from planificador import estado_planificadores
+from sov_local import calcular_sov_local
+from trazas import abrir_traza, cerrar_traza, tramo
 
 # --- LISTA ESTÁTICA DE CATEGORÍAS (MVP REDUCIDO - SIN AEROPUERTO) ---
 CATEGORIAS_GOOGLE = [
@@ -45,291 +51,200 @@ except Exception as e:
     st.stop()
 
 
-# --- FUNCIONES DE NOTIFICACIÓN Y ARCHIVOS ---
-def enviar_notificacion(usuario_email, tipo_busqueda, detalle, radio, coordenadas):
-    destinatario = "Mnsamame@gmail.com"
-    asunto = f"🔔 Nuevo Lead Radar CX: {tipo_busqueda}"
-    mensaje = f"""
-    Hola Matías,
-    Un nuevo usuario ha ejecutado una auditoría.
-
-    👤 Email: {usuario_email}
-    🔍 Tipo: {tipo_busqueda}
-    🏢 Detalle: {detalle}
-    📍 Ubicación: {coordenadas}
-    📏 Radio: {radio} km
-    """
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_SENDER
-        msg['To'] = destinatario
-        msg['Subject'] = asunto
-        msg.attach(MIMEText(mensaje, 'plain'))
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_SENDER, destinatario, text)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Error mail: {e}")
-        return False
-
-
-def cargar_reseñas_archivo(file):
-    try:
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
-        cols = [c.lower() for c in df.columns]
-        target_col = None
-        posibles_nombres = ['comentario', 'review', 'opinión', 'opinion', 'texto', 'feedback', 'mensaje']
-        for candidato in posibles_nombres:
-            matches = [c for c in cols if candidato in c]
-            if matches:
-                target_col = df.columns[cols.index(matches[0])]
-                break
-        if target_col:
-            return df[target_col].dropna().astype(str).tolist()
-        else:
-            return []
-    except:
-        return []
-
-
-# --- FUNCIONES API GOOGLE ---
-
-def buscar_candidatos_negocio(query, api_key):
-    """Búsqueda por nombre de negocio (Modo 1)"""
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {"Content-Type": "application/json", "X-Goog-Api-Key": api_key,
-               "X-Goog-FieldMask": "places.displayName,places.formattedAddress"}
-    data = {"textQuery": query, "pageSize": 5, "languageCode": "es"}
-    try:
-        return requests.post(url, headers=headers, json=data).json().get('places', [])
-    except:
-        return []
-
-
-def validar_direccion(direccion_input, api_key):
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-Api-Key": api_key,
-        "X-Goog-FieldMask": "places.formattedAddress,places.location"
-    }
-    data = {"textQuery": direccion_input, "pageSize": 1, "languageCode": "es"}
-    try:
-        resp = requests.post(url, headers=headers, json=data)
-        lugares = resp.json().get('places', [])
-        if lugares: return lugares[0]
-        return None
-    except:
-        return None
-
-
-def buscar_mercado_por_rubro(lat, lng, rubro, radio_km, api_key):
-    """
-    Trae DETALLE de los primeros 20 para análisis cualitativo.
-    """
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-Api-Key": api_key,
-        "X-Goog-FieldMask": "places.displayName,places.formattedAddress,places.rating,places.userRatingCount,places.reviews,places.primaryTypeDisplayName,places.googleMapsUri,places.location,places.editorialSummary,places.priceLevel,places.websiteUri"
-    }
-
-    radio_metros = radio_km * 1000.0
-    parametros = {
-        "textQuery": rubro,
-        "pageSize": 20,
-        "languageCode": "es",
-        "locationBias": {
-            "circle": {
-                "center": {"latitude": lat, "longitude": lng},
-                "radius": radio_metros
-            }
-        }
-    }
-    try:
-        resp = requests.post(url, headers=headers, json=parametros)
-        return resp.json().get('places', [])
-    except:
-        return []
-
-
-def buscar_detalle_target_y_competencia(lugar_seleccionado, radio_km, api_key):
-    nombre = lugar_seleccionado['displayName']['text']
-    direccion = lugar_seleccionado['formattedAddress']
-
-    url = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-Api-Key": api_key,
-        "X-Goog-FieldMask": "places.displayName,places.formattedAddress,places.rating,places.userRatingCount,places.reviews,places.primaryTypeDisplayName,places.googleMapsUri,places.location,places.editorialSummary,places.priceLevel,places.websiteUri"
-    }
-    resp_target = requests.post(url, headers=headers,
-                                json={"textQuery": f"{nombre} {direccion}", "pageSize": 1, "languageCode": "es"})
-
-    data_target = resp_target.json().get('places', [])
-    if not data_target: return None, None, None
-
-    target_obj = data_target[0]
-    rubro = target_obj.get('primaryTypeDisplayName', {}).get('text', 'Comercio')
-    loc = target_obj.get('location', {})
-
-    mercado = buscar_mercado_por_rubro(loc['latitude'], loc['longitude'], rubro, radio_km, api_key)
-
-    return target_obj, mercado, rubro
-
-
-# --- FUNCIONES IA (GEMINI) ---
-
-def generar_resumenes_batch(lista_negocios, api_key):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash', generation_config={"response_mime_type": "application/json"})
-    prompt = "Analiza opiniones y resume en 1 frase (máx 20 palabras) cada ítem.\n\n"
-    mapa = {}
-    for i, neg in enumerate(lista_negocios):
-        nom = neg.get('displayName', {}).get('text')
-        revs = " | ".join([r.get('text', {}).get('text', '') for r in neg.get('reviews', [])][:5])
-        pid = f"ID_{i}"
-        prompt += f"ITEM {pid} ({nom}): {revs or '(Sin datos)'}\n"
-        mapa[pid] = nom
-    prompt += "OUTPUT JSON: { 'ID_0': '...', ... }"
-    try:
-        res = json.loads(model.generate_content(prompt).text)
-        if isinstance(res, list): res = {k: v for i in res for k, v in i.items()}
-        return {mapa[k]: v for k, v in res.items() if k in mapa}
-    except:
-        return {}
-
-
-def analizar_distribucion_topicos(texto, rubro, api_key):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash', generation_config={"response_mime_type": "application/json"})
-    prompt = f"""
-    Analiza reseñas de {rubro}:
-    {texto[:15000]} 
-    Clasifica en 3 categorías y da % de Share of Voice.
-    1. Calidad (Producto/Servicio).
-    2. Conveniencia (Precio/Valor).
-    3. Atención (Servicio al cliente).
-    OUTPUT JSON: {{ "Calidad": int, "Conveniencia": int, "Atención": int }}
-    """
-    default_data = {"Calidad": 33, "Conveniencia": 33, "Atención": 34}
-    try:
-        response = model.generate_content(prompt)
-        parsed = json.loads(response.text)
-        if isinstance(parsed, list):
-            if len(parsed) > 0 and isinstance(parsed[0], dict):
-                return parsed[0]
-            else:
-                return default_data
-        elif isinstance(parsed, dict):
-            return parsed
-        else:
-            return default_data
-    except:
-        return default_data
-
-
-def generar_analisis_exhaustivo(texto_mercado, texto_lideres, rubro, api_key):
-    """
-    Genera el reporte ejecutivo.
-    CAMBIOS:
-    - Matriz con formato de lista de acciones (1. Empezar mañana...).
-    - Títulos más chicos.
-    - Sin emojis en la matriz.
-    - Basado 100% en evidencia del texto.
-    """
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash', generation_config=genai.GenerationConfig(temperature=0.15))
-
-    prompt = f"""
-    ROL: Estratega de Negocios Senior.
-    OBJETIVO: Decodificar el consumidor de **{rubro}** y definir prioridades basadas EXCLUSIVAMENTE en la evidencia leída.
-
-    DATOS:
-    [MERCADO]: {texto_mercado[:22000]}
-    [LÍDERES]: {texto_lideres}
-
-    ---
-    INSTRUCCIONES DE ESTILO:
-    1. EMOJIS: Solo permitidos en los títulos principales (##). PROHIBIDOS en el resto.
-    2. FORMATO: Markdown profesional.
-    3. FUENTE: No inventes consejos genéricos. Si recomiendas algo, debe ser porque lo leíste en las reseñas.
-
-    ---
-    ESTRUCTURA DEL REPORTE:
-
-    ## 🧠 Psicología del Consumidor
-
-    * **Lo que obsesiona al cliente (Valores Positivos):** (Qué genera euforia según las reseñas).
-    * **Lo que irrita al cliente (Fricciones Reales):** (Qué quejas se repiten).
-
-    ### 🔥 Los 3 Motores de Decisión
-    1.  **[Driver 1]**: Explicación.
-    2.  **[Driver 2]**: Explicación.
-    3.  **[Driver 3]**: Explicación.
+# --- MODELO IA (una vez por proceso) ---
+@st.cache_resource
+def inicializar_ia(api_key, modelo):
+    """Fija el modelo configurado y precalienta los handles y la conexión con Gemini."""
+    modelos_ia.configurar_modelo(modelo)
+    modelos_ia.calentar(api_key)
+    return modelo
 
-    ## 🏆 Benchmarking: Lecciones de los Líderes
-    *(Usa la info de LÍDERES. Si no hay, indícalo).*
 
-    ### [Nombre del Negocio]
-    * **Por qué gana:** (Propuesta de valor).
-    * **Precios:** (Percepción del cliente).
-    * **Clave del éxito:** (Aprendizaje).
+inicializar_ia(GEMINI_API_KEY, st.secrets.get("GEMINI_MODEL", modelos_ia.MODELO_POR_DEFECTO))
 
-    ### 💎 Hallazgo de Nicho
-    * **Insight:** [Detalle sutil valorado en la zona].
 
-    ## 🚀 Matriz de Priorización (Basada en Reseñas)
-
-    * **1. Empezar mañana [imperativo]:** (Cuál es la queja más grave y frecuente en la zona que se debe resolver YA. Sé específico).
-
-    * **2. Priorizar en las próximas semanas [diferencial]:** (Qué característica de los líderes es la que más envidian los clientes y deberíamos copiar).
-
-    * **3. No atender por ahora [ahorrar esfuerzo]:** (Menciona algo que los dueños suelen creer importante, pero que en estas reseñas NADIE mencionó o valoró. Ayuda a no gastar dinero en vano).
+# --- FUNCIONES DE NOTIFICACIÓN ---
+def enviar_notificacion(usuario_email, tipo_busqueda, detalle, radio, coordenadas):
+    """Encola el aviso del lead: lo envía un worker en segundo plano, la auditoría no espera al SMTP."""
+    cola = obtener_cola_notificaciones(EMAIL_SENDER, EMAIL_PASSWORD)
+    return cola.encolar({"usuario_email": usuario_email, "tipo_busqueda": tipo_busqueda, "detalle": detalle,
+                         "radio": radio, "coordenadas": coordenadas})
+
+
+# --- DIAGNÓSTICO ---
+def mostrar_diagnostico(traza_auditoria):
+    """Panel lateral con los tramos de la última auditoría y el estado de las colas de las APIs."""
+    columnas = ["tramo", "desde_ms", "duracion_ms", "cache_hit", "coalescido", "bytes", "tokens_entrada",
+                "tokens_salida", "hilo", "error"]
+    df_tramos = pd.DataFrame(traza_auditoria.a_dict()["tramos"]).reindex(columns=columnas)
+    with st.sidebar.expander("🩺 Diagnóstico", expanded=True):
+        st.metric("Auditoría completa", f"{traza_auditoria.duracion_ms / 1000:.1f} s")
+        st.dataframe(df_tramos.dropna(axis=1, how="all"), hide_index=True, use_container_width=True)
+        st.dataframe(pd.DataFrame(estado_planificadores()), hide_index=True, use_container_width=True)
+        st.caption(f"Traza {traza_auditoria.id}")
+
+
+# --- RENDER DE RESULTADOS (sin llamadas de red: dibuja desde el resultado guardado) ---
+FUENTES_SOV = {"local": "Léxico local, ponderado por volumen de opiniones.", "ia": "Clasificado por IA."}
+
+
+def armar_dataframe(lugares, resumenes, pendiente=False):
+    """Filas de la tabla. Con pendiente=True, los resúmenes que faltan todavía se están generando."""
+    sin_resumen = "Analizando..." if pendiente else "—"
+    df_data = []
+    for fila in lugares:
+        df_data.append({
+            "Negocio": fila["negocio"],
+            "Rating": fila["rating"],
+            "Opiniones": fila["opiniones"],
+            "Distancia (km)": fila["distancia_km"],
+            "Tipo": fila["tipo"],
+            "Rubro": ", ".join(fila["rubros"]),
+            "Resumen IA": resumenes.get(fila["negocio"], sin_resumen),
+            "Link": fila["link"],
+            "Rating_Visual": max(fila["rating"], 3.5)
+        })
+    return pd.DataFrame(df_data).sort_values("Rating", ascending=False)
+
+
+def dibujar_tabla(res, df):
+    # A) TABLA
+    st.divider()
+    st.subheader(f"📍 Radar de Mercado: {res['rubro']}")
+    columnas_tabla = ["Negocio", "Rating", "Opiniones", "Distancia (km)", "Resumen IA", "Link"]
+    if res["multi_rubro"]:
+        columnas_tabla.insert(1, "Rubro")
+    st.dataframe(df[columnas_tabla],
+                 column_config={"Link": st.column_config.LinkColumn("Maps", display_text="Ver"),
+                                "Rating": st.column_config.NumberColumn("⭐", format="%.1f"),
+                                "Distancia (km)": st.column_config.NumberColumn(format="%.2f")},
+                 hide_index=True, use_container_width=True)
+    if res["fuera_de_radio"]:
+        st.caption(f"Se descartaron {res['fuera_de_radio']} negocios que la API devolvió fuera del radio "
+                   f"de {res['radio']} km.")
+
+    # --- SECCIÓN DE MÉTRICAS (KPIs) ---
+    kpis = res["kpis"]
+    st.markdown("##### 🔢 Métricas de la Muestra")
+    k1, k2, k3, k4, k5 = st.columns(5)
+
+    with k1:
+        st.metric("Negocios en Radar", kpis["label_negocios"],
+                  help="Cantidad de negocios encontrados en el radio (Top 20 por relevancia, "
+                       "o todos en modo exhaustivo).")
+    with k2:
+        st.metric("Rating Promedio", f"{kpis['prom_simple']:.2f} ⭐",
+                  help="Promedio simple de calificaciones.")
+    with k3:
+        st.metric("Rating Ponderado", f"{kpis['prom_ponderado']:.2f} ⭐",
+                  help="Promedio considerando el volumen de reseñas "
+                       "(da más peso a negocios con más opiniones).")
+    with k4:
+        st.metric("Volumen Histórico", f"{kpis['total_reviews']:,}",
+                  help="Suma total de reseñas históricas de estos negocios.")
+    with k5:
+        st.metric("Reseñas Analizadas", f"{kpis['total_reviews_analizadas']}",
+                  help="Cantidad de textos de reseñas leídos por la IA para este análisis.")
+
+
+def dibujar_graficos(res, df, sov_pendiente=False):
+    # B) GRÁFICOS
+    st.divider()
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        st.markdown("#### 🎯 Mapa de Calidad vs. Madurez")
+        # CAMBIO: GRÁFICO MEJORADO YAXIS
+        fig = px.scatter(df, x="Opiniones", y="Rating_Visual", color="Tipo", text="Negocio", log_x=True,
+                         color_discrete_map={"MI NEGOCIO": "#1E88E5", "COMPETENCIA": "#90A4AE"},
+                         template='plotly_white')  # TEMPLATE BLANCO
+
+        fig.update_traces(textposition='top center', marker=dict(size=12, line=dict(width=1, color='gray')))
+        # AUMENTO RANGO Y PARA QUE ENTREN ETIQUETAS DE 5 ESTRELLAS
+        fig.update_layout(height=400, yaxis=dict(range=[3.0, 5.4]), margin=dict(t=50, l=20, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+
+    with c2:
+        st.markdown("#### 🗣️ Share of Voice")
+        dist_topicos = res["topicos"]
+        if isinstance(dist_topicos, list): dist_topicos = dist_topicos[0] if len(dist_topicos) > 0 else {}
+        labels, values = list(dist_topicos.keys()), list(dist_topicos.values())
+        fig_pie = go.Figure(data=[
+            go.Pie(labels=labels, values=values, hole=.4,
+                   marker=dict(colors=["#66BB6A", "#FFA726", "#42A5F5"]))])
+        fig_pie.update_layout(height=400, showlegend=True, legend=dict(orientation="h", y=-0.2))
+        st.plotly_chart(fig_pie, use_container_width=True)
+        st.caption(FUENTES_SOV.get(res["fuente_sov"], "") + (" Confirmando con IA..." if sov_pendiente else ""))
+
+
+def dibujar_tendencias(res):
+    # E) TENDENCIAS (historial local de auditorías de esta misma zona: sin red)
+    with tramo("tendencias"):
+        evolucion = tendencias(obtener_historial().leer(res["mercado"]))
+    if len(evolucion) < 2:
+        st.caption("📈 Las tendencias del mercado aparecen desde la segunda auditoría de esta zona.")
+        return
+    st.divider()
+    st.markdown("#### 📈 Tendencias del Mercado")
+    t1, t2, t3 = st.columns(3)
+    with t1:
+        fig = go.Figure([
+            go.Scatter(x=evolucion["momento"], y=evolucion["p75"], line=dict(width=0), showlegend=False,
+                       hoverinfo="skip"),
+            go.Scatter(x=evolucion["momento"], y=evolucion["p25"], line=dict(width=0), fill="tonexty",
+                       fillcolor="rgba(144,164,174,0.25)", name="P25–P75"),
+            go.Scatter(x=evolucion["momento"], y=evolucion["prom_ponderado"], name="Ponderado",
+                       line=dict(color="#90A4AE")),
+            go.Scatter(x=evolucion["momento"], y=evolucion["prom_bayesiano"], name="Bayesiano",
+                       line=dict(color="#66BB6A", dash="dot")),
+        ])
+        if "objetivo_rating" in evolucion:
+            fig.add_scatter(x=evolucion["momento"], y=evolucion["objetivo_bayesiano"], name="Mi negocio",
+                            line=dict(color="#1E88E5", width=3))
+        fig.update_layout(title="Rating del mercado", height=320, template="plotly_white",
+                          margin=dict(t=50, l=20, r=20, b=20), legend=dict(orientation="h", y=-0.25))
+        st.plotly_chart(fig, use_container_width=True)
+    with t2:
+        fig = px.bar(evolucion, x="momento", y="velocidad_mercado", template="plotly_white",
+                     labels={"momento": "", "velocidad_mercado": "Reseñas nuevas por día"})
+        fig.update_traces(marker_color="#42A5F5")
+        fig.update_layout(title="Velocidad de reseñas", height=320, margin=dict(t=50, l=20, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+    with t3:
+        fig = px.line(evolucion, x="momento", y="rotacion_lideres", markers=True, template="plotly_white",
+                      labels={"momento": "", "rotacion_lideres": "Recambio del Top 3"})
+        fig.update_traces(line_color="#FFA726")
+        fig.update_layout(title="Rotación de líderes", height=320, yaxis=dict(range=[0, 1.05], tickformat=".0%"),
+                          margin=dict(t=50, l=20, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"{len(evolucion)} auditorías de esta zona. Bayesiano: rating suavizado por volumen de opiniones.")
+
+
+def intercalar_resultados(fragmentos, lote, aplicar):
     """
-
-    try:
-        response = model.generate_content(prompt)
-        return response.text.replace("```markdown", "").replace("```", "").strip()
-    except Exception as e:
-        return f"Error: {e}"
-
-
-def analizar_brecha_mercado_vs_archivo(texto_mercado, reviews_propias, nombre, rubro, api_key):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash', generation_config=genai.GenerationConfig(temperature=0.2))
-    prompt = f"""
-    Auditor CX Gap Analysis para {nombre}.
-    Mercado: {texto_mercado[:10000]}
-    Negocio: {" | ".join(reviews_propias[:500])}
-
-    Regla Ponderación: <10% quejas = ✅, 10-30% = ⚠️, >30% = ❌.
-
-    Reporte Markdown:
-    ## ⚖️ Auditoría: Realidad vs Expectativa
-    ### 1. Matriz Cumplimiento
-    | Exigencia | Desempeño (Resumen + 1 Cita) | Veredicto |
-    | :--- | :--- | :--- |
-    | [Exigencia 1] | ... | ... |
-    | [Exigencia 2] | ... | ... |
-    ### 2. Análisis
-    * Fortaleza: ...
-    * Mejora: ...
-    ### 3. Veredicto Final
-    Alineado/Desalineado porque...
+    Deja pasar el stream del reporte y, entre fragmento y fragmento, aplica las tareas de fondo que ya terminaron:
+    la tabla y los gráficos se completan mientras el reporte se sigue escribiendo.
     """
-    try:
-        texto = model.generate_content(prompt).text
-        return texto.replace("```markdown", "").replace("```", "").strip()
-    except Exception as e:
-        return f"Error: {e}"
+    aplicados = set()
+    for frag in fragmentos:
+        for nombre, valor in resultados_listos(lote, aplicados).items():
+            aplicados.add(nombre)
+            aplicar(nombre, valor)
+        yield frag
+    for nombre, valor in recoger_resultados(lote).items():
+        if nombre not in aplicados:
+            aplicar(nombre, valor)
+
+
+def dibujar_encabezado_reporte():
+    # C) REPORTE
+    st.divider()
+    st.markdown("## 🧠 Inteligencia de Mercado")
+
+
+def dibujar_encabezado_auditoria():
+    # D) AUDITORÍA
+    st.divider()
+    st.markdown("## ⚖️ Auditoría Privada")
 
 
 # --- INTERFAZ ---
@@ -337,6 +252,19 @@ with st.sidebar:
     st.header("🔐 Acceso")
     st.info("Ingresa tu correo para desbloquear.")
     email_usuario = st.text_input("Tu Email", placeholder="usuario@empresa.com")
+    forzar_ia = st.checkbox("Regenerar análisis IA (ignorar caché)", value=False,
+                            help="Por defecto se reutilizan los análisis de IA ya generados para los mismos datos.")
+    modo_exhaustivo = st.checkbox("Búsqueda exhaustiva (todo el radio)", value=False,
+                                  help="Recorre el radio por zonas y pagina los resultados: supera el tope de 20 "
+                                       "negocios de la API, a cambio de más consultas.")
+    modo_incremental = st.checkbox("Refresco incremental (reusa auditorías anteriores)", value=False,
+                                   help="Compara rating y cantidad de opiniones con la última auditoría y sólo vuelve "
+                                        "a pedir reseñas (y resúmenes IA) de los negocios que cambiaron.")
+    confirmar_sov_ia = st.checkbox("Confirmar Share of Voice con IA", value=False,
+                                   help="El Share of Voice se calcula al instante con un léxico local. "
+                                        "Activalo para pedirle además la clasificación a Gemini.")
+    ver_diagnostico = st.checkbox("🩺 Diagnóstico de rendimiento", value=False,
+                                  help="Muestra cuánto tardó cada etapa de la auditoría (Places, IA, tabla, gráficos).")
     # YA NO HAY UPLOADER ACÁ
 
 st.title("📊 Qué pretende usted de mí?")
@@ -421,6 +349,7 @@ with tab2:
         st.warning("⚠️ Debes seleccionar al menos una categoría.")
 
 exec_params = None
+params_actuales = None  # lo que se auditaría con los controles tal como están ahora
 
 # LÓGICA DE EJECUCIÓN (CON LOS BOTONES YA PRESIONADOS ARRIBA O CONFIRMACIÓN)
 # Nota: La lógica anterior tenía un segundo botón "Iniciar Auditoría" después de validar.
@@ -431,218 +360,152 @@ if st.session_state.modo_seleccionado == "negocio" and st.session_state.resultad
     opts = {f"{c['displayName']['text']} - {c.get('formattedAddress', '')}": c for c in
             st.session_state.resultados_busqueda}
     sel = st.selectbox("Selecciona tu negocio:", list(opts.keys()))
+    params_actuales = {"type": "negocio", "data": opts[sel], "radio": r_negocio}
     if st.button("Confirmar y Analizar", type="primary", key="btn_conf_neg"):
-        exec_params = {"type": "negocio", "data": opts[sel], "radio": r_negocio}
+        exec_params = params_actuales
 
 if st.session_state.modo_seleccionado == "rubro" and st.session_state.direccion_validada:
     st.divider()
     rubros_str_user = ", ".join(st.session_state.rubro_actual)
     st.info(f"Analizando **{rubros_str_user}** en radio de **{r_rubro} km**.")
-    if st.button("Confirmar y Analizar", type="primary", key="btn_conf_rubro"):
-        exec_params = {"type": "rubro", "data": st.session_state.direccion_validada,
+    params_actuales = {"type": "rubro", "data": st.session_state.direccion_validada,
                        "rubro": st.session_state.rubro_actual, "radio": r_rubro}
+    if st.button("Confirmar y Analizar", type="primary", key="btn_conf_rubro"):
+        exec_params = params_actuales
+
+# RESULTADO GUARDADO: sobrevive a los reruns; se invalida si cambia el negocio, la dirección o los rubros
+guardado = st.session_state.get("auditoria")
+if guardado and (params_actuales is None or clave_objetivo(params_actuales) != guardado["objetivo"]):
+    st.session_state.auditoria = guardado = None
 
 if exec_params:
+    st.session_state.auditoria = guardado = None
+    traza_auditoria = abrir_traza("auditoria", tipo=exec_params["type"], radio=exec_params["radio"],
+                                  exhaustivo=modo_exhaustivo, incremental=modo_incremental)
     with st.spinner("🤖 Activando satélites e IA..."):
-        target_obj = None
-        mercado_data = []
-        rubro_final_str = ""
-        lat_central = 0
-        lng_central = 0
-
         # 1. OBTENCIÓN DE DATOS
-        if exec_params["type"] == "negocio":
-            target_obj, mercado_data, rubro_detectado = buscar_detalle_target_y_competencia(
-                exec_params["data"], exec_params["radio"], GOOGLE_API_KEY
-            )
-            rubro_final_str = rubro_detectado
-            det = f"Negocio: {target_obj.get('displayName', {}).get('text')}"
-            lat_central = target_obj['location']['latitude']
-            lng_central = target_obj['location']['longitude']
-
-        elif exec_params["type"] == "rubro":
-            loc = exec_params["data"]["location"]
-            lista_rubros = exec_params["rubro"]
-            rubro_final_str = " o ".join(lista_rubros)
-
-            lat_central = loc['latitude']
-            lng_central = loc['longitude']
-
-            mercado_data = buscar_mercado_por_rubro(
-                lat_central, lng_central, rubro_final_str, exec_params["radio"], GOOGLE_API_KEY
-            )
-            target_obj = None
-            det = f"Rubros: {rubro_final_str} en {exec_params['data']['formattedAddress']}"
-
-        if not mercado_data:
+        datos = obtener_mercado(exec_params, GOOGLE_API_KEY, exhaustivo=modo_exhaustivo, incremental=modo_incremental)
+        if not datos:
+            cerrar_traza(traza_auditoria)
             st.error("No se encontró información suficiente.")
             st.stop()
 
         # Enviar Mail
-        coord_m = f"{lat_central},{lng_central}"
-        enviar_notificacion(email_usuario, exec_params["type"], det, exec_params["radio"], coord_m)
-
-        # UNIFICAR LISTA VISUAL
-        lista_final = []
-        vistos = set()
-        if target_obj:
-            lista_final.append(target_obj)
-            vistos.add(target_obj.get('formattedAddress'))
-        for m in mercado_data:
-            if m.get('formattedAddress') not in vistos:
-                lista_final.append(m)
-                vistos.add(m.get('formattedAddress'))
-
-        lista_visual = lista_final[:15]
-
-        # LÍDERES
-        candidatos_lideres = [m for m in mercado_data if m.get('userRatingCount', 0) >= 100]
-        candidatos_lideres.sort(key=lambda x: x.get('rating', 0), reverse=True)
-        top_lideres = candidatos_lideres[:3]
-
-        texto_lideres = ""
-        if top_lideres:
-            for i, l in enumerate(top_lideres):
-                nom = l.get('displayName', {}).get('text', 'N/A')
-                rt = l.get('rating', 0)
-                cnt = l.get('userRatingCount', 0)
-                desc = l.get('editorialSummary', {}).get('text', 'Sin descripción.')
-                precio = l.get('priceLevel', 'N/A')
-                revs = " ".join([r.get('text', {}).get('text', '') for r in l.get('reviews', [])][:3])
-
-                texto_lideres += f"""
-                [LÍDER {i + 1}]
-                Nombre: {nom}
-                Rating: {rt} ({cnt} reviews)
-                Descripción: {desc}
-                Precio: {precio}
-                Opiniones recientes: {revs}
-                """
+        coord_m = f"{datos['lat']},{datos['lng']}"
+        with tramo("notificacion.encolar"):
+            enviar_notificacion(email_usuario, exec_params["type"], datos["detalle"], exec_params["radio"], coord_m)
+
+        datos = preparar_analisis(datos)
+
+        # Share of Voice local (léxico, ponderado por volumen de opiniones): instantáneo y sin costo
+        with tramo("sov_local"):
+            dist_topicos = calcular_sov_local(datos["lista_visual"], datos["excluir"]) or SOV_NEUTRO
+
+        # 2. LO QUE SALE DE PLACES SE MUESTRA YA; LA IA COMPLETA DESPUÉS
+        guardado = armar_resultado(datos, calcular_kpis(datos, modo_exhaustivo), {}, REPORTE_VACIO, dist_topicos,
+                                   "local")
+        guardado.update({
+            "objetivo": clave_objetivo(exec_params),
+            "mercado": datos["clave"],
+            "firma": (clave_mercado(exec_params, modo_exhaustivo), confirmar_sov_ia),
+            "radio": exec_params["radio"],
+            "multi_rubro": exec_params["type"] == "rubro" and len(exec_params["rubro"]) > 1,
+            "texto_mercado_brecha": datos["texto_mercado_brecha"],
+            "archivo": None,
+        })
+        ia_activa = bool(GEMINI_API_KEY)
+        sov_pendiente = ia_activa and confirmar_sov_ia
+
+        # SECCIONES (se llenan en orden de llegada, se muestran en este orden)
+        seccion_tabla = st.empty()
+        seccion_graficos = st.empty()
+        seccion_tendencias = st.container()
+        seccion_reporte = st.container()
+
+        def dibujar_seccion_tabla(pendiente):
+            with tramo("dataframe"):
+                df = armar_dataframe(guardado["lugares"], guardado["resumenes"], pendiente)
+            with seccion_tabla.container(), tramo("render.tabla"):
+                dibujar_tabla(guardado, df)
+            return df
+
+        def dibujar_seccion_graficos(df, pendiente):
+            with seccion_graficos.container(), tramo("render.graficos"):
+                dibujar_graficos(guardado, df, pendiente)
+
+        df = dibujar_seccion_tabla(ia_activa)
+        dibujar_seccion_graficos(df, sov_pendiente)
+        with seccion_tendencias:
+            dibujar_tendencias(guardado)
+
+        if ia_activa:
+            # IA: resúmenes y Share of Voice en segundo plano mientras el reporte se escribe en pantalla
+            lote_ia = lanzar_en_paralelo(tareas_ia(datos, GEMINI_API_KEY, not forzar_ia, confirmar_sov_ia,
+                                                   incluir_reporte=False, sov_respaldo=dist_topicos))
+
+            def aplicar(nombre, valor):
+                if nombre == "resumenes":
+                    guardado["resumenes"] = valor
+                    dibujar_seccion_tabla(False)
+                elif nombre == "topicos":
+                    if valor is not dist_topicos:
+                        guardado["topicos"], guardado["fuente_sov"] = valor, "ia"
+                    dibujar_seccion_graficos(df, False)
+
+            # C) REPORTE (streaming)
+            with seccion_reporte:
+                dibujar_encabezado_reporte()
+                guardado["reporte"] = st.write_stream(intercalar_resultados(generar_analisis_exhaustivo(
+                    datos["texto_mercado"], datos["texto_lideres"], datos["rubro"], GEMINI_API_KEY, not forzar_ia,
+                    stream=True), lote_ia, aplicar))
         else:
-            texto_lideres = "No hay líderes consolidados."
-
-        # TEXTO MERCADO
-        texto_mercado = ""
-        t_name = target_obj.get('displayName', {}).get('text') if target_obj else "Tu Negocio"
-        for neg in lista_visual:
-            n_n = neg.get('displayName', {}).get('text')
-            if target_obj and n_n == t_name: continue
-            rs = [r.get('text', {}).get('text', '') for r in neg.get('reviews', [])]
-            if rs: texto_mercado += f"COMPETIDOR ({n_n}): {' '.join(rs)}\n\n"
-
-        # IA
-        resumenes = {}
-        if GEMINI_API_KEY:
-            resumenes = generar_resumenes_batch(lista_visual, GEMINI_API_KEY)
-            analisis_experto = generar_analisis_exhaustivo(texto_mercado, texto_lideres, rubro_final_str,
-                                                           GEMINI_API_KEY)
-            dist_topicos = analizar_distribucion_topicos(texto_mercado, rubro_final_str, GEMINI_API_KEY)
-
-        # DATAFRAME
-        df_data = []
-        for n in lista_visual:
-            nom = n.get('displayName', {}).get('text')
-            tipo = "MI NEGOCIO" if (target_obj and nom == t_name) else "COMPETENCIA"
-            df_data.append({
-                "Negocio": nom,
-                "Rating": n.get('rating', 0.0),
-                "Opiniones": n.get('userRatingCount', 0),
-                "Tipo": tipo,
-                "Resumen IA": resumenes.get(nom, "Analizando..."),
-                "Link": n.get('googleMapsUri', '#'),
-                "Rating_Visual": max(n.get('rating', 0.0), 3.5)
-            })
-        df = pd.DataFrame(df_data).sort_values("Rating", ascending=False)
-
-        # A) TABLA
-        st.divider()
-        st.subheader(f"📍 Radar de Mercado: {rubro_final_str}")
-        st.dataframe(df[["Negocio", "Rating", "Opiniones", "Resumen IA", "Link"]],
-                     column_config={"Link": st.column_config.LinkColumn("Maps", display_text="Ver"),
-                                    "Rating": st.column_config.NumberColumn("⭐", format="%.1f")},
-                     hide_index=True, use_container_width=True)
-
-        # --- SECCIÓN DE MÉTRICAS (KPIs) ---
-
-        total_negocios = len(lista_visual)
-        suma_rating = 0
-        suma_ponderada = 0
-        total_reviews = 0
-        total_reviews_analizadas = 0
-
-        for n in lista_visual:
-            rt = n.get('rating', 0)
-            cnt = n.get('userRatingCount', 0)
-            revs_disponibles = len(n.get('reviews', []))
-
-            suma_rating += rt
-            suma_ponderada += (rt * cnt)
-            total_reviews += cnt
-            total_reviews_analizadas += revs_disponibles
-
-        prom_simple = suma_rating / total_negocios if total_negocios > 0 else 0
-        prom_ponderado = suma_ponderada / total_reviews if total_reviews > 0 else 0
-
-        label_negocios = f"{total_negocios}"
-        if total_negocios >= 20: label_negocios = "20 (Máx. API)"
-
-        st.markdown("##### 🔢 Métricas de la Muestra")
-        k1, k2, k3, k4, k5 = st.columns(5)
-
-        with k1:
-            st.metric("Negocios en Radar", label_negocios,
-                      help="Cantidad de negocios encontrados en el radio (Top 20 por relevancia).")
-        with k2:
-            st.metric("Rating Promedio", f"{prom_simple:.2f} ⭐", help="Promedio simple de calificaciones.")
-        with k3:
-            st.metric("Rating Ponderado", f"{prom_ponderado:.2f} ⭐",
-                      help="Promedio considerando el volumen de reseñas (da más peso a negocios con más opiniones).")
-        with k4:
-            st.metric("Volumen Histórico", f"{total_reviews:,}",
-                      help="Suma total de reseñas históricas de estos negocios.")
-        with k5:
-            st.metric("Reseñas Analizadas", f"{total_reviews_analizadas}",
-                      help="Cantidad de textos de reseñas leídos por la IA para este análisis.")
-
-        # B) GRÁFICOS
-        st.divider()
-        c1, c2 = st.columns([2, 1])
-        with c1:
-            st.markdown("#### 🎯 Mapa de Calidad vs. Madurez")
-            # CAMBIO: GRÁFICO MEJORADO YAXIS
-            fig = px.scatter(df, x="Opiniones", y="Rating_Visual", color="Tipo", text="Negocio", log_x=True,
-                             color_discrete_map={"MI NEGOCIO": "#1E88E5", "COMPETENCIA": "#90A4AE"},
-                             template='plotly_white')  # TEMPLATE BLANCO
-
-            fig.update_traces(textposition='top center', marker=dict(size=12, line=dict(width=1, color='gray')))
-            # AUMENTO RANGO Y PARA QUE ENTREN ETIQUETAS DE 5 ESTRELLAS
-            fig.update_layout(height=400, yaxis=dict(range=[3.0, 5.4]), margin=dict(t=50, l=20, r=20, b=20))
-            st.plotly_chart(fig, use_container_width=True)
-
-        with c2:
-            st.markdown("#### 🗣️ Share of Voice")
-            if isinstance(dist_topicos, list): dist_topicos = dist_topicos[0] if len(dist_topicos) > 0 else {}
-            labels, values = list(dist_topicos.keys()), list(dist_topicos.values())
-            fig_pie = go.Figure(data=[
-                go.Pie(labels=labels, values=values, hole=.4, marker=dict(colors=["#66BB6A", "#FFA726", "#42A5F5"]))])
-            fig_pie.update_layout(height=400, showlegend=True, legend=dict(orientation="h", y=-0.2))
-            st.plotly_chart(fig_pie, use_container_width=True)
-
-        # C) REPORTE
-        st.divider()
-        st.markdown("## 🧠 Inteligencia de Mercado")
-        st.markdown(analisis_experto)
-
-        # D) AUDITORÍA
-        if uploaded_file:
-            st.divider()
-            st.markdown(f"## ⚖️ Auditoría Privada")
-            with st.spinner("Auditando..."):
-                rp = cargar_reseñas_archivo(uploaded_file)
-                if rp:
-                    st.markdown(analizar_brecha_mercado_vs_archivo(texto_mercado, rp, "Tu Archivo", rubro_final_str,
-                                                                   GEMINI_API_KEY))
-                else:
-                    st.error("Archivo inválido.")
-
-        st.success("Análisis completado.")
\ No newline at end of file
+            with seccion_reporte:
+                dibujar_encabezado_reporte()
+                st.markdown(guardado["reporte"])
+
+        st.session_state.auditoria = guardado
+
+    cerrar_traza(traza_auditoria)
+    st.session_state.ultima_traza = traza_auditoria
+
+elif guardado:
+    if guardado["firma"] != (clave_mercado(params_actuales, modo_exhaustivo), confirmar_sov_ia):
+        st.warning("⚠️ Cambiaste el radio o las opciones de análisis: estos resultados son del análisis anterior. "
+                   "Presioná **Confirmar y Analizar** para actualizarlos.")
+    df = armar_dataframe(guardado["lugares"], guardado["resumenes"])
+    dibujar_tabla(guardado, df)
+    dibujar_graficos(guardado, df)
+    dibujar_tendencias(guardado)
+    dibujar_encabezado_reporte()
+    st.markdown(guardado["reporte"])
+
+# D) AUDITORÍA: se calcula una vez por archivo, sin volver a consultar Places
+if guardado and uploaded_file:
+    archivo_actual = [uploaded_file.name, uploaded_file.size]
+    dibujar_encabezado_auditoria()
+    if guardado["archivo"] == archivo_actual and guardado["auditoria"]:
+        st.markdown(guardado["auditoria"])
+    else:
+        with st.spinner("Auditando..."):
+            barra = st.progress(0.0, text="Leyendo archivo...")
+            with tramo("ingesta") as t:
+                rp = cargar_reseñas_archivo(uploaded_file, progreso=lambda f: barra.progress(
+                    f, text=f"Leyendo archivo... {f:.0%}"))
+                t.update(bytes=uploaded_file.size, reseñas=len(rp))
+            barra.empty()
+            if rp:
+                barra = st.progress(0.0, text="Auditando reseñas...")
+                guardado["auditoria"] = auditar_brecha(
+                    guardado["texto_mercado_brecha"], rp, "Tu Archivo", guardado["rubro"], GEMINI_API_KEY,
+                    usar_cache=not forzar_ia, progreso=lambda f: barra.progress(f, text=f"Auditando... {f:.0%}"))
+                guardado["archivo"] = archivo_actual
+                barra.empty()
+                st.markdown(guardado["auditoria"])
+            else:
+                st.error("Archivo inválido.")
+
+if exec_params:
+    st.success("Análisis completado.")
+
+if ver_diagnostico and st.session_state.get("ultima_traza"):
+    mostrar_diagnostico(st.session_state.ultima_traza)
@@ -0,0 +1,176 @@
+"""
+Radar CX en lote: audita una cartera completa de negocios sin la interfaz.
+
+Entrada (CSV), una fila por auditoría:
+    id,negocio,direccion,rubros,radio
+    f001,"Antojos de Poeta, Córdoba",,,2.5               <- modo negocio (busca por nombre)
+    f002,,"Av. Colón 5000, Córdoba",Panadería|Pastelería,2  <- modo rubro (dirección + categorías)
+
+Uso:
+    GOOGLE_API_KEY=... GEMINI_API_KEY=... python batch.py cartera.csv -o resultados.jsonl
+    python batch.py cartera.csv -o resultados.parquet --concurrencia 8 --max-places 16 --max-gemini 6
+
+Cada auditoría terminada se agrega al instante al archivo de progreso (JSONL):
+si la corrida se corta, al relanzarla se saltean los ids ya auditados.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import modelos_ia
+import places_client
+from planificador import prioridad_actual, enviar, estado_planificadores, PRIORIDAD_LOTE
+from radar import buscar_candidatos_negocio, validar_direccion, ejecutar_auditoria
+
+RADIO_POR_DEFECTO_KM = 2.0
+
+
+def leer_objetivos(ruta):
+    """Filas del CSV de entrada normalizadas. Sin columna id, se usa el número de fila."""
+    objetivos = []
+    with open(ruta, newline='', encoding='utf-8-sig') as f:
+        for i, fila in enumerate(csv.DictReader(f), start=1):
+            fila = {k.strip().lower(): (v or "").strip() for k, v in fila.items() if k}
+            rubros = [r.strip() for r in fila.get("rubros", "").split("|") if r.strip()]
+            objetivos.append({
+                "id": fila.get("id") or str(i),
+                "negocio": fila.get("negocio", ""),
+                "direccion": fila.get("direccion", ""),
+                "rubros": rubros,
+                "radio": float(fila.get("radio") or RADIO_POR_DEFECTO_KM),
+            })
+    return objetivos
+
+
+def ruta_progreso(salida):
+    """El JSONL de salida es su propio checkpoint; para Parquet se usa un JSONL parcial al lado."""
+    return salida if salida.endswith(".jsonl") else salida + ".parcial.jsonl"
+
+
+ESTADOS_TERMINADOS = ("ok", "sin_datos")  # un "error" (timeout, 5xx...) se reintenta al reanudar
+
+
+def ids_completados(ruta):
+    """Ids cuyo último registro quedó terminado: una línea posterior reemplaza a las anteriores del mismo id."""
+    if not os.path.exists(ruta):
+        return set()
+    ultimo_estado = {}
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+                ultimo_estado[registro["id"]] = registro.get("estado")
+            except (ValueError, KeyError):
+                continue  # línea cortada por una interrupción: esa auditoría se repite
+    return {i for i, estado in ultimo_estado.items() if estado in ESTADOS_TERMINADOS}
+
+
+def armar_params(objetivo, google_api_key):
+    """Traduce una fila del CSV a los exec_params de la app (resolviendo negocio o dirección)."""
+    if objetivo["negocio"]:
+        candidatos = buscar_candidatos_negocio(objetivo["negocio"], google_api_key)
+        if not candidatos:
+            return None
+        return {"type": "negocio", "data": candidatos[0], "radio": objetivo["radio"]}
+    if objetivo["direccion"] and objetivo["rubros"]:
+        ubicacion = validar_direccion(objetivo["direccion"], google_api_key)
+        if not ubicacion:
+            return None
+        return {"type": "rubro", "data": ubicacion, "rubro": objetivo["rubros"], "radio": objetivo["radio"]}
+    return None
+
+
+def auditar_objetivo(objetivo, google_api_key, gemini_api_key, exhaustivo, usar_cache, incremental=False):
+    inicio = time.monotonic()
+    registro = {"id": objetivo["id"], "entrada": objetivo}
+    try:
+        params = armar_params(objetivo, google_api_key)
+        resultado = ejecutar_auditoria(params, google_api_key, gemini_api_key, exhaustivo=exhaustivo,
+                                       usar_cache=usar_cache, incremental=incremental) if params else None
+        if resultado is None:
+            registro.update({"estado": "sin_datos"})
+        else:
+            registro.update({"estado": "ok", **resultado})
+    except Exception as e:
+        registro.update({"estado": "error", "error": str(e)})
+    registro["duracion_seg"] = round(time.monotonic() - inicio, 2)
+    return registro
+
+
+def convertir_a_parquet(ruta_jsonl, ruta_parquet):
+    import pandas as pd
+
+    with open(ruta_jsonl, encoding='utf-8') as f:
+        registros = [json.loads(l) for l in f if l.strip()]
+    # Un id reintentado aparece más de una vez: vale su último registro
+    df = pd.DataFrame(registros).drop_duplicates("id", keep="last", ignore_index=True)
+    # Las columnas anidadas (lugares, kpis, resúmenes...) van como JSON para un esquema plano y estable
+    for col in df.columns:
+        if df[col].map(lambda v: isinstance(v, (dict, list))).any():
+            df[col] = df[col].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v)
+    df.to_parquet(ruta_parquet, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Radar CX en lote (sin interfaz).")
+    parser.add_argument("entrada", help="CSV con id,negocio,direccion,rubros,radio")
+    parser.add_argument("-o", "--salida", default="resultados.jsonl", help=".jsonl o .parquet")
+    parser.add_argument("--concurrencia", type=int, default=4, help="auditorías simultáneas")
+    parser.add_argument("--max-places", type=int, default=16, help="llamadas simultáneas a Places")
+    parser.add_argument("--max-gemini", type=int, default=6, help="llamadas simultáneas a Gemini")
+    parser.add_argument("--exhaustivo", action="store_true", help="búsqueda exhaustiva (todo el radio)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="refrescar sobre los snapshots anteriores (reseñas sólo de lo que cambió)")
+    parser.add_argument("--sin-cache", action="store_true", help="regenerar análisis IA")
+    args = parser.parse_args(argv)
+
+    google_api_key = os.environ.get("GOOGLE_API_KEY")
+    gemini_api_key = os.environ.get("GEMINI_API_KEY")
+    if not google_api_key:
+        print("⚠️ ERROR: Falta GOOGLE_API_KEY en el entorno.")
+        return 1
+
+    places_client.limitar_concurrencia(args.max_places)
+    modelos_ia.limitar_concurrencia(args.max_gemini)
+    modelos_ia.configurar_modelo(os.environ.get("GEMINI_MODEL"))
+    # El lote cede el paso: si la app comparte proceso, las auditorías interactivas se atienden primero
+    prioridad_actual.set(PRIORIDAD_LOTE)
+
+    progreso = ruta_progreso(args.salida)
+    hechos = ids_completados(progreso)
+    pendientes = [o for o in leer_objetivos(args.entrada) if o["id"] not in hechos]
+    print(f"📋 {len(hechos)} auditorías ya hechas, {len(pendientes)} pendientes.")
+
+    lock = threading.Lock()
+    terminados = 0
+    with open(progreso, "a", encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max(1, args.concurrencia)) as pool:
+        futuros = [enviar(pool, auditar_objetivo, o, google_api_key, gemini_api_key, args.exhaustivo,
+                          not args.sin_cache, args.incremental) for o in pendientes]
+        for fut in as_completed(futuros):
+            registro = fut.result()
+            with lock:
+                out.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                out.flush()
+                terminados += 1
+            print(f"[{terminados}/{len(pendientes)}] {registro['id']}: {registro['estado']} "
+                  f"({registro['duracion_seg']}s)")
+
+    if progreso != args.salida:
+        convertir_a_parquet(progreso, args.salida)
+        print(f"✅ Parquet escrito en {args.salida}")
+    else:
+        print(f"✅ Resultados en {args.salida}")
+    for estado in estado_planificadores():
+        print(f"⏱️ {estado['api']}: {estado['atendidas']} llamadas, {estado['espera_total_seg']}s en espera de cuota "
+              f"(máx. {estado['espera_max_seg']}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+Benchmark de punta a punta del pipeline de auditoría, sin gastar cuota real.
+
+Levanta en un proceso aparte un servidor HTTP local que imita:
+- Places API (New) places:searchText, sirviendo un fixture de N lugares (generado o grabado en JSON).
+- Gemini generateContent / streamGenerateContent, con latencia y jitter configurables.
+Corre el pipeline contra ese servidor y reporta p50/p95/p99 por etapa y de punta a punta, más el pico de memoria.
+Cada corrida se guarda en JSON; con --comparar se muestran las diferencias contra una corrida anterior.
+
+Uso:
+    python benchmark.py --tamanos 20 200 2000 --iteraciones 10 --exhaustivo -o bench/base.json
+    python benchmark.py --tamanos 200 --latencia-gemini-ms 1500 --jitter-gemini-ms 500 --comparar bench/base.json
+    python benchmark.py --fixture mercado_grabado.json --modo rubro --rubros Panadería Pastelería
+    python benchmark.py --tamanos 2000 --radio 0.5 --radio-fixture 0.5 --exhaustivo  # celdas saturadas
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+CENTRO = (-31.4201, -64.1888)  # Córdoba
+KM_POR_GRADO = 111.32
+RESULTADOS_MAX_CONSULTA = 60  # Places no entrega más de 3 páginas de 20 por consulta
+PERCENTILES = (50, 95, 99)
+
+FRASES_RESEÑAS = [
+    "Muy rica la comida y la atención excelente, volvería sin dudas.",
+    "Los precios están un poco caros para lo que ofrecen.",
+    "Tardaron mucho en atendernos, el mozo parecía desbordado.",
+    "Buena relación precio calidad, porciones abundantes.",
+    "El lugar es lindo pero estaba sucio el baño.",
+    "La medialuna estaba fresca y crujiente, el café bien servido.",
+    "Atención amable y rápida, el personal muy predispuesto.",
+    "No aceptan tarjeta, sólo efectivo o Mercado Pago.",
+    "Todo muy casero y sabroso, se nota la calidad de los ingredientes.",
+    "Demoraron 40 minutos con el pedido por delivery y llegó frío.",
+    "Excelente ubicación, fácil para estacionar.",
+    "La dueña es un amor, te atiende con una sonrisa.",
+]
+
+
+# --- FIXTURES ---
+
+def generar_fixture(tamano, semilla=7, radio_km=3.0):
+    """N lugares alrededor de CENTRO con todos los campos de detalle. El primero es el negocio objetivo."""
+    rnd = random.Random(semilla)
+    lugares = []
+    for i in range(tamano):
+        if i == 0:
+            lat, lng = CENTRO
+        else:
+            r = radio_km * math.sqrt(rnd.random())
+            ang = rnd.random() * 2 * math.pi
+            lat = CENTRO[0] + r * math.cos(ang) / KM_POR_GRADO
+            lng = CENTRO[1] + r * math.sin(ang) / (KM_POR_GRADO * math.cos(math.radians(CENTRO[0])))
+        nombre = "Negocio Objetivo" if i == 0 else f"Competidor {i:04d}"
+        lugares.append({
+            "id": f"bench-{i:05d}",
+            "displayName": {"text": nombre, "languageCode": "es"},
+            "formattedAddress": f"Calle Falsa {100 + i}, Córdoba",
+            "location": {"latitude": lat, "longitude": lng},
+            "rating": round(rnd.uniform(3.0, 5.0), 1),
+            "userRatingCount": int(rnd.lognormvariate(4.5, 1.2)),
+            "primaryTypeDisplayName": {"text": "Panadería", "languageCode": "es"},
+            "googleMapsUri": f"https://maps.google.com/?cid={i}",
+            "websiteUri": f"https://ejemplo.com/{i}",
+            "priceLevel": rnd.choice(["PRICE_LEVEL_INEXPENSIVE", "PRICE_LEVEL_MODERATE"]),
+            "editorialSummary": {"text": "Panadería de barrio.", "languageCode": "es"},
+            "reviews": [{"rating": rnd.randint(1, 5), "text": {"text": " ".join(rnd.sample(FRASES_RESEÑAS, 2)),
+                                                                "languageCode": "es"}}
+                        for _ in range(5)],
+        })
+    return lugares
+
+
+def cargar_fixture(ruta):
+    """Fixture grabado: una lista de lugares o una respuesta de searchText ({"places": [...]})."""
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    return datos.get("places", []) if isinstance(datos, dict) else datos
+
+
+# --- SERVIDOR FALSO (Places + Gemini) ---
+
+def _en_rectangulo(lugar, rect):
+    loc = lugar.get("location", {})
+    return (rect["low"]["latitude"] <= loc.get("latitude", 0) <= rect["high"]["latitude"]
+            and rect["low"]["longitude"] <= loc.get("longitude", 0) <= rect["high"]["longitude"])
+
+
+def _distancia_km(lugar, centro):
+    loc = lugar.get("location", {})
+    dy = (loc.get("latitude", 0) - centro["latitude"]) * KM_POR_GRADO
+    dx = (loc.get("longitude", 0) - centro["longitude"]) * KM_POR_GRADO * math.cos(math.radians(centro["latitude"]))
+    return math.hypot(dx, dy)
+
+
+def responder_places(lugares, cuerpo, field_mask):
+    """Imita places:searchText: coincidencia por nombre, restricción/sesgo de ubicación, paginado y field mask."""
+    consulta = cuerpo.get("textQuery", "").lower()
+    por_nombre = [l for l in lugares if l["displayName"]["text"].lower() in consulta]
+    candidatos = por_nombre or lugares
+    restriccion = cuerpo.get("locationRestriction", {}).get("rectangle")
+    sesgo = cuerpo.get("locationBias", {}).get("circle")
+    if restriccion:
+        candidatos = [l for l in candidatos if _en_rectangulo(l, restriccion)]
+    elif sesgo and not por_nombre:
+        candidatos = sorted(candidatos, key=lambda l: _distancia_km(l, sesgo["center"]))
+    candidatos = candidatos[:RESULTADOS_MAX_CONSULTA]
+
+    inicio = int(cuerpo.get("pageToken") or 0)
+    tamano = min(int(cuerpo.get("pageSize") or 20), 20)
+    pagina = candidatos[inicio:inicio + tamano]
+    campos = [c.strip() for c in field_mask.split(",") if c.strip()]
+    if "*" not in campos:
+        propios = {c[len("places."):] for c in campos if c.startswith("places.")}
+        pagina = [{k: v for k, v in l.items() if k in propios} for l in pagina]
+    respuesta = {"places": pagina} if pagina else {}
+    if inicio + tamano < len(candidatos) and "nextPageToken" in campos:
+        respuesta["nextPageToken"] = str(inicio + tamano)
+    return respuesta
+
+
+def responder_gemini(prompt, largo_reporte):
+    """Respuesta plausible para cada prompt del pipeline (JSON donde el pipeline espera JSON)."""
+    if "OUTPUT JSON: { 'ID_0'" in prompt:
+        return json.dumps({pid: "Buena calidad, precios algo altos." for pid in re.findall(r"ITEM (ID_\d+)", prompt)})
+    if '"Calidad": int' in prompt:
+        return json.dumps({"Calidad": 45, "Conveniencia": 25, "Atención": 30})
+    if 'OUTPUT JSON: ["..."' in prompt:
+        return json.dumps(["Calidad del producto", "Precio justo", "Atención rápida", "Limpieza"])
+    if '"menciones": int' in prompt:
+        exigencias = json.loads(re.search(r"Exigencias del mercado: (\[.*?\])", prompt).group(1))
+        return json.dumps({e: {"menciones": 10, "quejas": 2, "cita": "muy bueno"} for e in exigencias},
+                          ensure_ascii=False)
+    parrafo = "## Sección\n* **Hallazgo:** texto de ejemplo basado en las reseñas del mercado.\n"
+    return (parrafo * (largo_reporte // len(parrafo) + 1))[:largo_reporte]
+
+
+def _respuesta_gemini_json(texto):
+    return {"candidates": [{"content": {"parts": [{"text": texto}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(texto) // 4}}
+
+
+def crear_servidor(lugares, config):
+    """ThreadingHTTPServer en 127.0.0.1 con puerto libre. config: latencias y largo del reporte."""
+
+    def demora(base_ms, jitter_ms):
+        time.sleep(max(0.0, base_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+    porid = {l["id"]: l for l in lugares}
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _enviar(self, codigo, cuerpo, tipo="application/json"):
+            datos = cuerpo.encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            # Place Details: /v1/places/{id}, field mask sin prefijo "places."
+            ruta = self.path.split("?")[0]
+            lugar = porid.get(ruta.rsplit("/", 1)[-1]) if "/places/" in ruta else None
+            if lugar is None:
+                return self._enviar(404, "{}")
+            demora(config["latencia_places_ms"], config["jitter_places_ms"])
+            campos = {c.strip() for c in self.headers.get("X-Goog-FieldMask", "*").split(",")}
+            if "*" not in campos:
+                lugar = {k: v for k, v in lugar.items() if k in campos}
+            return self._enviar(200, json.dumps(lugar, ensure_ascii=False))
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            ruta = self.path.split("?")[0]
+            if ruta.endswith("/places:searchText"):
+                demora(config["latencia_places_ms"], config["jitter_places_ms"])
+                respuesta = responder_places(lugares, cuerpo, self.headers.get("X-Goog-FieldMask", "*"))
+                return self._enviar(200, json.dumps(respuesta, ensure_ascii=False))
+            modelo = re.match(r".*/models/[^:]+:(generateContent|streamGenerateContent)$", ruta)
+            if not modelo:
+                return self._enviar(404, "{}")
+            prompt = "".join(p.get("text", "") for c in cuerpo.get("contents", []) for p in c.get("parts", []))
+            texto = responder_gemini(prompt, config["largo_reporte"])
+            demora(config["latencia_gemini_ms"], config["jitter_gemini_ms"])
+            if modelo.group(1) == "generateContent":
+                return self._enviar(200, json.dumps(_respuesta_gemini_json(texto), ensure_ascii=False))
+            # Stream (transporte REST): un array JSON que llega objeto por objeto, con una pausa entre fragmentos
+            n = config["fragmentos_stream"]
+            paso = max(1, -(-len(texto) // n))
+            objetos = [json.dumps(_respuesta_gemini_json(texto[i:i + paso]), ensure_ascii=False)
+                       for i in range(0, len(texto), paso)]
+            eventos = ["[" + objetos[0]] + ["," + o for o in objetos[1:]] + ["]"] if objetos else ["[]"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for evento in eventos:
+                datos = evento.encode("utf-8")
+                self.wfile.write(f"{len(datos):X}\r\n".encode() + datos + b"\r\n")
+                self.wfile.flush()
+                time.sleep(config["pausa_fragmento_ms"] / 1000)
+            self.wfile.write(b"0\r\n\r\n")
+
+    return ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+
+
+def _servir(lugares, config, cola_puerto):
+    servidor = crear_servidor(lugares, config)
+    cola_puerto.put(servidor.server_address[1])
+    servidor.serve_forever()
+
+
+def levantar_servidor(lugares, config):
+    """Proceso aparte: el servidor no compite por el GIL ni ensucia la medición de memoria."""
+    cola = multiprocessing.Queue()
+    proceso = multiprocessing.Process(target=_servir, args=(lugares, config, cola), daemon=True)
+    proceso.start()
+    return proceso, cola.get(timeout=30)
+
+
+# --- CORRIDA ---
+
+def medir(tiempos, etapa, fn, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = fn(*args, **kwargs)
+    tiempos[etapa] = time.perf_counter() - inicio
+    return resultado
+
+
+def una_auditoria(radar, params, exhaustivo, reseñas_propias):
+    """Las mismas etapas que la app, cronometradas una por una."""
+    tiempos = {}
+    inicio = time.perf_counter()
+    datos = medir(tiempos, "mercado", radar.obtener_mercado, params, "bench", exhaustivo)
+    if not datos:
+        raise RuntimeError("El servidor falso no devolvió mercado: revisar el fixture.")
+    datos = medir(tiempos, "preparar", radar.preparar_analisis, datos)
+    sov = medir(tiempos, "sov_local", radar.calcular_sov_local, datos["lista_visual"], datos["excluir"])
+    medir(tiempos, "kpis", radar.calcular_kpis, datos, exhaustivo)
+    # IA como en la app: resúmenes en segundo plano mientras el reporte llega por stream
+    inicio_ia = time.perf_counter()
+    lote = radar.lanzar_en_paralelo(radar.tareas_ia(datos, "bench", False, incluir_reporte=False, sov_respaldo=sov))
+    fragmentos = radar.generar_analisis_exhaustivo(datos["texto_mercado"], datos["texto_lideres"], datos["rubro"],
+                                                   "bench", False, stream=True)
+    for i, _ in enumerate(fragmentos):
+        if i == 0:
+            tiempos["reporte_primer_fragmento"] = time.perf_counter() - inicio_ia
+    tiempos["reporte"] = time.perf_counter() - inicio_ia
+    radar.recoger_resultados(lote)
+    tiempos["ia"] = time.perf_counter() - inicio_ia
+    if reseñas_propias:
+        medir(tiempos, "auditoria", radar.auditar_brecha, datos["texto_mercado_brecha"], reseñas_propias,
+              "Tu Archivo", datos["rubro"], "bench", False)
+    tiempos["total"] = time.perf_counter() - inicio
+    return tiempos, len(datos["mercado"])
+
+
+def percentiles(valores):
+    arr = np.asarray(valores) * 1000
+    res = {f"p{p}": round(float(np.percentile(arr, p)), 1) for p in PERCENTILES}
+    res["media"] = round(float(arr.mean()), 1)
+    return res
+
+
+def correr_tamano(lugares, args):
+    config = {k: getattr(args, k) for k in ("latencia_places_ms", "jitter_places_ms", "latencia_gemini_ms",
+                                            "jitter_gemini_ms", "largo_reporte", "fragmentos_stream",
+                                            "pausa_fragmento_ms")}
+    proceso, puerto = levantar_servidor(lugares, config)
+    try:
+        import indice_espacial
+        import modelos_ia
+        import places_client
+        import radar
+        places_client.PLACES_BASE_URL = f"http://127.0.0.1:{puerto}/v1"
+        places_client._clientes.clear()
+        modelos_ia.GEMINI_API_ENDPOINT = f"http://127.0.0.1:{puerto}"
+        modelos_ia._api_key_configurada = None
+
+        objetivo = lugares[0]
+        if args.modo == "negocio":
+            params = {"type": "negocio", "radio": args.radio,
+                      "data": {k: objetivo[k] for k in places_client.CAMPOS_CANDIDATOS if k in objetivo}}
+        else:
+            params = {"type": "rubro", "radio": args.radio, "rubro": args.rubros,
+                      "data": {"formattedAddress": objetivo["formattedAddress"], "location": objetivo["location"]}}
+        reseñas = [random.choice(FRASES_RESEÑAS) for _ in range(args.reseñas_propias)]
+
+        por_etapa, encontrados = {}, []
+        tracemalloc.start()
+        for i in range(args.calentamiento + args.iteraciones):
+            places_client.obtener_cache_places().limpiar()  # cada iteración paga la red, como un mercado nuevo
+            indice_espacial.obtener_indice_espacial().limpiar()
+            tiempos, n = una_auditoria(radar, params, args.exhaustivo, reseñas)
+            if i >= args.calentamiento:
+                for etapa, seg in tiempos.items():
+                    por_etapa.setdefault(etapa, []).append(seg)
+                encontrados.append(n)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        proceso.terminate()
+    return {
+        "tamano_fixture": len(lugares),
+        "lugares_analizados": int(np.mean(encontrados)),
+        "etapas_ms": {etapa: percentiles(v) for etapa, v in por_etapa.items()},
+        "memoria_pico_mb": round(pico / 2 ** 20, 1),
+    }
+
+
+def comparar(actual, ruta_previa):
+    with open(ruta_previa, encoding="utf-8") as f:
+        previa = {r["tamano_fixture"]: r for r in json.load(f)["resultados"]}
+    for res in actual["resultados"]:
+        base = previa.get(res["tamano_fixture"])
+        if not base:
+            continue
+        print(f"\nΔ vs {ruta_previa} — fixture {res['tamano_fixture']}")
+        for etapa, m in res["etapas_ms"].items():
+            b = base["etapas_ms"].get(etapa)
+            if b:
+                cambios = "  ".join(f"{p}: {(m[p] - b[p]) / b[p] * 100:+.0f}%" if b[p] else f"{p}: n/a"
+                                    for p in ("p50", "p95"))
+                print(f"  {etapa:<10} {cambios}")
+
+
+def version_codigo():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline contra Places y Gemini falsos.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[20, 200, 2000], help="lugares en el fixture")
+    parser.add_argument("--fixture", help="JSON grabado (lista de lugares o respuesta de searchText)")
+    parser.add_argument("--iteraciones", type=int, default=10)
+    parser.add_argument("--calentamiento", type=int, default=1, help="iteraciones descartadas al inicio")
+    parser.add_argument("--modo", choices=["negocio", "rubro"], default="negocio")
+    parser.add_argument("--rubros", nargs="+", default=["Panadería"])
+    parser.add_argument("--radio", type=float, default=2.0)
+    parser.add_argument("--radio-fixture", type=float, default=3.0,
+                        help="km en que se reparte el fixture generado; chico (ej. 0.5 con 2000 lugares) satura "
+                             "las celdas y ejercita la subdivisión de --exhaustivo")
+    parser.add_argument("--exhaustivo", action="store_true")
+    parser.add_argument("--reseñas-propias", type=int, default=0, help="reseñas sintéticas para la auditoría privada")
+    parser.add_argument("--latencia-places-ms", type=float, default=80)
+    parser.add_argument("--jitter-places-ms", type=float, default=30)
+    parser.add_argument("--latencia-gemini-ms", type=float, default=800)
+    parser.add_argument("--jitter-gemini-ms", type=float, default=300)
+    parser.add_argument("--largo-reporte", type=int, default=4000, help="caracteres del reporte falso")
+    parser.add_argument("--fragmentos-stream", type=int, default=20)
+    parser.add_argument("--pausa-fragmento-ms", type=float, default=30)
+    parser.add_argument("-o", "--salida", default=f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    args = parser.parse_args(argv)
+
+    # Caché y datos en un directorio descartable; sin topes de cuota que distorsionen la medición.
+    # Tiene que estar antes del primer import del pipeline: esos módulos leen el entorno al importarse.
+    with tempfile.TemporaryDirectory(prefix="radar-bench-", ignore_cleanup_errors=True) as datos:
+        os.environ["RADAR_DATA_DIR"] = datos
+        for var in ("PLACES_RPM", "GEMINI_RPM", "GEMINI_TPM"):
+            os.environ.setdefault(var, str(10 ** 9))
+
+        fixtures = ([cargar_fixture(args.fixture)] if args.fixture
+                    else [generar_fixture(n, radio_km=args.radio_fixture) for n in args.tamanos])
+        resultados = []
+        for lugares in fixtures:
+            print(f"▶ fixture de {len(lugares)} lugares ({args.iteraciones} iteraciones)...")
+            res = correr_tamano(lugares, args)
+            resultados.append(res)
+            total = res["etapas_ms"]["total"]
+            print(f"  total p50={total['p50']}ms p95={total['p95']}ms p99={total['p99']}ms · "
+                  f"pico memoria {res['memoria_pico_mb']} MB · {res['lugares_analizados']} lugares analizados")
+
+    corrida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "version": version_codigo(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "resultados": resultados,
+    }
+    carpeta = os.path.dirname(args.salida)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(corrida, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados en {args.salida}")
+    if args.comparar:
+        comparar(corrida, args.comparar)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
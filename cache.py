@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- CONFIGURACIÓN CACHÉ IA ---
+IA_CACHE_TTL_SEG = int(os.environ.get("IA_CACHE_TTL_SEG", 7 * 24 * 3600))
+IA_CACHE_MAX_MEMORIA = int(os.environ.get("IA_CACHE_MAX_MEMORIA", 256))
+IA_CACHE_MAX_DISCO = int(os.environ.get("IA_CACHE_MAX_DISCO", 2000))
+
+# --- DIRECTORIO DE DATOS LOCALES ---
+DATA_DIR = os.environ.get("RADAR_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".radar_data"))
+
+
+def ruta_datos(nombre_archivo):
+    """Ruta dentro del directorio de datos (lo crea si no existe)."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, nombre_archivo)
+
+
+def hash_clave(*partes):
+    """Hash estable (sha256) de cualquier combinación de valores serializables a JSON."""
+    crudo = json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(crudo.encode("utf-8")).hexdigest()
+
+
+class CacheSQLite:
+    """
+    Caché persistente clave -> texto sobre SQLite.
+    - TTL configurable: las entradas vencidas cuentan como miss y se borran.
+    - Tamaño acotado: al pasar max_entradas se desalojan las menos usadas (LRU por último acceso).
+    - Contadores de hits/misses para monitoreo.
+    Es segura entre hilos (un lock por instancia) y entre procesos (modo WAL de SQLite).
+    """
+
+    def __init__(self, ruta, ttl_seg, max_entradas):
+        self.ruta = ruta
+        self.ttl_seg = ttl_seg
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS entradas ("
+            " clave TEXT PRIMARY KEY, valor TEXT NOT NULL, creado REAL NOT NULL, accedido REAL NOT NULL)"
+        )
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_accedido ON entradas (accedido)")
+        self._con.commit()
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado o None si no existe o venció."""
+        entrada = self.obtener_con_creado(clave)
+        return entrada[0] if entrada is not None else None
+
+    def obtener_con_creado(self, clave):
+        """(valor, momento en que se guardó) o None: el otro nivel de la caché respeta el mismo vencimiento."""
+        ahora = time.time()
+        with self._lock:
+            fila = self._con.execute("SELECT valor, creado FROM entradas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                self.misses += 1
+                return None
+            valor, creado = fila
+            if self.ttl_seg and ahora - creado > self.ttl_seg:
+                self._con.execute("DELETE FROM entradas WHERE clave = ?", (clave,))
+                self._con.commit()
+                self.misses += 1
+                return None
+            self._con.execute("UPDATE entradas SET accedido = ? WHERE clave = ?", (ahora, clave))
+            self._con.commit()
+            self.hits += 1
+            return valor, creado
+
+    def guardar(self, clave, valor):
+        ahora = time.time()
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO entradas (clave, valor, creado, accedido) VALUES (?, ?, ?, ?)",
+                              (clave, valor, ahora, ahora))
+            sobrantes = self._con.execute("SELECT COUNT(*) FROM entradas").fetchone()[0] - self.max_entradas
+            if sobrantes > 0:
+                self._con.execute(
+                    "DELETE FROM entradas WHERE clave IN (SELECT clave FROM entradas ORDER BY accedido ASC LIMIT ?)",
+                    (sobrantes,))
+            self._con.commit()
+
+    def limpiar(self):
+        with self._lock:
+            self._con.execute("DELETE FROM entradas")
+            self._con.commit()
+
+    def estadisticas(self):
+        with self._lock:
+            n = self._con.execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entradas": n,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+class CacheLRU:
+    """Caché en memoria acotada (LRU) con TTL. Misma interfaz que CacheSQLite."""
+
+    def __init__(self, ttl_seg, max_entradas):
+        self.ttl_seg = ttl_seg
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            valor, creado = entrada
+            if self.ttl_seg and time.time() - creado > self.ttl_seg:
+                del self._datos[clave]
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def guardar(self, clave, valor, creado=None):
+        """creado: para subir una entrada de otro nivel sin renovarle el TTL."""
+        with self._lock:
+            self._datos[clave] = (valor, creado or time.time())
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entradas": len(self._datos),
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+class CacheDosNiveles:
+    """
+    Memoria (rápida, por proceso) delante de disco (persistente). Un hit en disco sube a memoria
+    con su fecha de creación original: en memoria vence cuando vence en disco, no un TTL completo después.
+    """
+
+    def __init__(self, memoria, disco):
+        self.memoria = memoria
+        self.disco = disco
+
+    def obtener(self, clave):
+        valor = self.memoria.obtener(clave)
+        if valor is not None:
+            return valor
+        entrada = self.disco.obtener_con_creado(clave)
+        if entrada is None:
+            return None
+        valor, creado = entrada
+        self.memoria.guardar(clave, valor, creado)
+        return valor
+
+    def guardar(self, clave, valor):
+        self.memoria.guardar(clave, valor)
+        self.disco.guardar(clave, valor)
+
+    def limpiar(self):
+        self.memoria.limpiar()
+        self.disco.limpiar()
+
+    def estadisticas(self):
+        return {"memoria": self.memoria.estadisticas(), "disco": self.disco.estadisticas()}
+
+
+_cache_ia = None
+_lock_cache_ia = threading.Lock()
+
+
+def obtener_cache_ia():
+    """Caché de respuestas de Gemini, una por proceso (compartida entre sesiones y reruns)."""
+    global _cache_ia
+    with _lock_cache_ia:
+        if _cache_ia is None:
+            _cache_ia = CacheDosNiveles(
+                CacheLRU(IA_CACHE_TTL_SEG, IA_CACHE_MAX_MEMORIA),
+                CacheSQLite(ruta_datos("ia_cache.sqlite3"), IA_CACHE_TTL_SEG, IA_CACHE_MAX_DISCO),
+            )
+        return _cache_ia
@@ -0,0 +1,79 @@
+import threading
+
+# --- COALESCENCIA DE PEDIDOS IDÉNTICOS (singleflight) ---
+# Si dos sesiones piden lo mismo a la vez, la primera calcula y las demás esperan y comparten el resultado.
+# La espera tiene tope: un líder colgado (un stream de Gemini trabado, Places sin responder) no arrastra a
+# las demás sesiones; vencido el tope, cada una calcula por su cuenta.
+
+
+class EsperaVencida(TimeoutError):
+    """El líder no terminó dentro de espera_max_seg."""
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class Coalescedor:
+    """
+    Un cálculo en curso por clave. Quien llega con una clave ya en vuelo espera al líder y recibe
+    su resultado (o su excepción). Terminado el vuelo la clave se libera: no es una caché.
+    """
+
+    def __init__(self, nombre, espera_max_seg):
+        self.nombre = nombre
+        self.espera_max_seg = espera_max_seg
+        self._vuelos = {}
+        self._lock = threading.Lock()
+        self.compartidas = 0
+        self.vencidas = 0
+
+    def unirse(self, clave):
+        """Devuelve (vuelo, es_lider). El líder debe llamar a aterrizar() pase lo que pase."""
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            if vuelo is not None:
+                self.compartidas += 1
+                return vuelo, False
+            vuelo = self._vuelos[clave] = _Vuelo()
+            return vuelo, True
+
+    def aterrizar(self, clave, vuelo, resultado=None, error=None):
+        with self._lock:
+            if self._vuelos.get(clave) is vuelo:
+                del self._vuelos[clave]
+        vuelo.resultado, vuelo.error = resultado, error
+        vuelo.listo.set()
+
+    def esperar(self, vuelo):
+        """Resultado (o excepción) del líder. EsperaVencida si no terminó a tiempo."""
+        if not vuelo.listo.wait(self.espera_max_seg):
+            with self._lock:
+                self.vencidas += 1
+            raise EsperaVencida(f"{self.nombre}: el cálculo compartido no terminó en {self.espera_max_seg}s")
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.resultado
+
+    def ejecutar(self, clave, fn, *args, **kwargs):
+        vuelo, es_lider = self.unirse(clave)
+        if not es_lider:
+            try:
+                return self.esperar(vuelo)
+            except EsperaVencida as e:
+                print(f"Error coalescencia: {e}; se calcula por separado")
+                return fn(*args, **kwargs)
+        try:
+            resultado = fn(*args, **kwargs)
+        except BaseException as e:
+            self.aterrizar(clave, vuelo, error=e)
+            raise
+        self.aterrizar(clave, vuelo, resultado=resultado)
+        return resultado
+
+    def en_vuelo(self):
+        with self._lock:
+            return len(self._vuelos)
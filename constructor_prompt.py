@@ -0,0 +1,160 @@
+import math
+import re
+import unicodedata
+
+# --- PRESUPUESTOS DE TOKENS (reemplazan los recortes fijos por caracteres) ---
+CHARS_POR_TOKEN = 4  # aproximación razonable para Gemini en español
+PRESUPUESTO_REPORTE = 5500
+PRESUPUESTO_SOV = 3750
+PRESUPUESTO_BRECHA_MERCADO = 2500
+PRESUPUESTO_BRECHA_PROPIAS = 6000
+PRESUPUESTO_LOTE_AUDITORIA = 8000
+SIMILITUD_CASI_DUPLICADO = 0.8
+TAMANO_SHINGLE = 3
+POSTINGS_MAX = 64  # un shingle que ya está en más reseñas ("muy buena atencion") no sirve para buscar candidatos
+FALLOS_SEGUIDOS_MAX = 25  # reseñas seguidas que no entran en lo que queda del presupuesto: se deja de buscar
+ENTRADA_MAX_RESEÑAS = 3000  # con más, se deduplica una muestra pareja de todo el archivo
+
+
+def estimar_tokens(texto):
+    return math.ceil(len(texto) / CHARS_POR_TOKEN)
+
+
+def _normalizar(texto):
+    """Minúsculas, sin tildes ni signos: dos reseñas iguales salvo formato quedan idénticas."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", texto))
+
+
+def _shingles(texto_normalizado):
+    palabras = texto_normalizado.split()
+    if len(palabras) < TAMANO_SHINGLE:
+        return {texto_normalizado}
+    return {" ".join(palabras[i:i + TAMANO_SHINGLE]) for i in range(len(palabras) - TAMANO_SHINGLE + 1)}
+
+
+def deduplicar(textos):
+    """
+    Quita reseñas vacías, duplicados exactos (tras normalizar) y casi duplicados
+    (Jaccard de shingles de palabras >= SIMILITUD_CASI_DUPLICADO). Conserva el orden.
+    Es un generador: quien consume puede cortar apenas llena su presupuesto.
+    """
+    vistos = set()
+    firmas = []
+    indice = {}  # shingle -> posiciones en firmas (sólo se compara contra candidatos que comparten algo)
+    for texto in textos:
+        normal = _normalizar(texto or "")
+        if not normal or normal in vistos:
+            continue
+        sh = _shingles(normal)
+        candidatos = {j for s in sh if len(indice.get(s, ())) <= POSTINGS_MAX for j in indice.get(s, ())}
+        if any(len(sh & firmas[j]) / len(sh | firmas[j]) >= SIMILITUD_CASI_DUPLICADO for j in candidatos):
+            continue
+        vistos.add(normal)
+        for s in sh:
+            posiciones = indice.setdefault(s, [])
+            if len(posiciones) <= POSTINGS_MAX:
+                posiciones.append(len(firmas))
+        firmas.append(sh)
+        yield texto.strip()
+
+
+def _repartir(demandas, presupuesto):
+    """
+    Reparto justo (water-filling): nadie recibe más de lo que pide
+    y lo que sobra de los chicos se redistribuye entre los grandes.
+    """
+    asignado = [0] * len(demandas)
+    restante = presupuesto
+    pendientes = sorted(range(len(demandas)), key=lambda i: demandas[i])
+    while pendientes:
+        parte = restante // len(pendientes)
+        i = pendientes.pop(0)
+        asignado[i] = min(demandas[i], parte)
+        restante -= asignado[i]
+    return asignado
+
+
+def _tomar_hasta(textos, presupuesto, separador):
+    """
+    Reseñas completas hasta agotar el presupuesto: nunca corta una reseña por la mitad.
+    Corta antes si muchas seguidas no entran: el resto del generador (y su deduplicado) no se recorre.
+    """
+    elegidos, usado, fallos = [], 0, 0
+    costo_sep = estimar_tokens(separador)
+    for t in textos:
+        if presupuesto - usado < costo_sep + 1 or fallos >= FALLOS_SEGUIDOS_MAX:
+            break
+        costo = estimar_tokens(t) + (costo_sep if elegidos else 0)
+        if usado + costo > presupuesto:
+            fallos += 1
+            continue
+        elegidos.append(t)
+        usado += costo
+        fallos = 0
+    return elegidos
+
+
+def armar_texto_mercado(negocios, presupuesto_tokens, excluir_nombre=None):
+    """
+    Bloque [MERCADO] de los prompts: reseñas deduplicadas de cada competidor,
+    con presupuesto repartido entre competidores para que ninguno quede afuera.
+    """
+    bloques = []
+    for neg in negocios:
+        nombre = neg.get('displayName', {}).get('text')
+        if excluir_nombre and nombre == excluir_nombre:
+            continue
+        revs = [r.get('text', {}).get('text', '') for r in neg.get('reviews', [])]
+        bloques.append((nombre, revs))
+
+    # Deduplicado global: la misma reseña copiada en varias fichas cuenta una sola vez
+    unicas = set(_normalizar(t) for t in deduplicar([t for _, revs in bloques for t in revs]))
+    depurados = []
+    for nombre, revs in bloques:
+        propias = [t for t in deduplicar(revs) if _normalizar(t) in unicas]
+        unicas -= {_normalizar(t) for t in propias}
+        if propias:
+            depurados.append((nombre, propias))
+
+    encabezados = [f"COMPETIDOR ({nombre}): " for nombre, _ in depurados]
+    costo_fijo = sum(estimar_tokens(e) for e in encabezados)
+    demandas = [sum(estimar_tokens(t) + 1 for t in revs) for _, revs in depurados]
+    cupos = _repartir(demandas, max(presupuesto_tokens - costo_fijo, 0))
+
+    partes = []
+    for encabezado, (_, revs), cupo in zip(encabezados, depurados, cupos):
+        elegidos = _tomar_hasta(revs, cupo, " | ")
+        if elegidos:
+            partes.append(encabezado + " | ".join(elegidos))
+    return "\n\n".join(partes)
+
+
+def armar_lista_reseñas(reseñas, presupuesto_tokens, separador=" | "):
+    """Reseñas propias deduplicadas, completas, dentro del presupuesto."""
+    if len(reseñas) > ENTRADA_MAX_RESEÑAS:
+        # Muestra sistemática: un archivo de 200.000 filas no se deduplica entero para llenar unos miles de tokens
+        reseñas = reseñas[::math.ceil(len(reseñas) / ENTRADA_MAX_RESEÑAS)]
+    return separador.join(_tomar_hasta(deduplicar(reseñas), presupuesto_tokens, separador))
+
+
+def partir_en_lotes(reseñas, presupuesto_tokens):
+    """
+    Agrupa reseñas completas en lotes que entran en el presupuesto (para map-reduce).
+    Una reseña más larga que el presupuesto va sola, recortada a ese tamaño.
+    """
+    lotes, actual, usado = [], [], 0
+    tope_chars = presupuesto_tokens * CHARS_POR_TOKEN
+    for texto in reseñas:
+        costo = estimar_tokens(texto) + 1
+        if costo > presupuesto_tokens:
+            texto, costo = texto[:tope_chars], presupuesto_tokens
+        if actual and usado + costo > presupuesto_tokens:
+            lotes.append(actual)
+            actual, usado = [], 0
+        actual.append(texto)
+        usado += costo
+    if actual:
+        lotes.append(actual)
+    return lotes
@@ -0,0 +1,181 @@
+import math
+
+import numpy as np
+
+# --- CONSTANTES GEOGRÁFICAS ---
+KM_POR_GRADO_LAT = 111.32
+RADIO_TIERRA_KM = 6371.0088
+
+
+def km_a_grados(lat, km):
+    """Convierte km a (delta_lat, delta_lng) en grados alrededor de una latitud."""
+    d_lat = km / KM_POR_GRADO_LAT
+    d_lng = km / (KM_POR_GRADO_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return d_lat, d_lng
+
+
+def rectangulo(lat_min, lng_min, lat_max, lng_max):
+    """Rectángulo en el formato de Places API (locationRestriction.rectangle)."""
+    return {"low": {"latitude": lat_min, "longitude": lng_min},
+            "high": {"latitude": lat_max, "longitude": lng_max}}
+
+
+def rect_toca_circulo(rect, lat, lng, radio_km):
+    """True si el punto del rectángulo más cercano al centro está dentro del radio."""
+    lat_c = min(max(lat, rect["low"]["latitude"]), rect["high"]["latitude"])
+    lng_c = min(max(lng, rect["low"]["longitude"]), rect["high"]["longitude"])
+    d_lat, d_lng = km_a_grados(lat, 1.0)
+    dy = (lat_c - lat) / d_lat
+    dx = (lng_c - lng) / d_lng
+    return dx * dx + dy * dy <= radio_km * radio_km
+
+
+def celdas_cubriendo_circulo(lat, lng, radio_km, lado_km):
+    """
+    Divide el cuadrado que envuelve al círculo en celdas de lado_km
+    y devuelve sólo las que tocan el círculo.
+    """
+    n = max(1, math.ceil(2 * radio_km / lado_km))
+    d_lat, d_lng = km_a_grados(lat, radio_km)
+    lat0, lng0 = lat - d_lat, lng - d_lng
+    paso_lat, paso_lng = 2 * d_lat / n, 2 * d_lng / n
+    celdas = []
+    for i in range(n):
+        for j in range(n):
+            rect = rectangulo(lat0 + i * paso_lat, lng0 + j * paso_lng,
+                              lat0 + (i + 1) * paso_lat, lng0 + (j + 1) * paso_lng)
+            if rect_toca_circulo(rect, lat, lng, radio_km):
+                celdas.append(rect)
+    return celdas
+
+
+def subdividir(rect):
+    """Parte un rectángulo en 4 cuadrantes (para celdas que saturan la paginación)."""
+    lo, hi = rect["low"], rect["high"]
+    lat_m = (lo["latitude"] + hi["latitude"]) / 2
+    lng_m = (lo["longitude"] + hi["longitude"]) / 2
+    return [
+        rectangulo(lo["latitude"], lo["longitude"], lat_m, lng_m),
+        rectangulo(lo["latitude"], lng_m, lat_m, hi["longitude"]),
+        rectangulo(lat_m, lo["longitude"], hi["latitude"], lng_m),
+        rectangulo(lat_m, lng_m, hi["latitude"], hi["longitude"]),
+    ]
+
+
+def distancias_km(lat, lng, lats, lngs):
+    """Haversine vectorizado: distancia (km) desde (lat, lng) a cada punto de los arrays."""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def filtrar_por_radio(lugares, lat, lng, radio_km, descartar=True):
+    """
+    locationBias es sólo una preferencia: la API devuelve lugares fuera del radio.
+    Calcula todas las distancias en una sola pasada, las guarda en 'distanciaKm' y marca 'fueraDeRadio'.
+    Con descartar=True devuelve sólo los que están dentro (los que no tienen ubicación se conservan).
+    Devuelve (lugares, cantidad_fuera).
+    """
+    if not lugares:
+        return [], 0
+    lats = [l.get('location', {}).get('latitude', np.nan) for l in lugares]
+    lngs = [l.get('location', {}).get('longitude', np.nan) for l in lugares]
+    dist = distancias_km(lat, lng, lats, lngs)
+    fuera = dist > radio_km  # NaN (sin ubicación) compara como False
+    for lugar, d, f in zip(lugares, dist, fuera):
+        lugar['distanciaKm'] = None if np.isnan(d) else round(float(d), 2)
+        lugar['fueraDeRadio'] = bool(f)
+    cantidad_fuera = int(fuera.sum())
+    if descartar:
+        lugares = [l for l, f in zip(lugares, fuera) if not f]
+    return lugares, cantidad_fuera
+
+
+# --- GRILLA GEOHASH ---
+# Las celdas de un geohash de precisión p, identificadas por (fila, columna) enteras: es la misma partición que
+# los geohash de texto, sin armar las cadenas (una búsqueda enumera miles de celdas).
+def lados_geohash(precision):
+    """(alto, ancho) en grados de una celda de geohash de la precisión dada."""
+    bits = 5 * precision
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+
+def celda_geohash(lat, lng, precision):
+    alto, ancho = lados_geohash(precision)
+    return int((lat + 90.0) // alto), int((lng + 180.0) // ancho)
+
+
+def _celdas_en_caja(lat_min, lng_min, lat_max, lng_max, precision):
+    """Filas, columnas y bordes (arrays) de las celdas que tocan una caja."""
+    alto, ancho = lados_geohash(precision)
+    filas = np.arange(int((lat_min + 90.0) // alto), int((lat_max + 90.0) // alto) + 1)
+    columnas = np.arange(int((lng_min + 180.0) // ancho), int((lng_max + 180.0) // ancho) + 1)
+    f, c = np.meshgrid(filas, columnas, indexing="ij")
+    lat_lo, lng_lo = f * alto - 90.0, c * ancho - 180.0
+    return f, c, lat_lo, lng_lo, lat_lo + alto, lng_lo + ancho
+
+
+def celdas_geohash_en_circulo(lat, lng, radio_km, precision):
+    """
+    {celda: completa} de las celdas que tocan el círculo, en una pasada vectorizada.
+    completa=True si la celda entera cae dentro del radio (su esquina más lejana está dentro).
+    """
+    d_lat, d_lng = km_a_grados(lat, radio_km)
+    f, c, lat_lo, lng_lo, lat_hi, lng_hi = _celdas_en_caja(lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng,
+                                                           precision)
+    g_lat, g_lng = km_a_grados(lat, 1.0)
+    cerca_y = (np.clip(lat, lat_lo, lat_hi) - lat) / g_lat
+    cerca_x = (np.clip(lng, lng_lo, lng_hi) - lng) / g_lng
+    lejos_y = np.maximum(np.abs(lat_lo - lat), np.abs(lat_hi - lat)) / g_lat
+    lejos_x = np.maximum(np.abs(lng_lo - lng), np.abs(lng_hi - lng)) / g_lng
+    r2 = radio_km * radio_km
+    toca = cerca_x ** 2 + cerca_y ** 2 <= r2
+    completa = lejos_x ** 2 + lejos_y ** 2 <= r2
+    return {(int(a), int(b)): bool(d) for a, b, d in zip(f[toca], c[toca], completa[toca])}
+
+
+def celdas_geohash_dentro_de_rect(rect, precision):
+    """Celdas enteramente contenidas en un rectángulo de Places API."""
+    lo, hi = rect["low"], rect["high"]
+    f, c, lat_lo, lng_lo, lat_hi, lng_hi = _celdas_en_caja(lo["latitude"], lo["longitude"], hi["latitude"],
+                                                           hi["longitude"], precision)
+    dentro = ((lat_lo >= lo["latitude"]) & (lat_hi <= hi["latitude"])
+              & (lng_lo >= lo["longitude"]) & (lng_hi <= hi["longitude"]))
+    return [(int(a), int(b)) for a, b in zip(f[dentro], c[dentro])]
+
+
+def celdas_geohash_cubiertas(rects, precision):
+    """
+    Celdas enteramente cubiertas por la unión de varios rectángulos (ej. la grilla de una búsqueda exhaustiva:
+    las celdas que cruzan el borde entre dos rectángulos también cuentan). Se prueba cada celda en sus esquinas,
+    los puntos medios de sus lados y el centro, lo que alcanza mientras los rectángulos no sean menores
+    que media celda.
+    """
+    if not rects:
+        return []
+    lo = np.array([[r["low"]["latitude"], r["low"]["longitude"]] for r in rects])
+    hi = np.array([[r["high"]["latitude"], r["high"]["longitude"]] for r in rects])
+    f, c, lat_lo, lng_lo, lat_hi, lng_hi = _celdas_en_caja(lo[:, 0].min(), lo[:, 1].min(), hi[:, 0].max(),
+                                                           hi[:, 1].max(), precision)
+    f, c, lat_lo, lng_lo, lat_hi, lng_hi = (a.ravel() for a in (f, c, lat_lo, lng_lo, lat_hi, lng_hi))
+    fracciones = np.array([0.0, 0.5, 1.0])
+    lats = (lat_lo[:, None] + (lat_hi - lat_lo)[:, None] * fracciones)[:, :, None]  # celda x 3 x 1
+    lngs = (lng_lo[:, None] + (lng_hi - lng_lo)[:, None] * fracciones)[:, None, :]  # celda x 1 x 3
+    cubierta = np.ones(f.shape, dtype=bool)
+    for i in range(3):
+        for j in range(3):
+            punto_lat, punto_lng = lats[:, i, 0][:, None], lngs[:, 0, j][:, None]
+            adentro = ((punto_lat >= lo[:, 0]) & (punto_lat <= hi[:, 0])
+                       & (punto_lng >= lo[:, 1]) & (punto_lng <= hi[:, 1]))
+            cubierta &= adentro.any(axis=1)
+    return [(int(a), int(b)) for a, b in zip(f[cubierta], c[cubierta])]
+
+
+def rect_de_celdas(celdas, precision):
+    """Rectángulo (formato Places) que envuelve un conjunto de celdas."""
+    alto, ancho = lados_geohash(precision)
+    filas = [f for f, _ in celdas]
+    columnas = [c for _, c in celdas]
+    return rectangulo(min(filas) * alto - 90.0, min(columnas) * ancho - 180.0,
+                      (max(filas) + 1) * alto - 90.0, (max(columnas) + 1) * ancho - 180.0)
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cache import ruta_datos
+
+# --- HISTORIAL DE MÉTRICAS POR LUGAR (Parquet) ---
+# Cada auditoría deja una foto de todo su mercado: una fila por lugar con rating y opiniones.
+# Un directorio por mercado (clave_mercado) y un archivo Parquet por auditoría: escribir nunca pisa a otro
+# proceso. Cuando un mercado junta muchos archivos se compactan en uno (leer sigue siendo una sola pasada).
+COMPACTAR_DESDE = 40
+
+ESQUEMA = pa.schema([
+    ("momento", pa.timestamp("s", tz="UTC")),
+    ("id", pa.string()),
+    ("negocio", pa.string()),
+    ("rating", pa.float64()),
+    ("opiniones", pa.int64()),
+    ("distancia_km", pa.float64()),
+    ("es_objetivo", pa.bool_()),
+])
+
+
+def filas_historial(lugares, id_objetivo=None):
+    """Columnas (listas) de la foto de un mercado, listas para pa.Table.from_pydict."""
+    lugares = [l for l in lugares if l.get('id')]
+    return {
+        "id": [l['id'] for l in lugares],
+        "negocio": [l.get('displayName', {}).get('text') for l in lugares],
+        "rating": [float(l.get('rating') or 0.0) for l in lugares],
+        "opiniones": [int(l.get('userRatingCount') or 0) for l in lugares],
+        "distancia_km": [0.0 if l['id'] == id_objetivo else l.get('distanciaKm') for l in lugares],
+        "es_objetivo": [l['id'] == id_objetivo for l in lugares],
+    }
+
+
+class HistorialMercados:
+    """Historial columnar por mercado sobre archivos Parquet."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def _carpeta(self, mercado):
+        return os.path.join(self.directorio, mercado[:32])
+
+    def registrar(self, mercado, lugares, id_objetivo=None, momento=None):
+        """Agrega la foto de una auditoría. Devuelve la cantidad de lugares registrados."""
+        columnas = filas_historial(lugares, id_objetivo)
+        if not columnas["id"]:
+            return 0
+        momento = int(momento if momento is not None else time.time())
+        columnas["momento"] = [momento] * len(columnas["id"])
+        tabla = pa.Table.from_pydict(columnas, schema=ESQUEMA)
+        carpeta = self._carpeta(mercado)
+        os.makedirs(carpeta, exist_ok=True)
+        pq.write_table(tabla, os.path.join(carpeta, f"{momento}-{uuid.uuid4().hex[:8]}.parquet"))
+        self._compactar_si_hace_falta(carpeta)
+        return tabla.num_rows
+
+    def _compactar_si_hace_falta(self, carpeta):
+        with self._lock:
+            archivos = sorted(f for f in os.listdir(carpeta) if f.endswith(".parquet"))
+            if len(archivos) < COMPACTAR_DESDE:
+                return
+            rutas = [os.path.join(carpeta, f) for f in archivos]
+            tabla = pa.concat_tables(pq.read_table(r, schema=ESQUEMA) for r in rutas)
+            temporal = os.path.join(carpeta, f"compactado-{uuid.uuid4().hex[:8]}.tmp")
+            pq.write_table(tabla, temporal)
+            os.replace(temporal, os.path.join(carpeta, f"0-compactado-{uuid.uuid4().hex[:8]}.parquet"))
+            for r in rutas:
+                os.remove(r)
+
+    def leer(self, mercado):
+        """DataFrame con todas las fotos del mercado (vacío si no hay historial)."""
+        carpeta = self._carpeta(mercado)
+        try:
+            rutas = [os.path.join(carpeta, f) for f in os.listdir(carpeta) if f.endswith(".parquet")]
+        except FileNotFoundError:
+            rutas = []
+        if not rutas:
+            return ESQUEMA.empty_table().to_pandas()
+        df = pq.read_table(rutas, schema=ESQUEMA).to_pandas()
+        # Dos procesos compactando a la vez pueden dejar la misma foto repetida
+        return df.drop_duplicates(["momento", "id"], ignore_index=True)
+
+
+_historial = None
+_lock_historial = threading.Lock()
+
+
+def obtener_historial():
+    """Historial de mercados, uno por proceso."""
+    global _historial
+    with _lock_historial:
+        if _historial is None:
+            _historial = HistorialMercados(ruta_datos("historial"))
+        return _historial
+
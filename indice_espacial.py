@@ -0,0 +1,180 @@
+import heapq
+import math
+import os
+import threading
+import time
+
+import geo
+
+# --- ÍNDICE ESPACIAL DE LUGARES (en memoria, por proceso) ---
+# Todo lugar que trae Places queda en un balde de la grilla geohash, marcado con el rubro que lo encontró,
+# los campos que trajo y cuándo. Aparte se anota qué celdas quedaron enumeradas por completo para un rubro
+# (una búsqueda que no llegó al tope de resultados): esas celdas se pueden responder sin volver a la API.
+# Una búsqueda que enumeró un círculo entero lo anota también como círculo: así su borde, que corta celdas
+# al medio, no queda como pendiente para una consulta que cae dentro de él.
+PRECISION = 7  # celdas de ~150 m
+FRESCURA_SEG = int(os.environ.get("INDICE_FRESCURA_SEG", 6 * 3600))
+MAX_LUGARES = int(os.environ.get("INDICE_MAX_LUGARES", 200_000))
+
+
+def normalizar_rubro(rubro):
+    return " ".join(rubro.lower().split())
+
+
+class IndiceEspacial:
+    """Lugares por celda y cobertura por (rubro, celda). Seguro entre hilos."""
+
+    def __init__(self, precision=PRECISION, frescura_seg=FRESCURA_SEG, max_lugares=MAX_LUGARES):
+        self.precision = precision
+        self.frescura_seg = frescura_seg
+        self.max_lugares = max_lugares
+        self._lock = threading.Lock()
+        self._lugares = {}    # id -> {"lugar", "celda", "campos": {campo: momento}, "rubros": {rubro: momento}}
+        self._por_celda = {}  # celda -> {ids}
+        self._cobertura = {}  # (rubro, celda) -> (momento, campos)
+        self._circulos = {}   # rubro -> [(lat, lng, radio_km, momento, campos)]
+
+    def registrar(self, lugares, rubro, campos, cubiertas=(), circulo=None, momento=None):
+        """
+        Agrega (o actualiza) lugares encontrados buscando `rubro` con `campos`.
+        cubiertas: celdas que esa búsqueda enumeró por completo. circulo: (lat, lng, radio_km) si enumeró
+        el círculo entero.
+        """
+        rubro = normalizar_rubro(rubro)
+        campos = frozenset(campos) - {"nextPageToken"}
+        momento = momento or time.time()
+        with self._lock:
+            for lugar in lugares:
+                loc = lugar.get('location')
+                if not lugar.get('id') or not loc:
+                    continue
+                entrada = self._lugares.get(lugar['id'])
+                if entrada is None:
+                    celda = geo.celda_geohash(loc['latitude'], loc['longitude'], self.precision)
+                    entrada = self._lugares[lugar['id']] = {"lugar": {}, "celda": celda, "campos": {},
+                                                            "rubros": {}}
+                    self._por_celda.setdefault(celda, set()).add(lugar['id'])
+                self._mezclar(entrada, lugar, campos, momento)
+                entrada["rubros"][rubro] = momento
+            for celda in cubiertas:
+                self._cobertura[(rubro, celda)] = (momento, campos)
+            if circulo:
+                self._circulos.setdefault(rubro, []).append((*circulo, momento, campos))
+            if len(self._lugares) > self.max_lugares:
+                self._purgar(time.time())
+
+    @staticmethod
+    def _mezclar(entrada, lugar, campos, momento):
+        # Una búsqueda liviana no borra las reseñas que trajo una completa: cada campo recuerda cuándo llegó
+        entrada["lugar"] = {**entrada["lugar"],
+                            **{k: v for k, v in lugar.items() if k not in ('distanciaKm', 'fueraDeRadio',
+                                                                           'rubrosCoincidentes')}}
+        entrada["campos"].update(dict.fromkeys(campos, momento))
+
+    def completar(self, por_id, campos, momento=None):
+        """Suma campos (ej. los pesados de Place Details) a lugares que ya están en el índice."""
+        campos = frozenset(campos)
+        momento = momento or time.time()
+        with self._lock:
+            for id_lugar, datos in por_id.items():
+                entrada = self._lugares.get(id_lugar)
+                if entrada is not None:
+                    self._mezclar(entrada, datos, campos, momento)
+
+    def _tiene(self, entrada, campos, limite):
+        return all(entrada["campos"].get(c, 0) >= limite for c in campos)
+
+    def lugar_con_campos(self, id_lugar, campos):
+        """Copia del lugar si el índice ya tiene esos campos frescos; si no, None."""
+        limite = time.time() - self.frescura_seg
+        with self._lock:
+            entrada = self._lugares.get(id_lugar)
+            if entrada is None or not self._tiene(entrada, campos, limite):
+                return None
+            return dict(entrada["lugar"])
+
+    @staticmethod
+    def _ultima_vez(entrada):
+        return max(entrada["campos"].values())
+
+    def _purgar(self, ahora):
+        limite = ahora - self.frescura_seg
+        for id_lugar, entrada in list(self._lugares.items()):
+            if self._ultima_vez(entrada) < limite:
+                del self._lugares[id_lugar]
+                self._por_celda[entrada["celda"]].discard(id_lugar)
+        # Si aun así sobran, se van los que hace más tiempo que no se actualizan
+        sobrantes = len(self._lugares) - self.max_lugares
+        if sobrantes > 0:
+            viejos = heapq.nsmallest(sobrantes, self._lugares, key=lambda i: self._ultima_vez(self._lugares[i]))
+            corte = self._ultima_vez(self._lugares[viejos[-1]])
+            for id_lugar in viejos:
+                self._por_celda[self._lugares.pop(id_lugar)["celda"]].discard(id_lugar)
+            # Una cobertura anotada antes de ese corte puede contar con lugares que ya no están
+            limite = math.nextafter(max(limite, corte), math.inf)
+        self._cobertura = {k: v for k, v in self._cobertura.items() if v[0] >= limite}
+        self._circulos = {r: [c for c in lista if c[3] >= limite] for r, lista in self._circulos.items()}
+
+    def celdas_pendientes(self, lat, lng, radio_km, rubro, campos):
+        """(celdas que toca el círculo, las que no tienen cobertura fresca con esos campos)."""
+        rubro = normalizar_rubro(rubro)
+        campos = frozenset(campos)
+        limite = time.time() - self.frescura_seg
+        celdas = geo.celdas_geohash_en_circulo(lat, lng, radio_km, self.precision)
+        with self._lock:
+            pendientes = []
+            for celda in celdas:
+                cob = self._cobertura.get((rubro, celda))
+                if cob is None or cob[0] < limite or not campos <= cob[1]:
+                    pendientes.append(celda)
+            circulos = [c[:3] for c in self._circulos.get(rubro, ()) if c[3] >= limite and campos <= c[4]]
+        for c_lat, c_lng, c_radio in circulos:
+            if not pendientes:
+                break
+            if geo.distancias_km(c_lat, c_lng, [lat], [lng])[0] + radio_km <= c_radio:
+                return celdas, []  # la consulta entera cae dentro de un círculo ya enumerado
+            dentro = geo.celdas_geohash_en_circulo(c_lat, c_lng, c_radio, self.precision)
+            pendientes = [p for p in pendientes if not dentro.get(p)]
+        return celdas, pendientes
+
+    def consultar(self, lat, lng, radio_km, rubro, campos):
+        """Lugares frescos del rubro dentro del círculo, del más cercano al más lejano (copias)."""
+        rubro = normalizar_rubro(rubro)
+        campos = frozenset(campos)
+        limite = time.time() - self.frescura_seg
+        celdas = geo.celdas_geohash_en_circulo(lat, lng, radio_km, self.precision)
+        candidatos = []
+        with self._lock:
+            for celda in celdas:
+                for id_lugar in self._por_celda.get(celda, ()):
+                    entrada = self._lugares[id_lugar]
+                    if entrada["rubros"].get(rubro, 0) >= limite and self._tiene(entrada, campos, limite):
+                        candidatos.append(dict(entrada["lugar"]))
+        dentro, _ = geo.filtrar_por_radio(candidatos, lat, lng, radio_km)
+        for lugar in dentro:
+            lugar.pop('fueraDeRadio', None)
+        return sorted(dentro, key=lambda l: l['distanciaKm'])
+
+    def limpiar(self):
+        with self._lock:
+            self._lugares.clear()
+            self._por_celda.clear()
+            self._cobertura.clear()
+            self._circulos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {"lugares": len(self._lugares), "celdas_cubiertas": len(self._cobertura)}
+
+
+_indice = None
+_lock_indice = threading.Lock()
+
+
+def obtener_indice_espacial():
+    """Índice espacial compartido por todas las sesiones del proceso."""
+    global _indice
+    with _lock_indice:
+        if _indice is None:
+            _indice = IndiceEspacial()
+        return _indice
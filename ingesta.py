@@ -0,0 +1,146 @@
+import codecs
+import csv
+import io
+
+import pandas as pd
+
+try:
+    from charset_normalizer import from_bytes  # viene con requests
+except ImportError:
+    from_bytes = None
+
+# --- INGESTA DE ARCHIVOS DE RESEÑAS ---
+POSIBLES_NOMBRES = ['comentario', 'review', 'opinión', 'opinion', 'texto', 'feedback', 'mensaje']
+BYTES_MUESTRA = 64 * 1024
+FILAS_POR_BLOQUE = 20000
+AVISAR_CADA = 5000  # filas entre avisos de progreso (xlsx)
+# UTF-32 antes que UTF-16: el BOM UTF-32 LE empieza con el de UTF-16 LE
+BOMS = [(codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+
+def detectar_columna(encabezados):
+    """Devuelve el nombre de la columna de reseñas a partir de la fila de encabezados (o None)."""
+    cols = [str(c).lower() if c is not None else "" for c in encabezados]
+    for candidato in POSIBLES_NOMBRES:
+        matches = [i for i, c in enumerate(cols) if candidato in c]
+        if matches:
+            return encabezados[matches[0]]
+    return None
+
+
+def detectar_codificacion(muestra):
+    """
+    Primero el BOM (los exports "Texto Unicode" de Excel son UTF-16); después UTF-8 si decodifica limpio;
+    si no, Windows-1252 (lo típico de los exports de Excel en español). Bytes nulos o algo que ni cp1252
+    acepta quedan para charset_normalizer; último recurso latin-1.
+    """
+    for bom, codificacion in BOMS:
+        if muestra.startswith(bom):
+            return codificacion
+    try:
+        muestra.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # Una muestra cortada puede partir un carácter multibyte al final: eso no invalida UTF-8
+        if e.start >= len(muestra) - 3:
+            return 'utf-8-sig'
+    if b'\x00' not in muestra:  # cp1252 acepta casi cualquier byte: un UTF-16 sin BOM pasaría por texto
+        try:
+            muestra.decode('cp1252')
+            return 'cp1252'
+        except UnicodeDecodeError:
+            pass
+    if from_bytes is not None:
+        mejor = from_bytes(muestra).best()
+        if mejor is not None:
+            return mejor.encoding
+    return 'latin-1'
+
+
+def _tamano(file):
+    tamano = getattr(file, 'size', None)
+    if tamano is None:
+        pos = file.tell()
+        file.seek(0, io.SEEK_END)
+        tamano = file.tell()
+        file.seek(pos)
+    return tamano or 1
+
+
+def _iterar_csv(file, progreso):
+    file.seek(0)
+    muestra = file.read(BYTES_MUESTRA)
+    file.seek(0)
+    codificacion = detectar_codificacion(muestra)
+    texto_muestra = muestra.decode(codificacion, errors='replace')
+    try:
+        separador = csv.Sniffer().sniff(texto_muestra.split('\n', 1)[0], delimiters=',;\t|').delimiter
+    except csv.Error:
+        separador = ','
+
+    encabezados = next(csv.reader([texto_muestra.splitlines()[0] if texto_muestra else ""], delimiter=separador))
+    columna = detectar_columna(encabezados)
+    if columna is None:
+        return
+
+    tamano = _tamano(file)
+    # Sólo se parsea la columna de reseñas, por bloques: la memoria no crece con el archivo
+    lector = pd.read_csv(file, usecols=[columna], dtype=str, sep=separador, encoding=codificacion,
+                         encoding_errors='replace', chunksize=FILAS_POR_BLOQUE, on_bad_lines='skip')
+    for bloque in lector:
+        yield from bloque[columna].dropna().tolist()
+        if progreso:
+            progreso(min(file.tell() / tamano, 1.0))
+
+
+def _iterar_xlsx(file, progreso):
+    from openpyxl import load_workbook
+
+    file.seek(0)
+    libro = load_workbook(file, read_only=True, data_only=True)
+    try:
+        hoja = libro.active
+        filas = hoja.iter_rows(values_only=True)
+        encabezados = list(next(filas, []))
+        columna = detectar_columna(encabezados)
+        if columna is None:
+            return
+        idx = encabezados.index(columna)
+        total = hoja.max_row or 0
+        for i, fila in enumerate(filas, start=1):
+            if idx < len(fila) and fila[idx] is not None:
+                yield str(fila[idx])
+            if progreso and total and i % AVISAR_CADA == 0:
+                progreso(min(i / total, 1.0))
+    finally:
+        libro.close()
+
+
+def iterar_reseñas(file, progreso=None):
+    """
+    Recorre las reseñas de un CSV/XLSX sin cargar el archivo entero:
+    detecta la columna desde el encabezado y lee sólo esa columna.
+    progreso: callback opcional que recibe la fracción leída (0 a 1).
+    """
+    lector = _iterar_csv if file.name.lower().endswith('.csv') else _iterar_xlsx
+    for texto in lector(file, progreso):
+        texto = texto.strip()
+        if texto:
+            yield texto
+    if progreso:
+        progreso(1.0)
+
+
+def cargar_reseñas_archivo(file, progreso=None, limite=None):
+    """Lista de reseñas del archivo (vacía si no se encuentra la columna o el archivo es inválido)."""
+    reseñas = []
+    try:
+        for texto in iterar_reseñas(file, progreso):
+            reseñas.append(texto)
+            if limite and len(reseñas) >= limite:
+                break
+    except Exception as e:
+        print(f"Error archivo: {e}")
+        return []
+    return reseñas
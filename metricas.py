@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# --- MOTOR DE MÉTRICAS (vectorizado) ---
+# Todo opera sobre columnas completas (NumPy / groupby de pandas), sin recorrer lugares en Python:
+# miles de lugares por muchas auditorías se resuelven en milisegundos.
+# Entrada: el DataFrame del historial (momento, id, negocio, rating, opiniones, distancia_km, es_objetivo).
+TOP_LIDERES = 3
+MIN_OPINIONES_LIDER = 100  # mismo criterio que los líderes del reporte
+CUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+def promedios(rating, opiniones):
+    """(promedio simple, promedio ponderado por opiniones) de dos arrays; 0 si no hay datos."""
+    rating = np.asarray(rating, dtype=float)
+    opiniones = np.asarray(opiniones, dtype=float)
+    simple = rating.mean() if rating.size else 0.0
+    total = opiniones.sum()
+    ponderado = float(rating @ opiniones) / total if total > 0 else 0.0
+    return float(simple), ponderado
+
+
+def rating_bayesiano(df):
+    """
+    Rating suavizado por volumen: (n·r + m·C) / (n + m), por auditoría.
+    C es el promedio ponderado del mercado y m la mediana de opiniones: un 5.0 con 3 opiniones
+    queda cerca del promedio, uno con 2.000 opiniones casi no se mueve.
+    """
+    por_momento = df["momento"]
+    votos = df["rating"] * df["opiniones"]
+    total = df["opiniones"].groupby(por_momento).transform("sum")
+    media = votos.groupby(por_momento).transform("sum") / total.where(total > 0)
+    m = df["opiniones"].groupby(por_momento).transform("median")
+    return ((votos + m * media) / (df["opiniones"] + m)).fillna(df["rating"])
+
+
+def velocidad_reseñas(df):
+    """Reseñas nuevas por día de cada lugar respecto de su foto anterior (NaN en la primera aparición)."""
+    orden = df.sort_values(["id", "momento"])
+    grupos = orden.groupby("id", sort=False)
+    dias = grupos["momento"].diff().dt.total_seconds() / 86400
+    nuevas = grupos["opiniones"].diff().clip(lower=0)
+    return (nuevas / dias.where(dias > 0)).reindex(df.index)
+
+
+def rotacion_lideres(df, top=TOP_LIDERES, min_opiniones=MIN_OPINIONES_LIDER):
+    """
+    Por auditoría, fracción del top de líderes (rating, con un mínimo de opiniones) que no estaba
+    en el top de la auditoría anterior. 0 = mismos líderes, 1 = recambio total. NaN en la primera.
+    """
+    candidatos = df[df["opiniones"] >= min_opiniones]
+    puesto = candidatos.groupby("momento")["rating"].rank(method="first", ascending=False)
+    lideres = candidatos[puesto <= top]
+    momentos = pd.Index(sorted(df["momento"].unique()), name="momento")
+    if lideres.empty:
+        return pd.Series(np.nan, index=momentos, name="rotacion_lideres")
+    matriz = pd.crosstab(lideres["momento"], lideres["id"]).reindex(momentos, fill_value=0).astype(bool)
+    previa = matriz.shift(1, fill_value=False)
+    entraron = (matriz & ~previa).sum(axis=1)
+    rotacion = entraron / matriz.sum(axis=1).replace(0, np.nan)
+    rotacion.iloc[0] = np.nan
+    return rotacion.rename("rotacion_lideres")
+
+
+def tendencias(df):
+    """
+    Una fila por auditoría: negocios, promedios (simple, ponderado, bayesiano), percentiles de rating,
+    volumen de opiniones, velocidad de reseñas (mediana y total del mercado) y rotación de líderes.
+    """
+    if df.empty:
+        return pd.DataFrame()
+    df = df.assign(votos=df["rating"] * df["opiniones"], bayesiano=rating_bayesiano(df),
+                   velocidad=velocidad_reseñas(df))
+    grupos = df.groupby("momento")
+    res = grupos.agg(negocios=("id", "size"), prom_simple=("rating", "mean"), opiniones=("opiniones", "sum"),
+                     votos=("votos", "sum"), prom_bayesiano=("bayesiano", "mean"),
+                     velocidad_mediana=("velocidad", "median"), velocidad_mercado=("velocidad", "sum"))
+    res["prom_ponderado"] = res["votos"] / res["opiniones"].where(res["opiniones"] > 0)
+    percentiles = grupos["rating"].quantile(list(CUANTILES)).unstack()
+    percentiles.columns = [f"p{int(q * 100)}" for q in CUANTILES]
+    res = res.drop(columns="votos").join(percentiles).join(rotacion_lideres(df))
+    # La velocidad necesita dos fotos: en la primera auditoría no hay contra qué comparar
+    res.loc[res.index[0], ["velocidad_mediana", "velocidad_mercado"]] = np.nan
+    objetivo = df[df["es_objetivo"]].set_index("momento")
+    if not objetivo.empty:
+        res = res.join(objetivo[["rating", "opiniones", "bayesiano"]].add_prefix("objetivo_"))
+    return res.reset_index()
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+
+import google.generativeai as genai
+
+from cache import hash_clave, obtener_cache_ia
+from coalescer import Coalescedor, EsperaVencida
+from constructor_prompt import estimar_tokens
+from planificador import PLANIFICADOR_GEMINI
+from trazas import tramo
+
+# --- MODELO IA ---
+# Cambiar de modelo es una sola edición: variable de entorno GEMINI_MODEL (o secreto en la app).
+MODELO_POR_DEFECTO = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+TIMEOUT_IA_SEG = 90
+ESPERA_COALESCIDA_SEG = TIMEOUT_IA_SEG + 30  # un poco más que lo que puede tardar el líder (turno + llamada)
+# Endpoint alternativo (ej. un proxy o el backend falso del benchmark). Vacío = API pública de Google.
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+
+# --- CONFIGURACIONES DE GENERACIÓN USADAS POR LA APP ---
+CONFIG_JSON = {"response_mime_type": "application/json"}
+CONFIG_REPORTE = {"temperature": 0.15}
+CONFIG_AUDITORIA = {"temperature": 0.2}
+CONFIGS_CONOCIDAS = [CONFIG_JSON, CONFIG_REPORTE, CONFIG_AUDITORIA]
+
+_modelo_actual = MODELO_POR_DEFECTO
+_api_key_configurada = None
+_handles = {}
+_lock = threading.Lock()
+_vuelos = Coalescedor("gemini", ESPERA_COALESCIDA_SEG)  # el mismo prompt pedido a la vez por varias sesiones se genera una vez
+
+
+def limitar_concurrencia(n):
+    """Tope de llamadas simultáneas a Gemini en todo el proceso (el runner batch lo ajusta)."""
+    PLANIFICADOR_GEMINI.limitar_concurrencia(n)
+
+
+def configurar_modelo(nombre):
+    """Cambia el modelo de todo el proceso (los handles viejos quedan sin uso)."""
+    global _modelo_actual
+    with _lock:
+        _modelo_actual = nombre or MODELO_POR_DEFECTO
+
+
+def nombre_modelo():
+    return _modelo_actual
+
+
+def obtener_modelo(api_key, generation_config):
+    """
+    Registro de modelos: un GenerativeModel por (modelo, configuración), construido una sola vez por proceso.
+    genai.configure se llama sólo cuando cambia la API key.
+    """
+    global _api_key_configurada
+    clave = (_modelo_actual, json.dumps(generation_config, sort_keys=True))
+    with _lock:
+        if _api_key_configurada != api_key:
+            if GEMINI_API_ENDPOINT:
+                genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+            else:
+                genai.configure(api_key=api_key)
+            _api_key_configurada = api_key
+            _handles.clear()
+        if clave not in _handles:
+            _handles[clave] = genai.GenerativeModel(_modelo_actual, generation_config=generation_config)
+        return _handles[clave]
+
+
+def calentar(api_key):
+    """
+    Construye los handles de las configuraciones conocidas y abre la conexión con una llamada barata
+    (count_tokens no consume cuota de generación). Corre en segundo plano: no demora la primera página.
+    """
+    def _calentar():
+        try:
+            for config in CONFIGS_CONOCIDAS:
+                obtener_modelo(api_key, config)
+            obtener_modelo(api_key, CONFIG_REPORTE).count_tokens("ping")
+        except Exception as e:
+            print(f"Error IA (calentamiento): {e}")
+
+    threading.Thread(target=_calentar, name="calentar-gemini", daemon=True).start()
+
+
+def consultar_gemini(prompt, api_key, generation_config, timeout=TIMEOUT_IA_SEG, usar_cache=True):
+    """
+    Llama a Gemini y devuelve el texto de la respuesta.
+    La respuesta se cachea por hash de (modelo, configuración, prompt): repetir una auditoría no vuelve a pagar la IA.
+    usar_cache=False fuerza una consulta nueva (y actualiza la caché).
+    """
+    cache = obtener_cache_ia()
+    clave = hash_clave(nombre_modelo(), generation_config, prompt)
+    with tramo("gemini", salida=_tipo_salida(generation_config), tokens_entrada=estimar_tokens(prompt)) as t:
+        if usar_cache:
+            guardado = cache.obtener(clave)
+            if guardado is not None:
+                t.update(cache_hit=True, bytes=len(guardado.encode("utf-8")))
+                return guardado
+
+        vuelo, es_lider = _vuelos.unirse(clave)
+        if not es_lider:
+            t.update(cache_hit=False, coalescido=True)
+            try:
+                return _vuelos.esperar(vuelo)
+            except EsperaVencida as e:
+                # El líder quedó colgado: esta sesión genera por su cuenta
+                print(f"Error IA (coalescencia): {e}")
+                t.update(espera_vencida=True)
+                return _generar(prompt, api_key, generation_config, timeout, cache, clave)
+        try:
+            texto = _generar(prompt, api_key, generation_config, timeout, cache, clave)
+        except Exception as e:
+            _vuelos.aterrizar(clave, vuelo, error=e)
+            raise
+        _vuelos.aterrizar(clave, vuelo, resultado=texto)
+        t.update(cache_hit=False, bytes=len(texto.encode("utf-8")), tokens_salida=estimar_tokens(texto))
+        return texto
+
+
+def _tipo_salida(generation_config):
+    return "json" if generation_config.get("response_mime_type") == "application/json" else "texto"
+
+
+def _generar(prompt, api_key, generation_config, timeout, cache, clave):
+    model = obtener_modelo(api_key, generation_config)
+    with PLANIFICADOR_GEMINI.turno(tokens=estimar_tokens(prompt)):
+        texto = model.generate_content(prompt, request_options={"timeout": timeout}).text
+    PLANIFICADOR_GEMINI.registrar_tokens(estimar_tokens(texto))
+    return _guardar_si_valido(cache, clave, generation_config, texto)
+
+
+def consultar_gemini_stream(prompt, api_key, generation_config, timeout=TIMEOUT_IA_SEG, usar_cache=True):
+    """
+    Igual que consultar_gemini pero va entregando el texto a medida que el modelo lo genera.
+    Con un hit de caché entrega la respuesta completa de una vez. Al terminar, guarda el texto completo.
+    Si otra sesión ya está generando el mismo prompt, espera ese resultado y lo entrega de una vez.
+    """
+    cache = obtener_cache_ia()
+    clave = hash_clave(nombre_modelo(), generation_config, prompt)
+    with tramo("gemini.stream", salida=_tipo_salida(generation_config), tokens_entrada=estimar_tokens(prompt)) as t:
+        if usar_cache:
+            guardado = cache.obtener(clave)
+            if guardado is not None:
+                t.update(cache_hit=True, bytes=len(guardado.encode("utf-8")))
+                yield guardado
+                return
+
+        vuelo, es_lider = _vuelos.unirse(clave)
+        if not es_lider:
+            t.update(cache_hit=False, coalescido=True)
+            try:
+                yield _vuelos.esperar(vuelo)
+                return
+            except EsperaVencida as e:
+                print(f"Error IA (coalescencia): {e}")
+                t.update(espera_vencida=True)
+                vuelo = None  # el líder quedó colgado: esta sesión genera por su cuenta, sin vuelo propio
+        try:
+            partes = []
+            yield from _generar_stream(prompt, api_key, generation_config, timeout, partes, t)
+            completo = _guardar_si_valido(cache, clave, generation_config, "".join(partes))
+        except BaseException as e:
+            # Incluye GeneratorExit (la sesión dejó de leer): quienes esperaban no quedan colgados
+            if vuelo is not None:
+                _vuelos.aterrizar(clave, vuelo,
+                                  error=e if isinstance(e, Exception) else RuntimeError("stream cortado"))
+            raise
+        if vuelo is not None:
+            _vuelos.aterrizar(clave, vuelo, resultado=completo)
+        t.update(cache_hit=False, bytes=len(completo.encode("utf-8")), tokens_salida=estimar_tokens(completo))
+
+
+def _generar_stream(prompt, api_key, generation_config, timeout, partes, t):
+    """Fragmentos del modelo a medida que llegan; los va sumando a `partes`."""
+    model = obtener_modelo(api_key, generation_config)
+    inicio = time.perf_counter()
+    with PLANIFICADOR_GEMINI.turno(tokens=estimar_tokens(prompt)):
+        for chunk in model.generate_content(prompt, stream=True, request_options={"timeout": timeout}):
+            texto = chunk.text
+            if not partes:
+                t["primer_fragmento_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            partes.append(texto)
+            yield texto
+    PLANIFICADOR_GEMINI.registrar_tokens(sum(estimar_tokens(p) for p in partes))
+
+
+def _guardar_si_valido(cache, clave, generation_config, texto):
+    # Sólo guardamos respuestas utilizables: un JSON roto no debe quedar pegado en la caché
+    if generation_config.get("response_mime_type") == "application/json":
+        try:
+            json.loads(texto)
+        except ValueError:
+            return texto
+    cache.guardar(clave, texto)
+    return texto
@@ -0,0 +1,175 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from trazas import tramo
+
+# --- CONFIGURACIÓN SMTP ---
+# Para probar sin Gmail: levantar un servidor local (ej. `python -m aiosmtpd -n -l localhost:8025`)
+# y usar SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT_SEG = 20
+DESTINATARIO_LEADS = "Mnsamame@gmail.com"
+
+# --- LOTES Y REINTENTOS ---
+VENTANA_LOTE_SEG = 20  # los leads que llegan dentro de esta ventana salen en un solo mail
+MAX_LOTE = 25
+MAX_COLA = 1000
+REINTENTOS_MAX = 4
+BACKOFF_SEG = 2  # 2s, 4s, 8s, 16s
+
+
+def _formatear_lead(lead):
+    return f"""
+    👤 Email: {lead['usuario_email']}
+    🔍 Tipo: {lead['tipo_busqueda']}
+    🏢 Detalle: {lead['detalle']}
+    📍 Ubicación: {lead['coordenadas']}
+    📏 Radio: {lead['radio']} km
+    """
+
+
+def armar_mensaje(leads, remitente, destinatario):
+    """Un lead: el mail de siempre. Varios: un resumen con todos."""
+    msg = MIMEMultipart()
+    msg['From'] = remitente
+    msg['To'] = destinatario
+    if len(leads) == 1:
+        msg['Subject'] = f"🔔 Nuevo Lead Radar CX: {leads[0]['tipo_busqueda']}"
+        cuerpo = "\n    Hola Matías,\n    Un nuevo usuario ha ejecutado una auditoría.\n" + _formatear_lead(leads[0])
+    else:
+        msg['Subject'] = f"🔔 {len(leads)} nuevos Leads Radar CX"
+        cuerpo = (f"\n    Hola Matías,\n    {len(leads)} usuarios ejecutaron auditorías.\n"
+                  + "\n    ---".join(_formatear_lead(l) for l in leads))
+    msg.attach(MIMEText(cuerpo, 'plain'))
+    return msg
+
+
+class ColaNotificaciones:
+    """
+    Envía los avisos de leads en segundo plano.
+    - encolar() no bloquea: la auditoría no espera al SMTP.
+    - Un hilo worker junta los leads de una ventana corta y los manda como un solo mail.
+    - La conexión autenticada se reutiliza entre envíos (se verifica con NOOP antes de usarla).
+    - Reintenta con backoff exponencial y reconecta si el servidor cortó.
+    """
+
+    def __init__(self, remitente, password, destinatario=DESTINATARIO_LEADS, host=SMTP_HOST, port=SMTP_PORT,
+                 starttls=SMTP_STARTTLS, ventana_seg=VENTANA_LOTE_SEG, max_lote=MAX_LOTE):
+        self.remitente = remitente
+        self.password = password
+        self.destinatario = destinatario
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.ventana_seg = ventana_seg
+        self.max_lote = max_lote
+        self.enviados = 0
+        self.fallidos = 0
+        self._cola = queue.Queue(maxsize=MAX_COLA)
+        self._smtp = None
+        self._hilo = threading.Thread(target=self._trabajar, name="notificaciones-smtp", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, lead):
+        try:
+            self._cola.put_nowait(lead)
+            return True
+        except queue.Full:
+            print("Error mail: cola de notificaciones llena, se descarta el lead")
+            return False
+
+    def detener(self, timeout=None):
+        """Vacía lo pendiente y cierra la conexión (útil en tests y al apagar el proceso)."""
+        self._cola.put(None)
+        self._hilo.join(timeout)
+
+    def _trabajar(self):
+        while True:
+            primero = self._cola.get()
+            if primero is None:
+                break
+            lote = [primero]
+            limite = time.monotonic() + self.ventana_seg
+            fin = False
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lead = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if lead is None:
+                    fin = True
+                    break
+                lote.append(lead)
+            try:
+                self._enviar_con_reintentos(lote)
+            except Exception as e:
+                # Cualquier otro error (armar el mensaje, credenciales con caracteres raros...) pierde este lote,
+                # no el worker: si el hilo muere, encolar() seguiría aceptando leads que nadie manda
+                print(f"Error mail (lote descartado): {e!r}")
+                self.fallidos += len(lote)
+                self._cerrar()
+            if fin:
+                break
+        self._cerrar()
+
+    def _conexion(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._cerrar()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SEG)
+        if self.starttls:
+            smtp.starttls()
+        if self.password:
+            smtp.login(self.remitente, self.password)
+        self._smtp = smtp
+        return smtp
+
+    def _cerrar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _enviar_con_reintentos(self, lote):
+        msg = armar_mensaje(lote, self.remitente, self.destinatario).as_string()
+        for intento in range(REINTENTOS_MAX + 1):
+            try:
+                with tramo("smtp.envio", leads=len(lote), bytes=len(msg)):
+                    self._conexion().sendmail(self.remitente, self.destinatario, msg)
+                self.enviados += len(lote)
+                return True
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"Error mail (intento {intento + 1}): {e}")
+                self._cerrar()
+                if intento < REINTENTOS_MAX:
+                    time.sleep(BACKOFF_SEG * 2 ** intento)
+        self.fallidos += len(lote)
+        return False
+
+
+_colas = {}
+_lock_colas = threading.Lock()
+
+
+def obtener_cola_notificaciones(remitente, password):
+    """Una cola (y un worker) por proceso, compartida entre sesiones y reruns de Streamlit."""
+    with _lock_colas:
+        if remitente not in _colas:
+            _colas[remitente] = ColaNotificaciones(remitente, password)
+        return _colas[remitente]
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import CacheSQLite, hash_clave, ruta_datos
+from planificador import PLANIFICADOR_PLACES
+from trazas import tramo
+
+# --- CONFIGURACIÓN DEL CLIENTE PLACES ---
+PLACES_BASE_URL = os.environ.get("PLACES_BASE_URL", "https://places.googleapis.com/v1")
+TIMEOUT_CONEXION_SEG = 5
+TIMEOUT_LECTURA_SEG = 20
+REINTENTOS_MAX = 3
+BACKOFF_SEG = 0.5  # 0.5s, 1s, 2s...
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+POOL_CONEXIONES = 20
+
+# --- CACHÉ DE BÚSQUEDAS ---
+CACHE_TTL_SEG = int(os.environ.get("PLACES_CACHE_TTL_SEG", 24 * 3600))
+CACHE_MAX_ENTRADAS = int(os.environ.get("PLACES_CACHE_MAX_ENTRADAS", 5000))
+DECIMALES_UBICACION = 4  # ~11 m: dos búsquedas "en el mismo lugar" comparten entrada
+
+# --- MÁSCARAS DE CAMPOS ---
+# Un solo lugar para definir qué pide cada búsqueda (el precio del SKU depende de esto).
+# Candidatos: con id, ubicación y rubro la auditoría arranca sin volver a buscar el negocio por texto
+CAMPOS_CANDIDATOS = ["id", "displayName", "formattedAddress", "location", "primaryTypeDisplayName"]
+CAMPOS_DIRECCION = ["formattedAddress", "location"]
+# Ligeros: alcanzan para tabla, KPIs y mapa. Pesados: sólo para el análisis cualitativo (reseñas, descripción...).
+CAMPOS_LIGEROS = ["id", "displayName", "formattedAddress", "rating", "userRatingCount", "primaryTypeDisplayName",
+                  "googleMapsUri", "location"]
+CAMPOS_PESADOS = ["reviews", "editorialSummary", "priceLevel", "websiteUri"]
+CAMPOS_DETALLE = CAMPOS_LIGEROS + CAMPOS_PESADOS
+
+
+def armar_field_mask(campos, prefijo="places."):
+    """Convierte una lista de campos en el header X-Goog-FieldMask."""
+    return ",".join(c if c == "nextPageToken" else f"{prefijo}{c}" for c in campos)
+
+
+def _normalizar_parametros(valor):
+    """Redondea coordenadas y normaliza el texto para que búsquedas equivalentes compartan clave."""
+    if isinstance(valor, dict):
+        normal = {}
+        for k, v in valor.items():
+            if k in ("latitude", "longitude") and isinstance(v, (int, float)):
+                normal[k] = round(v, DECIMALES_UBICACION)
+            elif k == "radius" and isinstance(v, (int, float)):
+                normal[k] = round(v)
+            elif k == "textQuery" and isinstance(v, str):
+                normal[k] = " ".join(v.lower().split())
+            else:
+                normal[k] = _normalizar_parametros(v)
+        return normal
+    if isinstance(valor, list):
+        return [_normalizar_parametros(v) for v in valor]
+    return valor
+
+
+def clave_busqueda(parametros, campos):
+    """Clave de caché: query, ubicación redondeada, radio, idioma y field mask (nunca un pageToken)."""
+    return hash_clave("searchText", _normalizar_parametros(parametros), armar_field_mask(campos))
+
+
+def _segundos_retry_after(resp):
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return None  # ausente o en formato fecha: vale el backoff
+
+
+class ClientePlaces:
+    """
+    Cliente HTTP compartido para Places API (New).
+    Mantiene un pool de conexiones keep-alive, timeouts y reintentos con backoff en 429/5xx.
+    Cada intento pide su propio turno al planificador (el backoff no ocupa un lugar) y un 429 lo frena.
+    Las respuestas de búsqueda se guardan en una caché persistente compartida entre sesiones.
+    """
+
+    def __init__(self, api_key, base_url=PLACES_BASE_URL, cache=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url
+        self.timeout = (TIMEOUT_CONEXION_SEG, TIMEOUT_LECTURA_SEG)
+        adaptador = HTTPAdapter(pool_connections=POOL_CONEXIONES, pool_maxsize=POOL_CONEXIONES)
+        self.sesion = requests.Session()
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+
+    def _pedir(self, metodo, url, **kwargs):
+        """Una llamada con reintentos. El backoff se duerme fuera del turno: no ocupa lugar ni saltea la cuota."""
+        for intento in range(REINTENTOS_MAX + 1):
+            ultimo = intento == REINTENTOS_MAX
+            try:
+                with PLANIFICADOR_PLACES.turno():
+                    resp = self.sesion.request(metodo, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if ultimo:
+                    raise
+                espera = BACKOFF_SEG * 2 ** intento
+            else:
+                if resp.status_code not in ESTADOS_REINTENTABLES or ultimo:
+                    return resp
+                espera = _segundos_retry_after(resp) or BACKOFF_SEG * 2 ** intento
+                if resp.status_code == 429:
+                    PLANIFICADOR_PLACES.frenar(espera)
+            time.sleep(espera)
+
+    def _headers(self, campos, prefijo="places."):
+        return {
+            "Content-Type": "application/json",
+            "X-Goog-Api-Key": self.api_key,
+            "X-Goog-FieldMask": armar_field_mask(campos, prefijo),
+        }
+
+    def buscar_texto(self, parametros, campos, usar_cache=True):
+        """
+        POST places:searchText. Devuelve el JSON completo de la respuesta.
+        Una página pedida con pageToken, o que trae uno, no se cachea sola: el token vence en minutos
+        (las búsquedas paginadas se cachean enteras con buscar_texto_paginado).
+        """
+        paginada = "pageToken" in parametros or "nextPageToken" in campos
+        with tramo("places.searchText") as t:
+            clave = clave_busqueda(parametros, campos) if (usar_cache and self.cache and not paginada) else None
+            if clave:
+                guardado = self.cache.obtener(clave)
+                if guardado is not None:
+                    t["cache_hit"] = True
+                    return json.loads(guardado)
+
+            resp = self._pedir("POST", f"{self.base_url}/places:searchText", headers=self._headers(campos),
+                               json=parametros)
+            resp.raise_for_status()
+            data = resp.json()
+            t.update(cache_hit=False, bytes=len(resp.content), lugares=len(data.get('places', [])))
+            if clave:
+                self.cache.guardar(clave, json.dumps(data, ensure_ascii=False))
+            return data
+
+    def buscar_texto_paginado(self, parametros, campos, paginas_max, usar_cache=True):
+        """
+        Hasta paginas_max páginas de places:searchText. Devuelve (lugares, hay_mas).
+        Todas las páginas van juntas en una sola entrada de caché. Si falla una página después de la primera,
+        se devuelve lo ya traído con hay_mas=True (y no se cachea).
+        """
+        campos = campos + ["nextPageToken"]
+        clave = hash_clave("searchText.paginado", _normalizar_parametros(parametros), armar_field_mask(campos),
+                           paginas_max) if (usar_cache and self.cache) else None
+        if clave:
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                datos = json.loads(guardado)
+                return datos["lugares"], datos["hay_mas"]
+
+        lugares, token = [], None
+        for pagina in range(paginas_max):
+            pedido = {**parametros, "pageToken": token} if token else parametros
+            try:
+                data = self.buscar_texto(pedido, campos, usar_cache=False)
+            except Exception as e:
+                if not lugares:
+                    raise
+                print(f"Error Places (página {pagina + 1}): {e}")
+                return lugares, True
+            lugares.extend(data.get('places', []))
+            token = data.get('nextPageToken')
+            if not token:
+                break
+        if clave:
+            self.cache.guardar(clave, json.dumps({"lugares": lugares, "hay_mas": bool(token)}, ensure_ascii=False))
+        return lugares, bool(token)
+
+    def detalle_lugar(self, place_id, campos, usar_cache=True):
+        """GET places/{id} (Place Details). Devuelve el JSON del lugar con los campos pedidos."""
+        with tramo("places.details") as t:
+            clave = hash_clave("details", place_id, armar_field_mask(campos, "")) if (usar_cache and self.cache) \
+                else None
+            if clave:
+                guardado = self.cache.obtener(clave)
+                if guardado is not None:
+                    t["cache_hit"] = True
+                    return json.loads(guardado)
+
+            resp = self._pedir("GET", f"{self.base_url}/places/{place_id}", params={"languageCode": "es"},
+                               headers=self._headers(campos, prefijo=""))
+            resp.raise_for_status()
+            data = resp.json()
+            t.update(cache_hit=False, bytes=len(resp.content))
+            if clave:
+                self.cache.guardar(clave, json.dumps(data, ensure_ascii=False))
+            return data
+
+
+_clientes = {}
+_cache_busquedas = None
+_lock_clientes = threading.Lock()
+
+
+def limitar_concurrencia(n):
+    """Tope de llamadas simultáneas a Places en todo el proceso (el runner batch lo ajusta)."""
+    PLANIFICADOR_PLACES.limitar_concurrencia(n)
+
+
+def obtener_cache_places():
+    """Caché SQLite de búsquedas, una por proceso."""
+    global _cache_busquedas
+    with _lock_clientes:
+        if _cache_busquedas is None:
+            _cache_busquedas = CacheSQLite(ruta_datos("places_cache.sqlite3"), CACHE_TTL_SEG, CACHE_MAX_ENTRADAS)
+        return _cache_busquedas
+
+
+def obtener_cliente_places(api_key):
+    """
+    Devuelve el cliente del proceso para esa API key.
+    Vive a nivel de módulo, así que sobrevive a los reruns de Streamlit y se comparte entre sesiones.
+    """
+    cache = obtener_cache_places()
+    with _lock_clientes:
+        if api_key not in _clientes:
+            _clientes[api_key] = ClientePlaces(api_key, base_url=PLACES_BASE_URL, cache=cache)
+        return _clientes[api_key]
@@ -0,0 +1,164 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- PRIORIDADES ---
+# Menor número = se atiende antes. Las auditorías interactivas pasan delante de los lotes nocturnos.
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_LOTE = 10
+prioridad_actual = contextvars.ContextVar("prioridad_actual", default=PRIORIDAD_INTERACTIVA)
+
+# --- CUOTAS POR API (ajustables por entorno según el plan contratado) ---
+PLACES_RPM = int(os.environ.get("PLACES_RPM", 600))
+PLACES_CONCURRENCIA_MAX = int(os.environ.get("PLACES_CONCURRENCIA_MAX", 32))
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 1000))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", 4_000_000))
+GEMINI_CONCURRENCIA_MAX = int(os.environ.get("GEMINI_CONCURRENCIA_MAX", 16))
+COLA_MAX = 500  # con la cola llena, quien llega espera a que se libere lugar (backpressure)
+SEGUNDOS_DE_RAFAGA = 10  # el balde acepta ráfagas de hasta ~10 s de cuota
+
+
+class CuboTokens:
+    """Token bucket: se recarga a 'por_minuto' tokens por minuto, con una ráfaga máxima acotada."""
+
+    def __init__(self, por_minuto):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = max(1.0, self.tasa * SEGUNDOS_DE_RAFAGA)
+        self.disponible = self.capacidad
+        self._ultimo = time.monotonic()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self.disponible = min(self.capacidad, self.disponible + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def espera(self, n):
+        """Segundos hasta que haya n tokens (0 si ya hay)."""
+        self._recargar()
+        n = min(n, self.capacidad)  # un pedido más grande que el balde pasa cuando el balde está lleno
+        falta = n - self.disponible
+        return 0.0 if falta <= 0 else falta / self.tasa
+
+    def consumir(self, n):
+        """Descuenta n tokens. Puede quedar negativo (consumo informado después de la llamada)."""
+        self._recargar()
+        self.disponible -= n
+
+
+class Planificador:
+    """
+    Turnero por API compartido por todo el proceso (todas las sesiones de Streamlit y el runner batch).
+    - Respeta requests/min y, si se indica, tokens/min.
+    - Limita las llamadas simultáneas.
+    - Atiende por prioridad (y por orden de llegada dentro de la misma prioridad).
+    - En lugar de fallar, encola: quien supera la cuota espera su turno.
+    Expone profundidad de cola y tiempo de espera acumulado para monitoreo.
+    """
+
+    def __init__(self, nombre, rpm, max_concurrencia, tpm=None, max_cola=COLA_MAX):
+        self.nombre = nombre
+        self.max_concurrencia = max_concurrencia
+        self.max_cola = max_cola
+        self._rpm = CuboTokens(rpm)
+        self._tpm = CuboTokens(tpm) if tpm else None
+        self._cola = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._en_curso = 0
+        self._pausa_hasta = 0.0
+        self.atendidas = 0
+        self.frenadas = 0
+        self.espera_total_seg = 0.0
+        self.espera_max_seg = 0.0
+
+    def limitar_concurrencia(self, n):
+        with self._cond:
+            self.max_concurrencia = max(1, n)
+            self._cond.notify_all()
+
+    def frenar(self, segundos):
+        """
+        La API respondió 429: la cuota real se agotó antes que la nuestra. Nadie sale hasta que pasen
+        `segundos` y el balde arranca vacío, así los reintentos se reparten al ritmo de la recarga.
+        """
+        with self._cond:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            self._rpm.consumir(max(self._rpm.disponible, 0.0))
+            self.frenadas += 1
+            self._cond.notify_all()
+
+    def _espera_cuota(self, tokens):
+        espera = max(self._rpm.espera(1), self._pausa_hasta - time.monotonic())
+        if self._tpm and tokens:
+            espera = max(espera, self._tpm.espera(tokens))
+        return espera
+
+    @contextmanager
+    def turno(self, tokens=0, prioridad=None):
+        """Bloquea hasta que sea el turno de esta llamada; libera el lugar al salir del bloque."""
+        prioridad = prioridad_actual.get() if prioridad is None else prioridad
+        llegada = time.monotonic()
+        with self._cond:
+            while len(self._cola) >= self.max_cola:
+                self._cond.wait()
+            ticket = (prioridad, next(self._seq))
+            heapq.heappush(self._cola, ticket)
+            while True:
+                if self._cola[0] == ticket and self._en_curso < self.max_concurrencia:
+                    espera = self._espera_cuota(tokens)
+                    if espera <= 0:
+                        break
+                    self._cond.wait(timeout=espera)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._cola)
+            self._rpm.consumir(1)
+            if self._tpm and tokens:
+                self._tpm.consumir(tokens)
+            self._en_curso += 1
+            esperado = time.monotonic() - llegada
+            self.atendidas += 1
+            self.espera_total_seg += esperado
+            self.espera_max_seg = max(self.espera_max_seg, esperado)
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._en_curso -= 1
+                self._cond.notify_all()
+
+    def registrar_tokens(self, n):
+        """Descuenta tokens conocidos recién al final (ej. los de la respuesta del modelo)."""
+        if self._tpm and n:
+            with self._cond:
+                self._tpm.consumir(n)
+
+    def estado(self):
+        with self._cond:
+            return {
+                "api": self.nombre,
+                "en_cola": len(self._cola),
+                "en_curso": self._en_curso,
+                "atendidas": self.atendidas,
+                "frenadas": self.frenadas,
+                "espera_total_seg": round(self.espera_total_seg, 2),
+                "espera_max_seg": round(self.espera_max_seg, 2),
+            }
+
+
+PLANIFICADOR_PLACES = Planificador("places", PLACES_RPM, PLACES_CONCURRENCIA_MAX)
+PLANIFICADOR_GEMINI = Planificador("gemini", GEMINI_RPM, GEMINI_CONCURRENCIA_MAX, tpm=GEMINI_TPM)
+
+
+def estado_planificadores():
+    return [PLANIFICADOR_PLACES.estado(), PLANIFICADOR_GEMINI.estado()]
+
+
+def enviar(pool, fn, *args, **kwargs):
+    """pool.submit que conserva la prioridad del hilo que lanza la tarea (los hilos no heredan contextvars)."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
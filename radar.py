@@ -0,0 +1,1056 @@
+import json
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait, FIRST_COMPLETED, as_completed
+
+import numpy as np
+
+import geo
+from cache import hash_clave
+from coalescer import Coalescedor
+from historial import obtener_historial
+from indice_espacial import obtener_indice_espacial
+from constructor_prompt import (armar_texto_mercado, armar_lista_reseñas, deduplicar, partir_en_lotes,
+                                estimar_tokens, PRESUPUESTO_REPORTE, PRESUPUESTO_SOV, PRESUPUESTO_BRECHA_MERCADO,
+                                PRESUPUESTO_BRECHA_PROPIAS, PRESUPUESTO_LOTE_AUDITORIA)
+from modelos_ia import (consultar_gemini, consultar_gemini_stream, nombre_modelo, CONFIG_JSON, CONFIG_REPORTE,
+                        CONFIG_AUDITORIA, TIMEOUT_IA_SEG)
+from places_client import (obtener_cliente_places, CAMPOS_CANDIDATOS, CAMPOS_DIRECCION, CAMPOS_DETALLE,
+                           CAMPOS_LIGEROS, CAMPOS_PESADOS)
+from metricas import promedios, MIN_OPINIONES_LIDER
+from planificador import enviar
+from snapshots import obtener_almacen_snapshots, sin_cambios, hash_reseñas
+from sov_local import calcular_sov_local
+from trazas import trazado, tramo, traza
+
+# --- BÚSQUEDA EXHAUSTIVA (GRILLA) ---
+LADO_CELDA_MIN_KM = 0.5
+CELDAS_POR_LADO_MAX = 6  # grilla inicial de hasta 6x6 sobre el círculo
+PAGINAS_MAX_POR_CELDA = 3  # Places entrega como máximo 60 resultados (3 páginas de 20) por consulta
+PROFUNDIDAD_MAX = 2  # una celda saturada se parte en 4, hasta 2 veces
+CELDAS_MAX = 150
+CONCURRENCIA_PLACES = 8
+CONCURRENCIA_DETALLES = 20  # la fase 2 (≤ 18 Place Details) sale en una sola tanda
+RESULTADOS_MAX_API = 20
+
+# --- ÍNDICE ESPACIAL ---
+FRACCION_MIN_CUBIERTA = 0.5  # con menos de la mitad del círculo cubierto, conviene la búsqueda normal
+PESADOS_FALTANTES_MAX = 4  # si el índice no tiene las reseñas de más lugares, 1 búsqueda completa < N Place Details
+
+# --- TIEMPOS MÁXIMOS DE IA (segundos) ---
+TIMEOUT_SOV_SEG = 45
+
+# --- AUDITORÍA MAP-REDUCE ---
+CONCURRENCIA_IA_MAPA = 8
+LOTES_MAX_AUDITORIA = 32  # con más reseñas se toma una muestra sistemática de todo el archivo
+
+# --- FUNCIONES API GOOGLE ---
+
+@trazado("places.candidatos")
+def buscar_candidatos_negocio(query, api_key):
+    """Búsqueda por nombre de negocio (Modo 1)"""
+    data = {"textQuery": query, "pageSize": 5, "languageCode": "es"}
+    try:
+        return obtener_cliente_places(api_key).buscar_texto(data, CAMPOS_CANDIDATOS).get('places', [])
+    except Exception as e:
+        print(f"Error Places (candidatos): {e}")
+        return []
+
+
+@trazado("places.direccion")
+def validar_direccion(direccion_input, api_key):
+    data = {"textQuery": direccion_input, "pageSize": 1, "languageCode": "es"}
+    try:
+        lugares = obtener_cliente_places(api_key).buscar_texto(data, CAMPOS_DIRECCION).get('places', [])
+        if lugares: return lugares[0]
+        return None
+    except Exception as e:
+        print(f"Error Places (dirección): {e}")
+        return None
+
+
+@trazado("places.rubro")
+def buscar_mercado_por_rubro(lat, lng, rubro, radio_km, api_key, campos=CAMPOS_DETALLE, usar_cache=True):
+    """
+    Trae DETALLE de los primeros 20 para análisis cualitativo.
+    Si búsquedas anteriores (frescas, del mismo rubro) ya enumeraron la zona, responde desde el índice espacial
+    sin red; si la cubren en buena parte, sólo consulta a la API el rectángulo que falta. Desde el índice
+    se garantizan los campos ligeros: los pesados los completa completar_pesados para quienes los usan.
+    usar_cache=False siempre va a la API (y actualiza el índice).
+    """
+    if usar_cache:
+        desde_indice = _buscar_en_indice(lat, lng, rubro, radio_km, api_key, campos)
+        if desde_indice is not None:
+            return desde_indice
+    radio_metros = radio_km * 1000.0
+    parametros = {
+        "textQuery": rubro,
+        "pageSize": 20,
+        "languageCode": "es",
+        "locationBias": {
+            "circle": {
+                "center": {"latitude": lat, "longitude": lng},
+                "radius": radio_metros
+            }
+        }
+    }
+    try:
+        lugares = obtener_cliente_places(api_key).buscar_texto(parametros, campos, usar_cache).get('places', [])
+    except Exception as e:
+        print(f"Error Places (mercado): {e}")
+        return []
+    # Menos resultados que el tope: la API no tenía más, el círculo quedó enumerado por completo
+    completo = len(lugares) < RESULTADOS_MAX_API
+    indice = obtener_indice_espacial()
+    if completo:
+        celdas = geo.celdas_geohash_en_circulo(lat, lng, radio_km, indice.precision)
+        indice.registrar(lugares, rubro, campos, [c for c, entera in celdas.items() if entera], (lat, lng, radio_km))
+    else:
+        indice.registrar(lugares, rubro, campos)
+    return lugares
+
+
+def _buscar_en_indice(lat, lng, rubro, radio_km, api_key, campos):
+    """Lugares del índice (y de la API para lo que falte), o None si conviene la búsqueda normal."""
+    indice = obtener_indice_espacial()
+    pesados = [c for c in campos if c not in CAMPOS_LIGEROS]
+    campos = CAMPOS_LIGEROS
+    with tramo("indice.espacial") as t:
+        celdas, pendientes = indice.celdas_pendientes(lat, lng, radio_km, rubro, campos)
+        t.update(celdas=len(celdas), pendientes=len(pendientes))
+        if len(pendientes) > len(celdas) * (1 - FRACCION_MIN_CUBIERTA):
+            return None
+        if pendientes:
+            rect = geo.rect_de_celdas(pendientes, indice.precision)
+            try:
+                _, saturada = _buscar_celda(rubro, rect, api_key, campos)
+            except Exception as e:
+                print(f"Error Places (faltante): {e}")
+                return None
+            if saturada:
+                return None  # el faltante tenía más de lo que entrega una consulta: la respuesta no sería completa
+        lugares = indice.consultar(lat, lng, radio_km, rubro, campos)[:RESULTADOS_MAX_API]
+        faltantes = sum(indice.lugar_con_campos(l['id'], pesados) is None for l in lugares) if pesados else 0
+        t.update(lugares=len(lugares), pesados_faltantes=faltantes)
+        if faltantes > PESADOS_FALTANTES_MAX:
+            return None
+        return lugares
+
+
+def _buscar_celda(rubro, rect, api_key, campos=CAMPOS_DETALLE, usar_cache=True):
+    """Pagina una celda de la grilla. Devuelve (lugares, saturada)."""
+    cliente = obtener_cliente_places(api_key)
+    parametros = {"textQuery": rubro, "pageSize": 20, "languageCode": "es",
+                  "locationRestriction": {"rectangle": rect}}
+    lugares, hay_mas = cliente.buscar_texto_paginado(parametros, campos, PAGINAS_MAX_POR_CELDA, usar_cache)
+    # Places corta en 60 resultados sin devolver token en la última página: llegar al tope también es saturar.
+    # Una página posterior que falló también deja la celda incompleta (hay_mas): se subdivide como saturada.
+    saturada = hay_mas or len(lugares) >= PAGINAS_MAX_POR_CELDA * RESULTADOS_MAX_API
+    indice = obtener_indice_espacial()
+    cubiertas = () if saturada else geo.celdas_geohash_dentro_de_rect(rect, indice.precision)
+    indice.registrar(lugares, rubro, campos, cubiertas)
+    return lugares, saturada
+
+
+@trazado("places.exhaustivo")
+def buscar_mercado_exhaustivo(lat, lng, rubro, radio_km, api_key, campos=CAMPOS_LIGEROS, usar_cache=True):
+    """
+    Recorre todo el radio: lo parte en celdas, pagina cada una y consulta varias celdas a la vez.
+    Las celdas que llegan al tope de paginación se subdividen. Resultado deduplicado por id.
+    Por defecto sólo campos ligeros: los pesados se piden después para los pocos que los usan (completar_pesados).
+    """
+    lado_km = max(LADO_CELDA_MIN_KM, 2 * radio_km / CELDAS_POR_LADO_MAX)
+    celdas = geo.celdas_cubriendo_circulo(lat, lng, radio_km, lado_km)
+    por_id = {}
+    completas = []
+    circulo_completo = True
+    consultadas = 0
+    with ThreadPoolExecutor(max_workers=CONCURRENCIA_PLACES) as pool:
+        pendientes = {enviar(pool, _buscar_celda, rubro, c, api_key, campos, usar_cache): (c, 0) for c in celdas}
+        consultadas += len(pendientes)
+        while pendientes:
+            hechos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for fut in hechos:
+                celda, profundidad = pendientes.pop(fut)
+                try:
+                    lugares, saturada = fut.result()
+                except Exception as e:
+                    print(f"Error Places (celda): {e}")
+                    circulo_completo = False
+                    continue
+                for lugar in lugares:
+                    por_id.setdefault(lugar.get('id') or lugar.get('formattedAddress'), lugar)
+                if not saturada:
+                    completas.append(celda)
+                elif profundidad < PROFUNDIDAD_MAX:
+                    for sub in geo.subdividir(celda):
+                        if not geo.rect_toca_circulo(sub, lat, lng, radio_km):
+                            continue
+                        if consultadas >= CELDAS_MAX:
+                            circulo_completo = False
+                            continue
+                        pendientes[enviar(pool, _buscar_celda, rubro, sub, api_key, campos,
+                                          usar_cache)] = (sub, profundidad + 1)
+                        consultadas += 1
+                else:
+                    circulo_completo = False
+    # Cobertura de la grilla completa, incluidas las celdas del índice que cruzan el borde entre dos rectángulos
+    indice = obtener_indice_espacial()
+    indice.registrar([], rubro, campos, geo.celdas_geohash_cubiertas(completas, indice.precision),
+                     (lat, lng, radio_km) if circulo_completo else None)
+    # Sin un orden de relevancia global, priorizamos a los negocios con más opiniones
+    return sorted(por_id.values(), key=lambda x: x.get('userRatingCount', 0), reverse=True)
+
+
+def traer_detalles(ids, campos, api_key, usar_cache=True):
+    """Place Details en paralelo. Devuelve {id: campos pedidos}; los que fallan no aparecen."""
+    detalles = {}
+    if not ids:
+        return detalles
+    cliente = obtener_cliente_places(api_key)
+    with ThreadPoolExecutor(max_workers=min(len(ids), CONCURRENCIA_DETALLES)) as pool:
+        futuros = {enviar(pool, cliente.detalle_lugar, pid, campos, usar_cache): pid for pid in ids}
+        for fut in as_completed(futuros):
+            try:
+                detalles[futuros[fut]] = fut.result()
+            except Exception as e:
+                print(f"Error Places (detalle): {e}")
+    return detalles
+
+
+@trazado("places.pesados")
+def completar_pesados(lugares, ids, api_key, incremental=False):
+    """
+    Fase 2: campos pesados (reseñas, descripción, precio) sólo para `ids`, los lugares que los usan.
+    No se pide lo que ya se tiene: lo que trajo una búsqueda completa o el índice espacial, o en un refresco
+    incremental, lo que no cambió desde su snapshot (mismas opiniones y rating). El resto va por Place Details
+    en paralelo. Los campos ligeros recién traídos siempre pisan a los guardados.
+    """
+    indice = obtener_indice_espacial()
+    previos = obtener_almacen_snapshots().obtener(list(ids)) if incremental else {}
+    conocidos, faltan = {}, []
+    for lugar in lugares:
+        pid = lugar.get('id')
+        if pid not in ids:
+            continue
+        if incremental:
+            conocido = previos[pid]["lugar"] if pid in previos and sin_cambios(previos[pid], lugar) else None
+        else:
+            conocido = indice.lugar_con_campos(pid, CAMPOS_PESADOS)
+        if conocido is not None:
+            conocidos[pid] = conocido
+        else:
+            faltan.append(pid)
+    detalles = traer_detalles(faltan, CAMPOS_PESADOS, api_key, usar_cache=not incremental)
+    indice.completar(detalles, CAMPOS_PESADOS)
+    conocidos.update(detalles)
+    return [{**conocidos[l['id']], **l} if l.get('id') in conocidos else l for l in lugares]
+
+
+def buscar_mercado(lat, lng, rubro, radio_km, api_key, exhaustivo=False, incremental=False):
+    """
+    Fase 1 de un rubro. La búsqueda de 20 pide los campos pesados en la misma consulta (una sola consulta los trae
+    para todos; pedirlos aparte serían ~18 Place Details más). La exhaustiva y el refresco incremental van
+    con campos ligeros. incremental=True saltea cachés e índice para ver las opiniones de hoy.
+    """
+    if exhaustivo:
+        return buscar_mercado_exhaustivo(lat, lng, rubro, radio_km, api_key, CAMPOS_LIGEROS, not incremental)
+    return buscar_mercado_por_rubro(lat, lng, rubro, radio_km, api_key,
+                                    CAMPOS_LIGEROS if incremental else CAMPOS_DETALLE, not incremental)
+
+
+@trazado("places.multi_rubro")
+def buscar_mercado_multi_rubro(lat, lng, rubros, radio_km, api_key, exhaustivo=False, incremental=False):
+    """
+    Una búsqueda por rubro, todas en paralelo, en lugar de una sola query "A o B o C".
+    Fusiona por id guardando qué rubros encontraron a cada lugar (clave 'rubrosCoincidentes')
+    y reparte el cupo en partes iguales entre rubros para que ninguno quede tapado por otro.
+    """
+    if len(rubros) == 1:
+        lugares = buscar_mercado(lat, lng, rubros[0], radio_km, api_key, exhaustivo, incremental)
+        for lugar in lugares:
+            lugar['rubrosCoincidentes'] = [rubros[0]]
+        return lugares
+
+    with ThreadPoolExecutor(max_workers=min(len(rubros), CONCURRENCIA_PLACES)) as pool:
+        futuros = [enviar(pool, buscar_mercado, lat, lng, r, radio_km, api_key, exhaustivo, incremental)
+                   for r in rubros]
+        por_rubro = [f.result() for f in futuros]  # las funciones de búsqueda ya atrapan sus errores
+
+    # Índice por id: un lugar que aparece en varios rubros se guarda una vez
+    indice = {}
+    listas = []
+    for rubro, lugares in zip(rubros, por_rubro):
+        ids = []
+        for lugar in lugares:
+            pid = lugar.get('id') or lugar.get('formattedAddress')
+            if pid not in indice:
+                indice[pid] = {**lugar, 'rubrosCoincidentes': []}
+            if rubro not in indice[pid]['rubrosCoincidentes']:
+                indice[pid]['rubrosCoincidentes'].append(rubro)
+            ids.append(pid)
+        listas.append(ids)
+
+    # Cupo por rubro: se intercalan los resultados (round-robin) respetando el orden de cada búsqueda
+    total = None if exhaustivo else RESULTADOS_MAX_API
+    cupo = None if total is None else -(-total // len(rubros))
+    elegidos, vistos = [], set()
+    for ronda in range(max(len(l) for l in listas) if listas else 0):
+        for ids in listas:
+            if ronda >= len(ids) or (cupo is not None and ronda >= cupo):
+                continue
+            if ids[ronda] not in vistos:
+                vistos.add(ids[ronda])
+                elegidos.append(indice[ids[ronda]])
+    # Si algún rubro no llenó su cupo, completamos con lo que sobró del resto
+    if total is not None and len(elegidos) < total:
+        for ids in listas:
+            for pid in ids:
+                if pid not in vistos and len(elegidos) < total:
+                    vistos.add(pid)
+                    elegidos.append(indice[pid])
+    return elegidos if total is None else elegidos[:total]
+
+
+@trazado("places.target_y_competencia")
+def buscar_detalle_target_y_competencia(lugar_seleccionado, radio_km, api_key, exhaustivo=False, incremental=False):
+    """
+    Ficha completa del negocio elegido y su mercado. El candidato ya trae id, ubicación y rubro: la ficha
+    (Place Details por id) y la búsqueda del mercado salen a la vez. Sin id (ej. una fila vieja) se resuelve
+    primero por texto, como antes.
+    """
+    pid, loc = lugar_seleccionado.get('id'), lugar_seleccionado.get('location')
+    if not (pid and loc):
+        return _target_por_texto_y_competencia(lugar_seleccionado, radio_km, api_key, exhaustivo, incremental)
+    rubro = lugar_seleccionado.get('primaryTypeDisplayName', {}).get('text', 'Comercio')
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        fut_target = enviar(pool, obtener_cliente_places(api_key).detalle_lugar, pid, CAMPOS_DETALLE,
+                            not incremental)
+        mercado = buscar_mercado(loc['latitude'], loc['longitude'], rubro, radio_km, api_key, exhaustivo,
+                                 incremental)
+        try:
+            target_obj = fut_target.result()
+        except Exception as e:
+            print(f"Error Places (target): {e}")
+            return None, None, None
+    return target_obj, mercado, rubro
+
+
+def _target_por_texto_y_competencia(lugar_seleccionado, radio_km, api_key, exhaustivo, incremental):
+    nombre = lugar_seleccionado['displayName']['text']
+    direccion = lugar_seleccionado['formattedAddress']
+
+    try:
+        data_target = obtener_cliente_places(api_key).buscar_texto(
+            {"textQuery": f"{nombre} {direccion}", "pageSize": 1, "languageCode": "es"}, CAMPOS_DETALLE,
+            usar_cache=not incremental
+        ).get('places', [])
+    except Exception as e:
+        print(f"Error Places (target): {e}")
+        return None, None, None
+    if not data_target: return None, None, None
+
+    target_obj = data_target[0]
+    rubro = target_obj.get('primaryTypeDisplayName', {}).get('text', 'Comercio')
+    loc = target_obj.get('location', {})
+
+    mercado = buscar_mercado(loc['latitude'], loc['longitude'], rubro, radio_km, api_key, exhaustivo, incremental)
+
+    return target_obj, mercado, rubro
+
+
+# --- EJECUCIÓN CONCURRENTE ---
+
+def lanzar_en_paralelo(tareas):
+    """
+    Arranca tareas independientes en segundo plano y devuelve el lote para recogerlas después.
+    tareas: {nombre: (funcion, args, valor_por_defecto, timeout_seg)}
+    """
+    pool = ThreadPoolExecutor(max_workers=max(len(tareas), 1))
+    futuros = {nombre: enviar(pool, fn, *args) for nombre, (fn, args, _, _) in tareas.items()}
+    return {"pool": pool, "inicio": time.monotonic(), "tareas": tareas, "futuros": futuros}
+
+
+def recoger_resultados(lote):
+    """
+    Espera los resultados de un lote lanzado con lanzar_en_paralelo.
+    Si una tarea falla o se pasa de su timeout, devuelve su valor por defecto sin frenar al resto.
+    """
+    resultados = {}
+    for nombre, fut in lote["futuros"].items():
+        _, _, default, timeout = lote["tareas"][nombre]
+        restante = max(0.0, lote["inicio"] + timeout - time.monotonic())
+        try:
+            resultados[nombre] = fut.result(timeout=restante)
+        except FuturesTimeout:
+            print(f"Timeout IA ({nombre}): {timeout}s")
+            fut.cancel()
+            resultados[nombre] = default
+        except Exception as e:
+            print(f"Error IA ({nombre}): {e}")
+            resultados[nombre] = default
+    # No esperamos a los hilos colgados: su resultado ya fue reemplazado por el default
+    lote["pool"].shutdown(wait=False, cancel_futures=True)
+    return resultados
+
+
+def resultados_listos(lote, ya_tomados=()):
+    """Resultados de las tareas del lote que ya terminaron, sin esperar a las demás (una que falló da su default)."""
+    listos = {}
+    for nombre, fut in lote["futuros"].items():
+        if nombre in ya_tomados or not fut.done():
+            continue
+        try:
+            listos[nombre] = fut.result()
+        except Exception as e:
+            print(f"Error IA ({nombre}): {e}")
+            listos[nombre] = lote["tareas"][nombre][2]
+    return listos
+
+
+def ejecutar_en_paralelo(tareas):
+    """Corre tareas independientes al mismo tiempo y devuelve {nombre: resultado}."""
+    return recoger_resultados(lanzar_en_paralelo(tareas))
+
+
+# --- FUNCIONES IA (GEMINI) ---
+
+@trazado("ia.resumenes")
+def generar_resumenes_batch(lista_negocios, api_key, usar_cache=True):
+    partes = ["Analiza opiniones y resume en 1 frase (máx 20 palabras) cada ítem.\n"]
+    mapa = {}
+    for i, neg in enumerate(lista_negocios):
+        nom = neg.get('displayName', {}).get('text')
+        revs = " | ".join(list(deduplicar(r.get('text', {}).get('text', '') for r in neg.get('reviews', [])))[:5])
+        pid = f"ID_{i}"
+        partes.append(f"ITEM {pid} ({nom}): {revs or '(Sin datos)'}")
+        mapa[pid] = nom
+    partes.append("OUTPUT JSON: { 'ID_0': '...', ... }")
+    prompt = "\n".join(partes)
+    try:
+        res = json.loads(consultar_gemini(prompt, api_key, CONFIG_JSON, usar_cache=usar_cache))
+        if isinstance(res, list): res = {k: v for i in res for k, v in i.items()}
+        return {mapa[k]: v for k, v in res.items() if k in mapa}
+    except:
+        return {}
+
+
+def _hash_resumen(lugar):
+    """Lo que produjo un resumen: las reseñas, el modelo y su configuración (cambiar el modelo lo invalida)."""
+    return hash_clave(nombre_modelo(), CONFIG_JSON, hash_reseñas(lugar))
+
+
+@trazado("ia.resumenes_incrementales")
+def generar_resumenes_incrementales(lista_negocios, api_key, usar_cache=True):
+    """
+    Reutiliza el resumen guardado de cada lugar cuyas reseñas (y modelo) no cambiaron desde el snapshot;
+    sólo los lugares con reseñas nuevas (o sin resumen) van a generar_resumenes_batch.
+    usar_cache=False regenera todos.
+    """
+    almacen = obtener_almacen_snapshots()
+    previos = almacen.obtener([n.get('id') for n in lista_negocios]) if usar_cache else {}
+    reusados, nuevos = {}, []
+    for neg in lista_negocios:
+        snap = previos.get(neg.get('id'))
+        if snap and snap["resumen"] and snap["hash_resumen"] == _hash_resumen(neg):
+            reusados[neg.get('displayName', {}).get('text')] = snap["resumen"]
+        else:
+            nuevos.append(neg)
+    generados = generar_resumenes_batch(nuevos, api_key, usar_cache) if nuevos else {}
+    para_guardar = {}
+    for neg in nuevos:
+        nom = neg.get('displayName', {}).get('text')
+        if neg.get('id') and nom in generados:
+            para_guardar[neg['id']] = (generados[nom], _hash_resumen(neg))
+    almacen.guardar_resumenes(para_guardar)
+    return {**reusados, **generados}
+
+
+@trazado("ia.share_of_voice")
+def analizar_distribucion_topicos(texto, rubro, api_key, usar_cache=True, respaldo=None):
+    prompt = f"""
+    Analiza reseñas de {rubro}:
+    {texto}
+    Clasifica en 3 categorías y da % de Share of Voice.
+    1. Calidad (Producto/Servicio).
+    2. Conveniencia (Precio/Valor).
+    3. Atención (Servicio al cliente).
+    OUTPUT JSON: {{ "Calidad": int, "Conveniencia": int, "Atención": int }}
+    """
+    default_data = respaldo or {"Calidad": 33, "Conveniencia": 33, "Atención": 34}
+    try:
+        parsed = json.loads(consultar_gemini(prompt, api_key, CONFIG_JSON, TIMEOUT_SOV_SEG, usar_cache))
+        if isinstance(parsed, list):
+            if len(parsed) > 0 and isinstance(parsed[0], dict):
+                return parsed[0]
+            else:
+                return default_data
+        elif isinstance(parsed, dict):
+            return parsed
+        else:
+            return default_data
+    except:
+        return default_data
+
+
+def limpiar_fences_stream(fragmentos):
+    """
+    Quita los ```markdown / ``` de un texto que llega por partes.
+    Retiene la cola que podría ser el comienzo de un fence hasta que llegue el fragmento siguiente.
+    """
+    fence = "```markdown"
+    pendiente = ""
+    empezo = False
+    for frag in fragmentos:
+        pendiente += frag
+        retener = 0
+        for n in range(min(len(fence) - 1, len(pendiente)), 0, -1):
+            if fence.startswith(pendiente[-n:]):
+                retener = n
+                break
+        crudo = pendiente[:len(pendiente) - retener]
+        retener += len(crudo) - len(crudo.rstrip())  # el espacio final también espera: puede ser el cierre
+        listo = pendiente[:len(pendiente) - retener].replace(fence, "").replace("```", "")
+        pendiente = pendiente[len(pendiente) - retener:]
+        if not empezo:
+            listo = listo.lstrip()
+            empezo = bool(listo)
+        if listo:
+            yield listo
+    resto = pendiente.replace(fence, "").replace("```", "").rstrip()
+    if resto:
+        yield resto.lstrip() if not empezo else resto
+
+
+def generar_analisis_exhaustivo(texto_mercado, texto_lideres, rubro, api_key, usar_cache=True, stream=False):
+    """
+    Genera el reporte ejecutivo.
+    Con stream=True devuelve un generador de fragmentos de Markdown ya limpios (para st.write_stream).
+    CAMBIOS:
+    - Matriz con formato de lista de acciones (1. Empezar mañana...).
+    - Títulos más chicos.
+    - Sin emojis en la matriz.
+    - Basado 100% en evidencia del texto.
+    """
+    prompt = f"""
+    ROL: Estratega de Negocios Senior.
+    OBJETIVO: Decodificar el consumidor de **{rubro}** y definir prioridades basadas EXCLUSIVAMENTE en la evidencia leída.
+
+    DATOS:
+    [MERCADO]: {texto_mercado}
+    [LÍDERES]: {texto_lideres}
+
+    ---
+    INSTRUCCIONES DE ESTILO:
+    1. EMOJIS: Solo permitidos en los títulos principales (##). PROHIBIDOS en el resto.
+    2. FORMATO: Markdown profesional.
+    3. FUENTE: No inventes consejos genéricos. Si recomiendas algo, debe ser porque lo leíste en las reseñas.
+
+    ---
+    ESTRUCTURA DEL REPORTE:
+
+    ## 🧠 Psicología del Consumidor
+
+    * **Lo que obsesiona al cliente (Valores Positivos):** (Qué genera euforia según las reseñas).
+    * **Lo que irrita al cliente (Fricciones Reales):** (Qué quejas se repiten).
+
+    ### 🔥 Los 3 Motores de Decisión
+    1.  **[Driver 1]**: Explicación.
+    2.  **[Driver 2]**: Explicación.
+    3.  **[Driver 3]**: Explicación.
+
+    ## 🏆 Benchmarking: Lecciones de los Líderes
+    *(Usa la info de LÍDERES. Si no hay, indícalo).*
+
+    ### [Nombre del Negocio]
+    * **Por qué gana:** (Propuesta de valor).
+    * **Precios:** (Percepción del cliente).
+    * **Clave del éxito:** (Aprendizaje).
+
+    ### 💎 Hallazgo de Nicho
+    * **Insight:** [Detalle sutil valorado en la zona].
+
+    ## 🚀 Matriz de Priorización (Basada en Reseñas)
+
+    * **1. Empezar mañana [imperativo]:** (Cuál es la queja más grave y frecuente en la zona que se debe resolver YA. Sé específico).
+
+    * **2. Priorizar en las próximas semanas [diferencial]:** (Qué característica de los líderes es la que más envidian los clientes y deberíamos copiar).
+
+    * **3. No atender por ahora [ahorrar esfuerzo]:** (Menciona algo que los dueños suelen creer importante, pero que en estas reseñas NADIE mencionó o valoró. Ayuda a no gastar dinero en vano).
+    """
+
+    if stream:
+        return _stream_con_errores(limpiar_fences_stream(
+            consultar_gemini_stream(prompt, api_key, CONFIG_REPORTE, usar_cache=usar_cache)))
+    try:
+        texto = consultar_gemini(prompt, api_key, CONFIG_REPORTE, usar_cache=usar_cache)
+        return texto.replace("```markdown", "").replace("```", "").strip()
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def _stream_con_errores(fragmentos):
+    """Un corte a mitad del stream no rompe la página: se informa al final de lo ya mostrado."""
+    try:
+        yield from fragmentos
+    except Exception as e:
+        yield f"\n\nError: {e}"
+
+
+@trazado("ia.brecha")
+def analizar_brecha_mercado_vs_archivo(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache=True):
+    prompt = f"""
+    Auditor CX Gap Analysis para {nombre}.
+    Mercado: {texto_mercado}
+    Negocio: {armar_lista_reseñas(reviews_propias, PRESUPUESTO_BRECHA_PROPIAS)}
+
+    Regla Ponderación: <10% quejas = ✅, 10-30% = ⚠️, >30% = ❌.
+
+    Reporte Markdown:
+    ## ⚖️ Auditoría: Realidad vs Expectativa
+    ### 1. Matriz Cumplimiento
+    | Exigencia | Desempeño (Resumen + 1 Cita) | Veredicto |
+    | :--- | :--- | :--- |
+    | [Exigencia 1] | ... | ... |
+    | [Exigencia 2] | ... | ... |
+    ### 2. Análisis
+    * Fortaleza: ...
+    * Mejora: ...
+    ### 3. Veredicto Final
+    Alineado/Desalineado porque...
+    """
+    try:
+        texto = consultar_gemini(prompt, api_key, CONFIG_AUDITORIA, usar_cache=usar_cache)
+        return texto.replace("```markdown", "").replace("```", "").strip()
+    except Exception as e:
+        return f"Error: {e}"
+
+
+@trazado("ia.exigencias")
+def extraer_exigencias(texto_mercado, rubro, api_key, usar_cache=True):
+    """Lista corta de exigencias del mercado (la misma vara para todos los lotes del map-reduce)."""
+    prompt = f"""
+    Analiza reseñas de {rubro}:
+    {texto_mercado}
+    Lista las 3 a 6 exigencias principales que el cliente de esta zona le hace a un negocio de este rubro.
+    Nombres cortos (2 a 4 palabras).
+    OUTPUT JSON: ["...", "..."]
+    """
+    try:
+        res = json.loads(consultar_gemini(prompt, api_key, CONFIG_JSON, usar_cache=usar_cache))
+        if isinstance(res, dict): res = next((v for v in res.values() if isinstance(v, list)), [])
+        return [str(e) for e in res if e][:6]
+    except Exception as e:
+        print(f"Error IA (exigencias): {e}")
+        return []
+
+
+@trazado("ia.lote_auditoria")
+def _auditar_lote(lote, exigencias, api_key, usar_cache):
+    """MAP: cuenta menciones y quejas por exigencia dentro de un lote de reseñas."""
+    reseñas = "\n".join(f"[{i + 1}] {t}" for i, t in enumerate(lote))
+    prompt = f"""
+    Eres auditor CX. Exigencias del mercado: {json.dumps(exigencias, ensure_ascii=False)}
+    Reseñas del negocio ({len(lote)}):
+    {reseñas}
+
+    Para CADA exigencia: cuántas reseñas la mencionan, cuántas de esas son quejas,
+    y una cita textual breve representativa.
+    OUTPUT JSON: {{ "<exigencia>": {{ "menciones": int, "quejas": int, "cita": "..." }}, ... }}
+    """
+    res = json.loads(consultar_gemini(prompt, api_key, CONFIG_JSON, usar_cache=usar_cache))
+    if isinstance(res, list): res = res[0] if res and isinstance(res[0], dict) else {}
+    # El modelo puede devolver la exigencia con otra capitalización, tildes o espacios: se compara normalizada
+    por_clave = {_clave_exigencia(k): v for k, v in res.items() if isinstance(v, dict)}
+    faltan = [e for e in exigencias if _clave_exigencia(e) not in por_clave]
+    if faltan:
+        # Un lote sin todas las exigencias no se cuenta como "nadie la menciona": se informa como fallido
+        raise ValueError(f"respuesta sin las exigencias {faltan} (claves: {list(res)})")
+    return {e: por_clave[_clave_exigencia(e)] for e in exigencias}
+
+
+def _clave_exigencia(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    return " ".join(re.findall(r"\w+", "".join(c for c in texto if not unicodedata.combining(c))))
+
+
+def _veredicto(pct_quejas):
+    if pct_quejas is None: return "Sin datos"
+    if pct_quejas < 10: return "✅"
+    if pct_quejas <= 30: return "⚠️"
+    return "❌"
+
+
+def auditar_brecha_map_reduce(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache=True,
+                              progreso=None):
+    """
+    Auditoría sobre TODAS las reseñas del archivo:
+    - MAP: los lotes (por tokens) se analizan en paralelo con concurrencia acotada.
+    - REDUCE: se suman menciones/quejas por exigencia y se aplica la regla de ponderación.
+    Un lote que falla no tumba el reporte: se informa la cobertura real.
+    """
+    exigencias = extraer_exigencias(texto_mercado, rubro, api_key, usar_cache)
+    if not exigencias:
+        return analizar_brecha_mercado_vs_archivo(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache)
+
+    total_archivo = len(reviews_propias)
+    lotes = partir_en_lotes(reviews_propias, PRESUPUESTO_LOTE_AUDITORIA)
+    muestreo = len(lotes) > LOTES_MAX_AUDITORIA
+    if muestreo:
+        # Muestra sistemática: cubre el archivo de punta a punta, no sólo el principio
+        tamano = len(reviews_propias) * LOTES_MAX_AUDITORIA // len(lotes)
+        elegidas = np.linspace(0, len(reviews_propias) - 1, tamano).round().astype(int)
+        lotes = partir_en_lotes([reviews_propias[i] for i in elegidas], PRESUPUESTO_LOTE_AUDITORIA)
+        if len(lotes) > LOTES_MAX_AUDITORIA:
+            # Lotes de distinto largo pueden pasarse del tope: se eligen parejos, sin cortar el final
+            lotes = [lotes[i] for i in np.linspace(0, len(lotes) - 1, LOTES_MAX_AUDITORIA).round().astype(int)]
+
+    agregado = {e: {"menciones": 0, "quejas": 0, "citas": []} for e in exigencias}
+    ok, fallidos, analizadas = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=CONCURRENCIA_IA_MAPA) as pool:
+        futuros = {enviar(pool, _auditar_lote, lote, exigencias, api_key, usar_cache): len(lote) for lote in lotes}
+        for i, fut in enumerate(as_completed(futuros)):
+            try:
+                parcial = fut.result()
+                # Se valida el lote entero antes de sumar: uno con un conteo ilegible no deja sumas a medias
+                conteos = {e: (int(d.get("menciones", 0) or 0), int(d.get("quejas", 0) or 0), d.get("cita"))
+                           for e, d in parcial.items()}
+                for e, (menciones, quejas, cita) in conteos.items():
+                    agregado[e]["menciones"] += menciones
+                    agregado[e]["quejas"] += quejas
+                    if cita: agregado[e]["citas"].append(str(cita))
+                ok += 1
+                analizadas += futuros[fut]
+            except Exception as e:
+                print(f"Error IA (lote auditoría): {e}")
+                fallidos += 1
+            if progreso: progreso((i + 1) / len(futuros))
+
+    if ok == 0:
+        return "Error: no se pudo auditar ningún lote del archivo."
+
+    # REDUCE
+    filas = []
+    for e, d in agregado.items():
+        menciones = max(d["menciones"], d["quejas"])
+        pct = round(100 * d["quejas"] / menciones, 1) if menciones else None
+        cita = f' — "{d["citas"][0]}"' if d["citas"] else ""
+        desempeño = f"{pct}% quejas ({d['quejas']} de {menciones} menciones){cita}" if pct is not None \
+            else "Nadie la menciona en el archivo."
+        filas.append((e, desempeño.replace("|", "/"), _veredicto(pct), pct))
+
+    tabla = "\n".join(f"| {e} | {d} | {v} |" for e, d, v, _ in filas)
+    cobertura = f"Se analizaron {analizadas:,} reseñas en {ok} lotes"
+    if muestreo: cobertura += f" (muestra sistemática de un archivo de {total_archivo:,})"
+    if fallidos: cobertura += f". {fallidos} lotes fallaron y no se contabilizaron"
+    matriz = (f"## ⚖️ Auditoría: Realidad vs Expectativa\n*{cobertura}.*\n\n"
+              f"### 1. Matriz Cumplimiento\n| Exigencia | Desempeño (Resumen + 1 Cita) | Veredicto |\n"
+              f"| :--- | :--- | :--- |\n{tabla}\n")
+
+    prompt = f"""
+    Auditor CX para {nombre} ({rubro}). Resultado agregado de todas sus reseñas:
+    {tabla}
+    Regla Ponderación: <10% quejas = ✅, 10-30% = ⚠️, >30% = ❌.
+    Escribe SOLO esto en Markdown:
+    ### 2. Análisis
+    * Fortaleza: ...
+    * Mejora: ...
+    ### 3. Veredicto Final
+    Alineado/Desalineado porque...
+    """
+    try:
+        sintesis = consultar_gemini(prompt, api_key, CONFIG_AUDITORIA, usar_cache=usar_cache)
+        sintesis = sintesis.replace("```markdown", "").replace("```", "").strip()
+    except Exception as e:
+        print(f"Error IA (síntesis auditoría): {e}")
+        medidas = [f for f in filas if f[3] is not None]
+        mejor = min(medidas, key=lambda f: f[3])[0] if medidas else "-"
+        peor = max(medidas, key=lambda f: f[3])[0] if medidas else "-"
+        alineado = not any(v == "❌" for _, _, v, _ in filas)
+        sintesis = (f"### 2. Análisis\n* Fortaleza: {mejor}\n* Mejora: {peor}\n"
+                    f"### 3. Veredicto Final\n{'Alineado' if alineado else 'Desalineado'} "
+                    f"según la regla de ponderación.")
+    return matriz + "\n" + sintesis
+
+
+@trazado("auditoria_privada")
+def auditar_brecha(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache=True, progreso=None):
+    """Si las reseñas entran en un solo prompt, una llamada; si no, map-reduce sobre el archivo completo."""
+    if sum(estimar_tokens(t) + 1 for t in reviews_propias) <= PRESUPUESTO_BRECHA_PROPIAS:
+        return analizar_brecha_mercado_vs_archivo(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache)
+    return auditar_brecha_map_reduce(texto_mercado, reviews_propias, nombre, rubro, api_key, usar_cache, progreso)
+
+
+# --- PIPELINE DE AUDITORÍA (sin interfaz: lo usan la app y el runner batch) ---
+SOV_NEUTRO = {"Calidad": 33, "Conveniencia": 33, "Atención": 34}
+REPORTE_VACIO = "No se pudo generar el reporte."
+MAX_LISTA_VISUAL = 15
+
+
+ESPERA_MERCADO_SEG = 180  # por encima de una búsqueda exhaustiva lenta (grilla + reintentos + detalles)
+_vuelos_mercado = Coalescedor("mercado", ESPERA_MERCADO_SEG)
+
+
+def clave_objetivo(params):
+    """Qué se audita, sin el radio: mismo lugar/dirección y mismas categorías (sin importar orden)."""
+    data = params["data"]
+    if params["type"] == "negocio":
+        lugar = data.get("id") or [data.get("displayName", {}).get("text"), data.get("formattedAddress")]
+    else:
+        loc = data.get("location", {})
+        lugar = [round(loc.get("latitude", 0), 5), round(loc.get("longitude", 0), 5)]
+    rubros = sorted({r.strip().lower() for r in params.get("rubro") or []})
+    return hash_clave(params["type"], lugar, rubros)
+
+
+def clave_mercado(params, exhaustivo=False):
+    """Parámetros normalizados de la búsqueda: objetivo + radio + modo."""
+    return hash_clave(clave_objetivo(params), round(float(params["radio"]), 2), bool(exhaustivo))
+
+
+@trazado("mercado")
+def obtener_mercado(params, api_key, exhaustivo=False, incremental=False):
+    """
+    Paso 1 (Places). params: {"type": "negocio"|"rubro", "data": lugar o dirección validada,
+    "radio": km, "rubro": [categorías] (sólo modo rubro)}.
+    Devuelve los datos crudos del mercado, o None si no hay información suficiente.
+    Pedidos idénticos simultáneos (ej. un equipo abriendo el mismo link) comparten una sola búsqueda.
+    incremental=True refresca sobre los snapshots de auditorías anteriores (reseñas sólo de lo que cambió).
+    """
+    clave = clave_mercado(params, exhaustivo)
+    return _vuelos_mercado.ejecutar(hash_clave(clave, incremental), _obtener_mercado, clave, params, api_key,
+                                    exhaustivo, incremental)
+
+
+def _obtener_mercado(clave, params, api_key, exhaustivo, incremental):
+    target_obj = None
+    if params["type"] == "negocio":
+        target_obj, mercado_data, rubro_final_str = buscar_detalle_target_y_competencia(
+            params["data"], params["radio"], api_key, exhaustivo=exhaustivo, incremental=incremental
+        )
+        if not target_obj:
+            return None
+        det = f"Negocio: {target_obj.get('displayName', {}).get('text')}"
+        lat_central = target_obj['location']['latitude']
+        lng_central = target_obj['location']['longitude']
+    else:
+        loc = params["data"]["location"]
+        lista_rubros = params["rubro"]
+        rubro_final_str = " o ".join(lista_rubros)
+        lat_central = loc['latitude']
+        lng_central = loc['longitude']
+        mercado_data = buscar_mercado_multi_rubro(
+            lat_central, lng_central, lista_rubros, params["radio"], api_key, exhaustivo=exhaustivo,
+            incremental=incremental
+        )
+        det = f"Rubros: {rubro_final_str} en {params['data']['formattedAddress']}"
+
+    # Radio estricto: lo que cae fuera no compite ni gasta tokens en los prompts
+    mercado_data, fuera_de_radio = geo.filtrar_por_radio(mercado_data or [], lat_central, lng_central,
+                                                         params["radio"])
+    if not mercado_data:
+        return None
+    # Fase 2: campos pesados sólo para la lista visual y los líderes
+    mercado_data = completar_pesados(mercado_data, ids_con_pesados(target_obj, mercado_data), api_key, incremental)
+    # Snapshot de cada lugar: el próximo refresco incremental compara contra esto
+    obtener_almacen_snapshots().guardar_lugares(mercado_data + ([target_obj] if target_obj else []))
+    registrar_historial(clave, mercado_data, target_obj)
+    return {"target": target_obj, "mercado": mercado_data, "rubro": rubro_final_str, "detalle": det,
+            "lat": lat_central, "lng": lng_central, "fuera_de_radio": fuera_de_radio, "clave": clave}
+
+
+@trazado("historial.registrar")
+def registrar_historial(clave, mercado_data, target_obj):
+    """Foto del mercado para las tendencias. Si falla el disco la auditoría sigue igual."""
+    id_objetivo = target_obj.get('id') if target_obj else None
+    lugares = mercado_data if not target_obj or any(m.get('id') == id_objetivo for m in mercado_data) \
+        else [target_obj] + mercado_data
+    try:
+        obtener_historial().registrar(clave, lugares, id_objetivo)
+    except Exception as e:
+        print(f"Error historial: {e}")
+
+
+def unificar_lista(target_obj, mercado_data):
+    """El objetivo primero y después el mercado, sin repetir direcciones."""
+    lista_final = []
+    vistos = set()
+    if target_obj:
+        lista_final.append(target_obj)
+        vistos.add(target_obj.get('formattedAddress'))
+    for m in mercado_data:
+        if m.get('formattedAddress') not in vistos:
+            lista_final.append(m)
+            vistos.add(m.get('formattedAddress'))
+    return lista_final
+
+
+def elegir_lideres(mercado_data):
+    """Top 3 por rating entre los que tienen volumen de opiniones suficiente."""
+    candidatos_lideres = [m for m in mercado_data if m.get('userRatingCount', 0) >= MIN_OPINIONES_LIDER]
+    candidatos_lideres.sort(key=lambda x: x.get('rating', 0), reverse=True)
+    return candidatos_lideres[:3]
+
+
+def ids_con_pesados(target_obj, mercado_data):
+    """Lugares que usan campos pesados: la lista visual (reseñas) y los líderes (descripción, precio, reseñas)."""
+    usados = unificar_lista(target_obj, mercado_data)[:MAX_LISTA_VISUAL] + elegir_lideres(mercado_data)
+    return {l.get('id') for l in usados} - {None}
+
+
+@trazado("preparar")
+def preparar_analisis(datos):
+    """Paso 2 (sin red): lista visual, líderes y textos de los prompts."""
+    target_obj, mercado_data = datos["target"], datos["mercado"]
+
+    # UNIFICAR LISTA VISUAL
+    lista_final = unificar_lista(target_obj, mercado_data)
+    lista_visual = lista_final[:MAX_LISTA_VISUAL]
+
+    # LÍDERES
+    bloques_lideres = []
+    for i, l in enumerate(elegir_lideres(mercado_data)):
+        nom = l.get('displayName', {}).get('text', 'N/A')
+        rt = l.get('rating', 0)
+        cnt = l.get('userRatingCount', 0)
+        desc = l.get('editorialSummary', {}).get('text', 'Sin descripción.')
+        precio = l.get('priceLevel', 'N/A')
+        revs = " ".join(list(deduplicar(r.get('text', {}).get('text', '') for r in l.get('reviews', [])))[:3])
+        bloques_lideres.append(f"""
+                [LÍDER {i + 1}]
+                Nombre: {nom}
+                Rating: {rt} ({cnt} reviews)
+                Descripción: {desc}
+                Precio: {precio}
+                Opiniones recientes: {revs}
+                """)
+
+    # TEXTO MERCADO (presupuesto de tokens repartido entre competidores, sin reseñas repetidas)
+    t_name = target_obj.get('displayName', {}).get('text') if target_obj else "Tu Negocio"
+    excluir = t_name if target_obj else None
+    return {
+        **datos,
+        "lista_final": lista_final,
+        "lista_visual": lista_visual,
+        "nombre_target": t_name,
+        "excluir": excluir,
+        "texto_lideres": "".join(bloques_lideres) if bloques_lideres else "No hay líderes consolidados.",
+        "texto_mercado": armar_texto_mercado(lista_visual, PRESUPUESTO_REPORTE, excluir),
+        "texto_mercado_sov": armar_texto_mercado(lista_visual, PRESUPUESTO_SOV, excluir),
+        "texto_mercado_brecha": armar_texto_mercado(lista_visual, PRESUPUESTO_BRECHA_MERCADO, excluir),
+    }
+
+
+@trazado("kpis")
+def calcular_kpis(datos, exhaustivo=False):
+    """Métricas de la muestra (sobre la lista visual) y cantidad total de negocios en el radar."""
+    lista_visual = datos["lista_visual"]
+    rating = np.array([n.get('rating', 0) for n in lista_visual], dtype=float)
+    opiniones = np.array([n.get('userRatingCount', 0) for n in lista_visual], dtype=np.int64)
+    reseñas_leidas = np.array([len(n.get('reviews', [])) for n in lista_visual], dtype=np.int64)
+    prom_simple, prom_ponderado = promedios(rating, opiniones)
+
+    label_negocios = f"{len(datos['lista_final'])}"
+    if not exhaustivo and len(datos["mercado"]) >= RESULTADOS_MAX_API: label_negocios = "20 (Máx. API)"
+    return {
+        "negocios": len(datos["lista_final"]),
+        "label_negocios": label_negocios,
+        "prom_simple": prom_simple,
+        "prom_ponderado": prom_ponderado,
+        "total_reviews": int(opiniones.sum()),
+        "total_reviews_analizadas": int(reseñas_leidas.sum()),
+    }
+
+
+def tareas_ia(datos, api_key, usar_cache=True, confirmar_sov_ia=False, incluir_reporte=True, sov_respaldo=None):
+    """Tareas IA independientes entre sí, listas para lanzar_en_paralelo."""
+    tareas = {
+        "resumenes": (generar_resumenes_incrementales, (datos["lista_visual"], api_key, usar_cache), {},
+                      TIMEOUT_IA_SEG),
+    }
+    if incluir_reporte:
+        tareas["reporte"] = (generar_analisis_exhaustivo,
+                             (datos["texto_mercado"], datos["texto_lideres"], datos["rubro"], api_key, usar_cache),
+                             REPORTE_VACIO, TIMEOUT_IA_SEG)
+    if confirmar_sov_ia:
+        respaldo = sov_respaldo or SOV_NEUTRO
+        tareas["topicos"] = (analizar_distribucion_topicos,
+                             (datos["texto_mercado_sov"], datos["rubro"], api_key, usar_cache, respaldo),
+                             respaldo, TIMEOUT_SOV_SEG)
+    return tareas
+
+
+def resumen_lugar(lugar, nombre_target=None):
+    """Fila compacta y serializable de un lugar (para tablas, JSONL y Parquet)."""
+    nom = lugar.get('displayName', {}).get('text')
+    es_target = bool(nombre_target) and nom == nombre_target
+    return {
+        "id": lugar.get('id'),
+        "negocio": nom,
+        "rating": lugar.get('rating', 0.0),
+        "opiniones": lugar.get('userRatingCount', 0),
+        "distancia_km": 0.0 if es_target else lugar.get('distanciaKm'),
+        "tipo": "MI NEGOCIO" if es_target else "COMPETENCIA",
+        "rubros": lugar.get('rubrosCoincidentes', []),
+        "link": lugar.get('googleMapsUri', '#'),
+    }
+
+
+def ejecutar_auditoria(params, google_api_key, gemini_api_key, exhaustivo=False, usar_cache=True,
+                       confirmar_sov_ia=False, reseñas_propias=None, incremental=False):
+    """
+    Pipeline completo sin interfaz: Places -> textos -> IA en paralelo (-> auditoría privada).
+    Devuelve un dict serializable, o None si no hay información suficiente.
+    Cada corrida deja su traza por etapa en el archivo de métricas (el id queda en el resultado).
+    """
+    with traza("auditoria", tipo=params["type"], radio=params["radio"], exhaustivo=exhaustivo) as actual:
+        resultado = _ejecutar_auditoria(params, google_api_key, gemini_api_key, exhaustivo, usar_cache,
+                                        confirmar_sov_ia, reseñas_propias, incremental)
+    if resultado is not None:
+        resultado["traza"] = actual.id
+    return resultado
+
+
+def _ejecutar_auditoria(params, google_api_key, gemini_api_key, exhaustivo, usar_cache, confirmar_sov_ia,
+                        reseñas_propias, incremental):
+    datos = obtener_mercado(params, google_api_key, exhaustivo, incremental)
+    if not datos:
+        return None
+    datos = preparar_analisis(datos)
+
+    with tramo("sov_local"):
+        dist_topicos = calcular_sov_local(datos["lista_visual"], datos["excluir"]) or SOV_NEUTRO
+    fuente_sov = "local"
+    res_ia = {"resumenes": {}, "reporte": REPORTE_VACIO}
+    if gemini_api_key:
+        res_ia = ejecutar_en_paralelo(tareas_ia(datos, gemini_api_key, usar_cache, confirmar_sov_ia,
+                                                sov_respaldo=dist_topicos))
+        if confirmar_sov_ia and res_ia["topicos"] is not dist_topicos:
+            dist_topicos, fuente_sov = res_ia["topicos"], "ia"
+
+    auditoria = None
+    if reseñas_propias and gemini_api_key:
+        auditoria = auditar_brecha(datos["texto_mercado_brecha"], reseñas_propias, "Tu Archivo", datos["rubro"],
+                                   gemini_api_key, usar_cache)
+
+    return armar_resultado(datos, calcular_kpis(datos, exhaustivo), res_ia["resumenes"], res_ia["reporte"],
+                           dist_topicos, fuente_sov, auditoria)
+
+
+def armar_resultado(datos, kpis, resumenes, reporte, topicos, fuente_sov, auditoria=None):
+    """Resultado de una auditoría: serializable y suficiente para volver a dibujarla sin tocar la red."""
+    return {
+        "rubro": datos["rubro"],
+        "detalle": datos["detalle"],
+        "lat": datos["lat"],
+        "lng": datos["lng"],
+        "fuera_de_radio": datos["fuera_de_radio"],
+        "kpis": kpis,
+        "lugares": [resumen_lugar(l, datos["excluir"]) for l in datos["lista_visual"]],
+        "resumenes": resumenes,
+        "reporte": reporte,
+        "topicos": topicos,
+        "fuente_sov": fuente_sov,
+        "auditoria": auditoria,
+    }
@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import threading
+import time
+
+from cache import hash_clave, ruta_datos
+
+# --- SNAPSHOTS DE LUGARES (refresco incremental) ---
+# Por place id: rating, userRatingCount, hashes de las reseñas, el lugar completo y el último resumen IA.
+# Un refresco compara los campos baratos contra el snapshot y sólo vuelve a pedir reseñas de lo que cambió.
+
+
+def hash_reseñas(lugar):
+    """Hash estable del conjunto de reseñas de un lugar (el resource name de cada reseña, o su texto)."""
+    claves = sorted(r.get('name') or r.get('text', {}).get('text', '') for r in lugar.get('reviews', []))
+    return hash_clave(claves)
+
+
+class AlmacenSnapshots:
+    """Snapshots sobre SQLite (WAL), seguro entre hilos y procesos como la caché."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS lugares ("
+            " id TEXT PRIMARY KEY, rating REAL, opiniones INTEGER, hash_reseñas TEXT, lugar TEXT NOT NULL,"
+            " resumen TEXT, hash_resumen TEXT, actualizado REAL NOT NULL)"
+        )
+        self._con.commit()
+
+    def obtener(self, ids):
+        """{id: snapshot} de los ids que ya tienen uno."""
+        ids = [i for i in ids if i]
+        if not ids:
+            return {}
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            filas = self._con.execute(
+                f"SELECT id, rating, opiniones, hash_reseñas, lugar, resumen, hash_resumen, actualizado "
+                f"FROM lugares WHERE id IN ({marcas})", ids).fetchall()
+        return {f[0]: {"rating": f[1], "opiniones": f[2], "hash_reseñas": f[3], "lugar": json.loads(f[4]),
+                       "resumen": f[5], "hash_resumen": f[6], "actualizado": f[7]} for f in filas}
+
+    def guardar_lugares(self, lugares):
+        """Guarda lugares completos (con reseñas). No pisa el resumen IA ya guardado."""
+        ahora = time.time()
+        filas = [(l['id'], l.get('rating'), l.get('userRatingCount', 0), hash_reseñas(l),
+                  json.dumps({k: v for k, v in l.items() if k not in ('distanciaKm', 'rubrosCoincidentes')},
+                             ensure_ascii=False), ahora)
+                 for l in lugares if l.get('id') and 'reviews' in l]
+        with self._lock:
+            self._con.executemany(
+                "INSERT INTO lugares (id, rating, opiniones, hash_reseñas, lugar, actualizado) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET rating = excluded.rating, opiniones = excluded.opiniones,"
+                " hash_reseñas = excluded.hash_reseñas, lugar = excluded.lugar, actualizado = excluded.actualizado",
+                filas)
+            self._con.commit()
+
+    def guardar_resumenes(self, resumenes):
+        """resumenes: {id: (resumen, hash de las reseñas con que se generó)}."""
+        with self._lock:
+            self._con.executemany("UPDATE lugares SET resumen = ?, hash_resumen = ? WHERE id = ?",
+                                  [(r, h, i) for i, (r, h) in resumenes.items()])
+            self._con.commit()
+
+
+def sin_cambios(snapshot, ligero):
+    """True si los campos baratos del lugar coinciden con el snapshot (mismas opiniones y mismo rating)."""
+    return (snapshot["opiniones"] == ligero.get('userRatingCount', 0)
+            and snapshot["rating"] == ligero.get('rating'))
+
+
+_almacen = None
+_lock_almacen = threading.Lock()
+
+
+def obtener_almacen_snapshots():
+    """Almacén de snapshots, uno por proceso."""
+    global _almacen
+    with _lock_almacen:
+        if _almacen is None:
+            _almacen = AlmacenSnapshots(ruta_datos("snapshots.sqlite3"))
+        return _almacen
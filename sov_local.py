@@ -0,0 +1,121 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# --- SHARE OF VOICE LOCAL (LÉXICO) ---
+# Raíces en minúscula y sin tildes: un token cuenta para la categoría si empieza con alguna raíz.
+# Las palabras cortas que son prefijo de otras ("cara" de "característica", "lento" de "lentejas") van aparte,
+# en PALABRAS_SOV, y sólo cuentan como token completo.
+CATEGORIAS_SOV = ["Calidad", "Conveniencia", "Atención"]
+LEXICO_SOV = {
+    "Calidad": [
+        "riquisim", "delicios", "sabor", "sabros", "fresc", "calidad", "exquisit", "insipid",
+        "ingredient", "producto", "variedad", "crujient", "esponjos", "casero", "casera", "elaborad", "cocin",
+        "coccion", "quemad", "crudo", "cruda", "rancio", "limpi", "sucio", "sucia", "higien",
+        "ambiente", "comod", "decoracion", "musica", "calentit", "recomendabl", "gusto", "horrend",
+    ],
+    "Conveniencia": [
+        "precio", "barat", "carisim", "costo", "costos", "econom", "valor", "pagar", "pague",
+        "promo", "oferta", "descuent", "abundant", "porcion", "cantidad", "accesibl", "tarjeta", "efectivo",
+        "cuota", "mercadopago", "estacionamiento", "ubicacion", "ubicad", "cerca", "horario", "abiert",
+        "cerrad", "delivery", "envio", "pedido", "retirar", "relacion", "inflacion",
+    ],
+    "Atención": [
+        "atencion", "atendi", "atiend", "amabl", "simpatic", "cordial", "trato", "mozo", "moza", "camarer",
+        "personal", "empleado", "vendedor", "duen", "espera", "demor", "lentitud", "rapid", "tarda",
+        "grosero", "grosera", "servicial", "predispuest", "maleducad", "ignor", "recepcion", "atento", "atenta",
+        "educad", "paciencia", "malhumor", "sonris", "calidez", "respuesta",
+    ],
+}
+PALABRAS_SOV = {
+    "Calidad": ["rico", "rica", "ricos", "ricas", "feo", "fea", "feos", "feas"],
+    "Conveniencia": ["caro", "cara", "caros", "caras", "vale", "valen", "plata"],
+    "Atención": ["lento", "lenta", "lentos", "lentas", "lentamente"],
+}
+TAM_RAIZ_MIN = 3
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _indice_raices():
+    """raíz -> índice de categoría, ordenado de más larga a más corta (gana la más específica)."""
+    pares = [(raiz, i) for i, cat in enumerate(CATEGORIAS_SOV) for raiz in LEXICO_SOV[cat]]
+    return sorted(pares, key=lambda p: -len(p[0]))
+
+
+_RAICES = _indice_raices()
+_PALABRAS = {palabra: i for i, cat in enumerate(CATEGORIAS_SOV) for palabra in PALABRAS_SOV[cat]}
+
+
+def _categoria_token(token):
+    if token in _PALABRAS:
+        return _PALABRAS[token]
+    for raiz, idx in _RAICES:
+        if token.startswith(raiz):
+            return idx
+    return -1
+
+
+def puntajes_por_reseña(textos):
+    """
+    Matriz (n_reseñas x 3) con la cantidad de términos de cada categoría por reseña.
+    El vocabulario se clasifica una sola vez (palabras únicas) y el conteo es una sola operación NumPy.
+    """
+    n = len(textos)
+    matriz = np.zeros((n, len(CATEGORIAS_SOV)))
+    tokens_por_reseña = [re.findall(r"[a-z]+", _normalizar(t)) for t in textos]
+    largos = np.fromiter((len(t) for t in tokens_por_reseña), dtype=np.int64, count=n)
+    if largos.sum() == 0:
+        return matriz
+    planos = np.array([tok for toks in tokens_por_reseña for tok in toks])
+    fila = np.repeat(np.arange(n), largos)
+    vocab, inversa = np.unique(planos, return_inverse=True)
+    cat_vocab = np.fromiter((_categoria_token(t) if len(t) >= TAM_RAIZ_MIN else -1 for t in vocab),
+                            dtype=np.int64, count=len(vocab))
+    cats = cat_vocab[inversa]
+    hay = cats >= 0
+    np.add.at(matriz, (fila[hay], cats[hay]), 1)
+    return matriz
+
+
+def _a_porcentajes(totales):
+    """Enteros que suman 100 (método del mayor resto)."""
+    if totales.sum() <= 0:
+        return None
+    crudos = 100 * totales / totales.sum()
+    enteros = np.floor(crudos).astype(int)
+    faltan = 100 - enteros.sum()
+    for i in np.argsort(-(crudos - enteros))[:faltan]:
+        enteros[i] += 1
+    return {cat: int(v) for cat, v in zip(CATEGORIAS_SOV, enteros)}
+
+
+def calcular_sov_local(negocios, excluir_nombre=None, ponderar=True):
+    """
+    Share of Voice (Calidad / Conveniencia / Atención) sin IA, en milisegundos.
+    Cada reseña reparte 1 punto entre las categorías que menciona. Con ponderar=True,
+    las reseñas de cada negocio pesan según su userRatingCount (un local con 2.000 opiniones
+    representa más voz del mercado que uno con 15). Devuelve None si no hay señal suficiente.
+    """
+    textos, pesos = [], []
+    for neg in negocios:
+        if excluir_nombre and neg.get('displayName', {}).get('text') == excluir_nombre:
+            continue
+        revs = [r.get('text', {}).get('text', '') for r in neg.get('reviews', [])]
+        revs = [t for t in revs if t]
+        if not revs:
+            continue
+        peso = (neg.get('userRatingCount', 0) or 1) / len(revs) if ponderar else 1.0
+        textos.extend(revs)
+        pesos.extend([peso] * len(revs))
+    if not textos:
+        return None
+
+    matriz = puntajes_por_reseña(textos)
+    sumas = matriz.sum(axis=1, keepdims=True)
+    share = np.divide(matriz, sumas, out=np.zeros_like(matriz), where=sumas > 0)
+    return _a_porcentajes((share * np.asarray(pesos)[:, None]).sum(axis=0))
@@ -0,0 +1,129 @@
+"""Cola de notificaciones contra un servidor SMTP local (aiosmtpd): lotes, conexión reutilizada y reintentos."""
+import email
+import email.policy
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import notificaciones
+from notificaciones import ColaNotificaciones
+
+
+class Buzon:
+    """Handler de aiosmtpd que guarda los mensajes y cuenta las conexiones (un EHLO por conexión)."""
+
+    def __init__(self, rechazar=0):
+        self.mensajes = []
+        self.conexiones = 0
+        self.rechazar = rechazar
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.conexiones += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.rechazar:
+            self.rechazar -= 1
+            return "451 Error temporal, reintentar"
+        self.mensajes.append(email.message_from_bytes(envelope.content, policy=email.policy.default))
+        return "250 OK"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def servidor():
+    controladores = []
+
+    def levantar(**kwargs):
+        buzon = Buzon(**kwargs)
+        controlador = Controller(buzon, hostname="127.0.0.1", port=_puerto_libre())
+        controlador.start()
+        controladores.append(controlador)
+        return buzon, controlador.port
+
+    yield levantar
+    for controlador in controladores:
+        controlador.stop()
+
+
+@pytest.fixture(autouse=True)
+def sin_backoff(monkeypatch):
+    monkeypatch.setattr(notificaciones, "BACKOFF_SEG", 0)
+
+
+def _lead(i):
+    return {"usuario_email": f"user{i}@mail.com", "tipo_busqueda": "negocio", "detalle": f"Negocio {i}",
+            "coordenadas": "(-31.42, -64.18)", "radio": 1.0}
+
+
+def _cola(port, ventana_seg=0.3):
+    return ColaNotificaciones("radar@mail.com", None, destinatario="leads@mail.com", host="127.0.0.1", port=port,
+                              starttls=False, ventana_seg=ventana_seg)
+
+
+def test_leads_de_una_ventana_salen_en_un_solo_mail(servidor):
+    buzon, port = servidor()
+    cola = _cola(port, ventana_seg=1)
+    for i in range(3):
+        assert cola.encolar(_lead(i))
+    cola.detener(timeout=10)
+    assert len(buzon.mensajes) == 1
+    assert buzon.mensajes[0]["Subject"].startswith("🔔 3 nuevos Leads")
+    assert cola.enviados == 3 and cola.fallidos == 0
+
+
+def test_lotes_sucesivos_reutilizan_la_conexion(servidor):
+    buzon, port = servidor()
+    cola = _cola(port, ventana_seg=0.05)
+    for i in range(3):
+        cola.encolar(_lead(i))
+        _esperar(lambda: cola.enviados == i + 1)
+    cola.detener(timeout=10)
+    assert len(buzon.mensajes) == 3
+    assert buzon.conexiones == 1
+
+
+def test_error_temporal_se_reintenta_reconectando(servidor):
+    buzon, port = servidor(rechazar=2)
+    cola = _cola(port, ventana_seg=0.05)
+    cola.encolar(_lead(0))
+    cola.detener(timeout=10)
+    assert len(buzon.mensajes) == 1
+    assert buzon.conexiones == 3  # cada reintento descarta la conexión y abre otra
+    assert cola.enviados == 1 and cola.fallidos == 0
+
+
+def test_lote_que_no_se_puede_armar_no_mata_al_worker(servidor, monkeypatch):
+    buzon, port = servidor()
+    original = notificaciones.armar_mensaje
+    llamadas = []
+
+    def armar_que_falla_una_vez(leads, remitente, destinatario):
+        llamadas.append(len(leads))
+        if len(llamadas) == 1:
+            raise UnicodeEncodeError("ascii", "contraseña", 6, 7, "ordinal not in range(128)")
+        return original(leads, remitente, destinatario)
+
+    monkeypatch.setattr(notificaciones, "armar_mensaje", armar_que_falla_una_vez)
+    cola = _cola(port, ventana_seg=0.05)
+    cola.encolar(_lead(0))
+    _esperar(lambda: cola.fallidos == 1)
+    cola.encolar(_lead(1))
+    cola.detener(timeout=10)
+    assert cola.fallidos == 1 and cola.enviados == 1
+    assert len(buzon.mensajes) == 1
+
+
+def _esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "timeout esperando al worker"
+        time.sleep(0.01)
@@ -0,0 +1,199 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from cache import ruta_datos
+from planificador import estado_planificadores
+
+# --- TRAZAS LIVIANAS POR ETAPA ---
+# Cada auditoría abre una traza; cada etapa o llamada a una API abre un tramo dentro de ella.
+# Los tramos guardan duración y los atributos que cargue quien mide (bytes, tokens, cache_hit...).
+# La traza viaja en un contextvar: los hilos lanzados con planificador.enviar la heredan.
+# RADAR_METRICAS: "jsonl" (una línea por traza), "prom" (texto Prometheus), "ambos" o "no".
+METRICAS_FORMATO = os.environ.get("RADAR_METRICAS", "jsonl").lower()
+ARCHIVO_TRAZAS = "trazas.jsonl"
+ARCHIVO_PROMETHEUS = "metricas.prom"
+ATRIBUTOS_SUMABLES = ("bytes", "tokens_entrada", "tokens_salida")
+
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+_tramo_actual = contextvars.ContextVar("tramo_actual", default=None)
+_ids = itertools.count(1)
+
+
+class Traza:
+    def __init__(self, nombre, **atributos):
+        self.id = uuid.uuid4().hex[:12]
+        self.nombre = nombre
+        self.atributos = atributos
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.duracion_ms = None
+        self.tramos = []
+        self._lock = threading.Lock()
+
+    def agregar(self, tramo):
+        with self._lock:
+            self.tramos.append(tramo)
+
+    def a_dict(self):
+        with self._lock:
+            tramos = sorted(self.tramos, key=lambda t: t["desde_ms"])
+        return {"traza": self.id, "nombre": self.nombre, "inicio": self.inicio, "duracion_ms": self.duracion_ms,
+                "atributos": self.atributos, "tramos": tramos}
+
+
+class _Agregado:
+    """Totales por nombre de tramo desde que arrancó el proceso (lo que se exporta a Prometheus)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.por_tramo = {}
+
+    def sumar(self, nombre, duracion_seg, atributos, error):
+        with self._lock:
+            d = self.por_tramo.setdefault(nombre, {"cantidad": 0, "segundos": 0.0, "errores": 0, "cache_hits": 0,
+                                                   **{a: 0 for a in ATRIBUTOS_SUMABLES}})
+            d["cantidad"] += 1
+            d["segundos"] += duracion_seg
+            d["errores"] += int(error)
+            d["cache_hits"] += int(bool(atributos.get("cache_hit")))
+            for a in ATRIBUTOS_SUMABLES:
+                d[a] += int(atributos.get(a) or 0)
+
+    def copia(self):
+        with self._lock:
+            return {k: dict(v) for k, v in self.por_tramo.items()}
+
+
+_agregado = _Agregado()
+_lock_archivos = threading.Lock()
+
+
+@contextmanager
+def tramo(nombre, **atributos):
+    """
+    Mide un bloque. Devuelve el dict de atributos para que el bloque agregue lo que sepa:
+        with tramo("places.searchText") as t:
+            ...
+            t["bytes"] = len(resp.content)
+    """
+    traza = _traza_actual.get()
+    id_tramo = next(_ids)
+    padre = _tramo_actual.get()
+    marca = _tramo_actual.set(id_tramo)
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield atributos
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        try:
+            _tramo_actual.reset(marca)
+        except ValueError:
+            pass  # generador retomado desde otro contexto: el tramo se registra igual
+        fin = time.perf_counter()
+        _agregado.sumar(nombre, fin - t0, atributos, error is not None)
+        if traza is not None:
+            traza.agregar({"id": id_tramo, "padre": padre, "tramo": nombre,
+                           "desde_ms": round((t0 - traza._t0) * 1000, 1), "duracion_ms": round((fin - t0) * 1000, 1),
+                           "hilo": threading.current_thread().name, "error": error,
+                           **{k: v for k, v in atributos.items() if v is not None}})
+
+
+def trazado(nombre):
+    """Decorador: la función completa es un tramo."""
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            with tramo(nombre):
+                return fn(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def abrir_traza(nombre, **atributos):
+    """Abre la traza de una auditoría: los tramos que siguen (en este hilo y sus tareas) quedan adentro."""
+    actual = Traza(nombre, **atributos)
+    actual._marca = _traza_actual.set(actual)
+    return actual
+
+
+def cerrar_traza(actual):
+    """Cierra la traza y la escribe en los archivos de métricas."""
+    try:
+        _traza_actual.reset(actual._marca)
+    except ValueError:
+        _traza_actual.set(None)
+    actual.duracion_ms = round((time.perf_counter() - actual._t0) * 1000, 1)
+    exportar(actual)
+    return actual
+
+
+@contextmanager
+def traza(nombre, **atributos):
+    actual = abrir_traza(nombre, **atributos)
+    try:
+        yield actual
+    finally:
+        cerrar_traza(actual)
+
+
+def exportar(actual):
+    if METRICAS_FORMATO == "no":
+        return
+    try:
+        with _lock_archivos:
+            if METRICAS_FORMATO in ("jsonl", "ambos"):
+                with open(ruta_datos(ARCHIVO_TRAZAS), "a", encoding="utf-8") as f:
+                    f.write(json.dumps(actual.a_dict(), ensure_ascii=False, default=str) + "\n")
+            if METRICAS_FORMATO in ("prom", "ambos"):
+                escribir_prometheus(ruta_datos(ARCHIVO_PROMETHEUS))
+    except OSError as e:
+        print(f"Error métricas: {e}")
+
+
+def texto_prometheus():
+    """Totales del proceso en formato de exposición de Prometheus (sirve para el textfile collector)."""
+    lineas = []
+    series = [
+        ("radar_tramo_segundos_total", "counter", "Tiempo acumulado por tramo.", "segundos"),
+        ("radar_tramo_total", "counter", "Cantidad de tramos medidos.", "cantidad"),
+        ("radar_tramo_errores_total", "counter", "Tramos que terminaron en excepción.", "errores"),
+        ("radar_tramo_cache_hits_total", "counter", "Tramos resueltos desde caché.", "cache_hits"),
+        ("radar_tramo_bytes_total", "counter", "Bytes recibidos de las APIs.", "bytes"),
+        ("radar_tramo_tokens_entrada_total", "counter", "Tokens estimados enviados a la IA.", "tokens_entrada"),
+        ("radar_tramo_tokens_salida_total", "counter", "Tokens estimados recibidos de la IA.", "tokens_salida"),
+    ]
+    agregado = _agregado.copia()
+    for metrica, tipo, ayuda, campo in series:
+        lineas += [f"# HELP {metrica} {ayuda}", f"# TYPE {metrica} {tipo}"]
+        for nombre, d in sorted(agregado.items()):
+            lineas.append(f'{metrica}{{tramo="{nombre}"}} {round(d[campo], 4)}')
+    estados = estado_planificadores()
+    for metrica, ayuda, campo in [("radar_api_en_cola", "Llamadas esperando turno.", "en_cola"),
+                                  ("radar_api_en_curso", "Llamadas en curso.", "en_curso"),
+                                  ("radar_api_espera_segundos_total", "Espera acumulada por cuota.",
+                                   "espera_total_seg")]:
+        lineas += [f"# HELP {metrica} {ayuda}", f"# TYPE {metrica} gauge"]
+        lineas += [f'{metrica}{{api="{e["api"]}"}} {e[campo]}' for e in estados]
+    return "\n".join(lineas) + "\n"
+
+
+def escribir_prometheus(ruta):
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(texto_prometheus())
+    os.replace(temporal, ruta)  # el collector nunca ve un archivo a medio escribir
+
+
+def totales():
+    """Totales por tramo desde que arrancó el proceso."""
+    return _agregado.copia()